@@ -19,6 +19,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ninjashop.middleware.InstrumentationMiddleware',
+    'ninjashop.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,11 +50,60 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'django_ninja.wsgi.application'
 
+# Кэш ответов каталога может быть своим в каждом процессе: версии пространств имен хранятся в базе
+# (CacheVersion), поэтому после изменения ни один процесс не отдает устаревший ответ
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ninjashop',
+    },
+}
+
+CATALOG_CACHE_ALIAS = 'default'
+
+CATALOG_CACHE_TIMEOUT = 300
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            # Блокировка на запись берется в начале транзакции, а не при первом INSERT,
+            # иначе конкурирующие писатели получают database is locked без ожидания
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Тестовая база в файле, а не в памяти: так блокировки и WAL работают как в рабочей базе
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    },
+    # Отдельное соединение только для чтения к тому же файлу (в режиме WAL читатели не ждут писателя)
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+DATABASE_ROUTERS = ['ninjashop.db.ReadReplicaRouter']
+
+DATABASE_READ_ALIAS = 'replica'
+
+SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
 }
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -84,4 +135,56 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_URL = 'media/'
+
+MEDIA_ROOT = BASE_DIR
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+NINJA_PAGINATION_PER_PAGE = 50
+
+PAGINATION_MAX_LIMIT = 200
+
+EXPORT_CHUNK_SIZE = 2000
+
+# auto — FTS5 на SQLite, иначе поиск запросом к базе; memory — индекс в памяти одного процесса (тесты)
+SEARCH_BACKEND = 'auto'
+
+ORDER_TOTAL_AUTO_UPDATE = True
+
+AUTH_CACHE_TTL = 300
+
+AUTH_CACHE_SIZE = 1024
+
+# Права кэшируются в каждом процессе отдельно: после отзыва права другие процессы
+# могут разрешать операцию еще до PERMISSION_CACHE_TTL секунд; 0 — без кэша
+PERMISSION_CACHE_TTL = 60
+
+IMAGE_VARIANTS = { 'thumb': 200, 'medium': 800 }
+
+IMAGE_WORKERS = 2
+
+IMPORT_BATCH_SIZE = 1000
+
+BATCH_MAX_SIZE = 100
+
+PRICE_FACET_BOUNDS = [1000, 5000, 10000, 50000, 100000]
+
+# Server-Timing раскрывает время запросов к базе: True — всем, 'staff' — только сотрудникам, False — никому
+METRICS_SERVER_TIMING = DEBUG
+
+JSON_RENDERER = 'auto'
+
+COMPRESSION_LEVELS = { 'gzip': 3, 'br': 4, 'zstd': 3 }
+
+COMPRESSION_MIN_SIZE = 1024
+
+COMPRESSION_TYPES = ('application/json', 'application/x-ndjson')
+
+RATE_LIMIT_ENABLED = True
+
+RATE_LIMIT_BACKEND = 'memory'
+
+RATE_LIMITS = {}
+
+CONCURRENCY_LIMITS = {}
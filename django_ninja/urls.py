@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path
 from ninjashop.api import api
@@ -5,4 +7,4 @@ from ninjashop.api import api
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', api.urls),
-]
+] + static(settings.MEDIA_URL + 'images/', document_root = settings.MEDIA_ROOT / 'images')
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Product, Wishlist, Order, OrderItem, Status
+from .models import Category, Product, Wishlist, Order, OrderItem, Status, ApiToken
 
 
 admin.site.register(Status)
@@ -30,4 +30,10 @@ class OrderItemAdmin(admin.StackedInline):
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'created_at', 'status', 'total']
     inlines = [OrderItemAdmin]
-admin.site.register(Order, OrderAdmin)
\ No newline at end of file
+admin.site.register(Order, OrderAdmin)
+
+
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'name', 'created_at']
+    readonly_fields = ['digest']
+admin.site.register(ApiToken, ApiTokenAdmin)
\ No newline at end of file
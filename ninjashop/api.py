@@ -1,148 +1,162 @@
-from ninja import NinjaAPI, Schema
-from pydantic import EmailStr
-from .models import Category, Product, Wishlist, Order, OrderItem, Status
+from .models import Category, Product, Wishlist, Order, OrderItem, Status, ApiToken
 from ninja import UploadedFile, File
 from django.shortcuts import get_object_or_404
 from typing import List
-from django.contrib.auth import authenticate
-from ninja.security import HttpBasicAuth
-from ninja.errors import HttpError, AuthenticationError
+from ninja.errors import HttpError
 from django.contrib.auth.models import User
 from ninja import Query
 from django.core.exceptions import PermissionDenied
 from django.contrib.auth.decorators import permission_required
+from django.conf import settings
 from django.http import HttpResponse
+from django.db.models import Count, F, Sum
 from .decorator import *
+from .schemas import *
+from .queries import optimize_queryset, fetch_in_order
+from .fieldsets import projected_queryset
+from .catalog import filter_products, product_facets
+from ninja.pagination import paginate
+from .export import stream_export
+from .search import get_search_index
+from .pagination import KeysetPagination, PAGINATION_MAX_LIMIT, paged_schema
+from .cache import cached_response, conditional_response
+from .services import place_order, change_wishlist_quantity, apply_wishlist_deltas, upsert_wishlist, check_wishlist_owner
+from .auth import BasicAuth, TokenAuth, token_digest, generate_token
+from .api_async import router as async_router
+from .images import save_product_image
+from .imports import IMPORT_FORMATS, import_products, parse_rows
+from .metrics import InstrumentedAPI, registry
+from .throttling import concurrency_limit, rate_limit
+from .renderers import renderer
 
 
-class BasicAuth(HttpBasicAuth):
-    def authenticate(self, request, username, password):
-        user = authenticate(username = username, password = password)
-        if user:
-            return user
-        raise AuthenticationError('Ошибка авторизации!')
+BATCH_MAX_SIZE = getattr(settings, 'BATCH_MAX_SIZE', 100)
 
+paginator = KeysetPagination()
 
-api = NinjaAPI(csrf = True, auth = BasicAuth())
-    
-
-@api.get('/basic', auth = BasicAuth(), summary = 'Авторизация')
-def authentication(request):
-    return { 'Сообщение': 'Пользователь авторизован!', 'Логин пользователя': request.auth.username }
-
-
-class CategoryIn(Schema):
-    name: str
-    slug: str
-
-
-class CategoryOut(Schema):
-    id: int
-    name: str
-    slug: str
-
-
-class ProductIn(Schema):
-    name: str
-    slug: str
-    category: str
-    description: str
-    price: float 
+FIELDS_DESCRIPTION = 'Поля ответа через запятую, вложенные через точку: id,name,category.slug'
 
 
-class ProductOut(Schema):
-    id: int
-    name: str
-    slug: str
-    category: CategoryOut
-    description: str
-    price: float
+def check_batch_size(keys):
+    if len(keys) > BATCH_MAX_SIZE:
+        raise HttpError(400, f'За один запрос можно получить не более { BATCH_MAX_SIZE } объектов!')
 
 
-class UserAuth(Schema):
-    username: str
-    password: str
-
-
-class UserRegistration(Schema):
-    username: str
-    last_name: str
-    first_name: str
-    email: EmailStr
-    password1: str
-    password2: str
+api = InstrumentedAPI(csrf = True, auth = [TokenAuth(), BasicAuth()], renderer = renderer)
+api.add_router('/async', async_router)
     
 
-class UserOut(Schema):
-    username: str
-    last_name: str
-    first_name: str
-    email: str
-    is_active: bool
+@api.get('/basic', auth = BasicAuth(), summary = 'Авторизация')
+def authentication(request):
+    return { 'Сообщение': 'Пользователь авторизован!', 'Логин пользователя': request.auth.username }
 
 
-class WishlistIn(Schema):
-    user: int
-    product: int
-    quantity: int
+@api.get('/metrics', summary = 'Метрики производительности в формате Prometheus')
+def metrics(request):
+    if not request.auth.is_staff:
+        return HttpResponse('У вас недостаточно прав для совершения данной операции!', status = 403)
+    return HttpResponse(registry.render(), content_type = 'text/plain; version=0.0.4; charset=utf-8')
 
 
-class WishlistOut(Schema):
-    product: ProductOut
-    quantity: int
+@api.post('/tokens', response = TokenOut, summary = 'Выпустить API-токен')
+def create_token(request, payload: TokenIn):
+    '''Токен показывается один раз, в базе хранится только его хеш'''
+    token = generate_token()
+    api_token = ApiToken.objects.create(user = request.auth, name = payload.name, digest = token_digest(token))
+    return { 'id': api_token.id, 'name': api_token.name, 'token': token }
 
 
-class StatusOut(Schema):
-    name: str
+@api.delete('/tokens/{token_id}', summary = 'Отозвать API-токен')
+def delete_token(request, token_id: int):
+    api_token = get_object_or_404(ApiToken, id = token_id, user = request.auth)
+    api_token.delete()
+    return { 'Успешно!': 'Токен был отозван!' }
 
 
-class OrderOut(Schema):
-    status: StatusOut
-    total: float
+@api.get('/categories', response = List[CategoryOut], summary = 'Получить список категорий')
+@conditional_response(['categories'])
+@cached_response(['categories'], paged_schema(CategoryOut), validate = False)
+@paginate(KeysetPagination)
+@values_for(CategoryOut)
+def list_categories(request, fields: str = Query(None, description = FIELDS_DESCRIPTION)):
+    return Category.objects.all()
 
 
-class OrderIn(Schema):
-    user: int
-    status: int
-    total: float
+@api.get('/products', response = ProductPageOut, summary = 'Получить список товаров с фильтрами и фасетами')
+@conditional_response(['categories', 'products'])
+@cached_response(['categories', 'products'], ProductPageOut, validate = False)
+def list_products(
+    request,
+    filters: ProductFilter = Query(...),
+    pagination: KeysetPagination.Input = Query(...),
+    fields: str = Query(None, description = FIELDS_DESCRIPTION),
+    facets: bool = Query(False, description = 'Добавить в ответ число товаров по категориям и диапазонам цены')
+):
+    '''Фильтры комбинируются; фасеты считаются по всем товарам, подходящим под фильтры, а не по странице'''
+    queryset = filter_products(Product.objects.all(), filters)
+    page = paginator.paginate_queryset(projected_queryset(queryset, ProductOut, fields), pagination)
+    if facets:
+        page['facets'] = product_facets(queryset)
+    return page
 
 
-class OrderItemOut(Schema):
-    order: OrderOut
-    product: ProductOut
-    cost: float
-    quantity: int
+@api.get('/categories/batch', response = CategoryBatchOut, summary = 'Получить несколько категорий по списку slug')
+def get_categories_batch(request, slugs: List[str] = Query(..., description = 'slug категорий, например ?slugs=a&slugs=b')):
+    check_batch_size(slugs)
+    items, missing = fetch_in_order(Category.objects.all(), slugs, 'slug')
+    return { 'items': items, 'missing': missing }
 
 
-class OrderItemIn(Schema):
-    order: int
-    product: int
-    cost: float
-    quantity: int
+@api.get('/categories/{category_slug}', response = CategoryOut, summary = 'Получить категорию по slug')
+@conditional_response(['categories'])
+@cached_response(['categories'], CategoryOut)
+def get_category(request, category_slug: str):
+    return get_object_or_404(Category, slug = category_slug)
 
 
-@api.get('/categories', response = List[CategoryOut], summary = 'Получить список категорий')
-def list_categories(request):
-    return Category.objects.all()
+@api.get('/products/search', response = List[ProductOut], summary = 'Полнотекстовый поиск товаров по названию и описанию')
+@rate_limit('60/m')
+@concurrency_limit(8)
+def search_products(request, q: str = Query(..., min_length = 1, description = 'Строка поиска'), limit: int = Query(20, ge = 1, le = PAGINATION_MAX_LIMIT)):
+    '''Результаты упорядочены по релевантности, каждое слово запроса ищется по префиксу'''
+    product_ids = get_search_index().search(q, limit = limit)
+    products = optimize_queryset(Product.objects.all(), ProductOut).in_bulk(product_ids)
+    return [products[product_id] for product_id in product_ids if product_id in products]
 
 
-@api.get('/products', response = List[ProductOut], summary = 'Получить список товаров')
-def list_products(request):
-    return Product.objects.all()
+@api.post('/products/import', response = ImportOut, summary = 'Массовый импорт товаров (JSON, NDJSON, CSV)')
+@check_permission(['ninjashop.add_product', 'ninjashop.change_product'], raise_exception = True, use_auth = True)
+@concurrency_limit(2)
+def import_products_view(request, format: str = None):
+    '''Формат берется из параметра format или из Content-Type; существующие товары обновляются по slug'''
+    if format is None:
+        content_type = request.content_type or ''
+        format = 'csv' if 'csv' in content_type else 'ndjson' if 'ndjson' in content_type else 'json'
+    if format not in IMPORT_FORMATS:
+        raise HttpError(400, f'Неподдерживаемый формат! Доступны: { ", ".join(IMPORT_FORMATS) }')
+    return import_products(parse_rows(request, format))
 
 
-@api.get('/categories/{category_slug}', response = CategoryOut, summary = 'Получить категорию по slug')
-def get_category(request, category_slug: str):
-    return get_object_or_404(Category, slug = category_slug)
+@api.get('/products/batch', response = ProductBatchOut, summary = 'Получить несколько товаров по списку id')
+def get_products_batch(request, ids: List[int] = Query(..., description = 'id товаров, например ?ids=1&ids=2')):
+    '''Товары возвращаются в порядке запроса, ненайденные id перечислены в missing'''
+    check_batch_size(ids)
+    items, missing = fetch_in_order(optimize_queryset(Product.objects.all(), ProductOut), ids)
+    return { 'items': items, 'missing': missing }
 
 
 @api.get('/products/{product_id}', response = ProductOut, summary = 'Получить товар по id')
+@conditional_response(['categories', 'product:{product_id}'])
+@cached_response(['categories', 'product:{product_id}'], ProductOut)
 def get_product(request, product_id: int):
-    return get_object_or_404(Product, id = product_id)
+    return get_object_or_404(optimize_queryset(Product.objects.all(), ProductOut), id = product_id)
 
 
 @api.get('/products/{category_slug}/', response = List[ProductOut], summary = 'Получить список товаров по категории')
-def get_products_of_category(request, category_slug: str):
+@rendered_response
+@paginate(KeysetPagination)
+@values_for(ProductOut)
+def get_products_of_category(request, category_slug: str, fields: str = Query(None, description = FIELDS_DESCRIPTION)):
     category = get_object_or_404(Category, slug = category_slug)
     products = Product.objects.filter(category = category)
     return products
@@ -161,8 +175,7 @@ def create_product(request, payload: ProductIn, image: UploadedFile = File(...))
     payload_dict = payload.dict()
     category = get_object_or_404(Category, slug = payload_dict.pop('category'))
     product = Product(**payload_dict, category = category)
-    product.image.save(image.name, image) 
-    return product
+    return save_product_image(product, image)
 
 
 @api.put('/products/{product_id}', response = ProductOut, summary = 'Изменить информацию о товаре')
@@ -196,6 +209,8 @@ def delete_product(request, product_id: int):
 
 
 @api.post('/registration', summary = 'Регистрация пользователя')
+@rate_limit('5/m', key = 'ip')
+@concurrency_limit(4)
 def registration_user(request, payload: UserRegistration):
     if User.objects.filter(username = payload.username).exists():
         raise HttpError(400, 'Пользователь с таким именем уже существует!')
@@ -211,11 +226,14 @@ def registration_user(request, payload: UserRegistration):
 
 @api.get('/users', response = List[UserOut], summary = 'Просмотр информации о пользователях')
 @check_permission('auth.view_user', raise_exception = True, use_auth = True)
+@paginate(KeysetPagination)
 def users(request):    
     return User.objects.all()
     
 
 @api.get('/products_sort', response = List[ProductOut], summary = 'Сортировка товаров по цене')
+@paginate(KeysetPagination)
+@select_related_for(ProductOut)
 def products_sort(request, sort: str = Query(None, description = 'Введите asc или desc')):
     queryset = Product.objects.all()
     if sort == 'asc':
@@ -226,17 +244,28 @@ def products_sort(request, sort: str = Query(None, description = 'Введите
 
 
 @api.get('/products_name_search', response = List[ProductOut], summary = 'Поиск товара по названию')
-def search_product_name(request, search: str = Query(None, description = 'Строка поиска')):
+@rate_limit('60/m')
+@concurrency_limit(8)
+@paginate(KeysetPagination)
+@select_related_for(ProductOut)
+def search_product_name(request, search: str = Query(..., min_length = 1, description = 'Строка поиска')):
     return Product.objects.filter(name__icontains = search)
 
 
 @api.get('/products_desc_search', response = List[ProductOut], summary = 'Поиск товара по описанию')
-def search_product_desc(request, search: str = Query(None, description = 'Строка поиска')):
+@rate_limit('60/m')
+@concurrency_limit(8)
+@paginate(KeysetPagination)
+@select_related_for(ProductOut)
+def search_product_desc(request, search: str = Query(..., min_length = 1, description = 'Строка поиска')):
     return Product.objects.filter(description__icontains = search)
 
 
 @api.get('/wishlist/{user_id}/', response = List[WishlistOut], summary = 'Получить лист желаний пользователя')
-def get_wishlist(request, user_id: int):
+@rendered_response
+@paginate(KeysetPagination)
+@values_for(WishlistOut)
+def get_wishlist(request, user_id: int, fields: str = Query(None, description = FIELDS_DESCRIPTION)):
     user = get_object_or_404(User, id = user_id)
     wishlist = Wishlist.objects.filter(user = user)
     return wishlist
@@ -244,49 +273,70 @@ def get_wishlist(request, user_id: int):
 
 @api.post('/wishlist', response = WishlistOut, summary = 'Добавить лист желаний')
 def create_wishlist(request, payload: WishlistIn):
-    payload_dict = payload.dict()
-    user = get_object_or_404(User, id = payload_dict.pop('user'))
-    product = get_object_or_404(Product, id = payload_dict.pop('product'))
+    check_wishlist_owner(request.auth, payload.user)
+    return upsert_wishlist(payload.user, [(payload.product, payload.quantity)])[0]
 
-    if Wishlist.objects.filter(user = user, product = product).exists():
-        wishlist = get_object_or_404(Wishlist, user = user, product = product)
-        wishlist.quantity = payload_dict.pop('quantity')
-    else:
-        wishlist = Wishlist(**payload_dict, user = user, product = product)    
 
-    wishlist.save()
-    return wishlist
+@api.put('/wishlist/{user_id}/items', response = List[WishlistOut], summary = 'Синхронизировать лист желаний списком товаров')
+def sync_wishlist(request, user_id: int, items: List[WishlistItemIn]):
+    '''Товары с количеством 0 удаляются из листа желаний, остальные добавляются или обновляются'''
+    check_wishlist_owner(request.auth, user_id)
+    return upsert_wishlist(user_id, [(item.product, item.quantity) for item in items])
 
 
 @api.put('/wishlist_add', response = WishlistOut, summary = 'Добавить единицу товара в лист желаний')
 def add_to_wishlist(request, wishlist_id: int):
-    wishlist = get_object_or_404(Wishlist, id = wishlist_id)
-    wishlist.quantity += 1
-    wishlist.save()
-    return wishlist
+    return change_wishlist_quantity(wishlist_id, 1)
 
 
 @api.put('/wishlist_remove', response = WishlistOut, summary = 'Удалить единицу товара из листа желаний')
 def remove_from_wishlist(request, wishlist_id: int):
-    wishlist = get_object_or_404(Wishlist, id = wishlist_id)
-    wishlist.quantity -= 1
+    return change_wishlist_quantity(wishlist_id, -1)
 
-    if wishlist.quantity == 0:
-        wishlist.delete()
-    else:
-        wishlist.save()
 
-    return wishlist
+@api.post('/wishlist/{user_id}/quantities', response = List[WishlistOut], summary = 'Изменить количество нескольких товаров в листе желаний')
+def change_wishlist_quantities(request, user_id: int, deltas: List[WishlistDeltaIn]):
+    check_wishlist_owner(request.auth, user_id)
+    return apply_wishlist_deltas(user_id, deltas)
 
 
 @api.get('/orders', response = List[OrderItemOut], summary = 'Получить список всех заказов')
 @check_permission('ninjashop.view_orderitem', raise_exception = True, use_auth = True)
-def list_orders(request):
+@rendered_response
+@paginate(KeysetPagination)
+@values_for(OrderItemOut)
+def list_orders(request, fields: str = Query(None, description = FIELDS_DESCRIPTION)):
     return OrderItem.objects.all()
 
 
+@api.get('/orders/summary', response = List[OrderSummaryOut], summary = 'Количество заказов и выручка по пользователям')
+@check_permission('ninjashop.view_order', raise_exception = True, use_auth = True)
+def orders_summary(request):
+    return Order.objects.values('user_id', username = F('user__username')).annotate(
+        orders = Count('id'),
+        revenue = Sum('total')
+    ).order_by('user_id')
+
+
+@api.get('/export/products', summary = 'Потоковая выгрузка каталога товаров')
+@concurrency_limit(2)
+def export_products(request, format: str = Query('ndjson', description = 'ndjson или json')):
+    return stream_export(Product.objects.all(), ProductOut, format, values = True)
+
+
+@api.get('/export/orders', summary = 'Потоковая выгрузка всех заказов')
+@check_permission('ninjashop.view_orderitem', raise_exception = True, use_auth = True)
+@concurrency_limit(2)
+def export_orders(request, format: str = Query('ndjson', description = 'ndjson или json')):
+    '''Порядок по order_id совпадает с порядком создания и читается по индексу внешнего ключа без сортировки'''
+    return stream_export(OrderItem.objects.order_by('order_id', 'id'), OrderItemOut, format, values = True)
+
+
 @api.get('/order/{user_id}/', response = List[OrderItemOut], summary = 'Получить список заказов пользователя')
-def get_user_orders(request, user_id: int):
+@rendered_response
+@paginate(KeysetPagination)
+@values_for(OrderItemOut)
+def get_user_orders(request, user_id: int, fields: str = Query(None, description = FIELDS_DESCRIPTION)):
     try:
         user = get_object_or_404(User, id = user_id)
         order = get_object_or_404(Order, user = user)
@@ -297,26 +347,11 @@ def get_user_orders(request, user_id: int):
 
 
 @api.post('/order', response = OrderOut, summary = 'Добавить заказ')
+@rate_limit('30/m')
+@concurrency_limit(8)
 def create_order(request, wishlists: List[int]):
-    '''Получаю список id листов желаний, которые будут включены в заказ'''
-    status = get_object_or_404(Status, id = 1)
-    wishlist = get_object_or_404(Wishlist, id = wishlists[0])
-    order = Order(user = wishlist.user, status = status, total = 0)   
-    order.save()
-    '''Прохожусь по всем id и собираю их в элементы заказа'''
-    for item in wishlists:
-        wishlist = get_object_or_404(Wishlist, id = item)
-        OrderItem.objects.create(
-            order = order,
-            product = wishlist.product,
-            quantity = wishlist.quantity,
-            cost = wishlist.product.price * wishlist.quantity
-        )
-    
-    order.total += order.get_total_amount()  
-    order.save()
-
-    return order
+    '''Получаю список id листов желаний, которые будут включены в заказ; все они должны принадлежать пользователю'''
+    return place_order(request.auth, wishlists)
 
 
 @api.put('/change_status', response = OrderOut, summary = 'Изменить статус заказа')
@@ -0,0 +1,73 @@
+from django.contrib.auth.models import User
+from django.shortcuts import aget_object_or_404
+from ninja import Query
+from ninja.errors import HttpError
+from .models import Category, Product, Wishlist, Order, OrderItem
+from .schemas import CategoryOut, ProductOut, WishlistOut, OrderItemOut
+from .auth import AsyncBasicAuth, AsyncTokenAuth
+from .decorator import check_permission
+from .queries import optimize_queryset
+from .pagination import KeysetPagination, paged_schema
+from .metrics import InstrumentedRouter
+
+
+'''
+Асинхронные версии эндпоинтов чтения. Под ASGI они выполняются в цикле событий,
+авторизация, проверка прав и запросы к базе идут через асинхронный интерфейс ORM
+'''
+router = InstrumentedRouter(auth = [AsyncTokenAuth(), AsyncBasicAuth()], tags = ['async'])
+
+paginator = KeysetPagination()
+
+
+async def paginate(queryset, schema, pagination):
+    return await paginator.apaginate_queryset(optimize_queryset(queryset, schema), pagination)
+
+
+@router.get('/categories', response = paged_schema(CategoryOut), summary = 'Получить список категорий')
+async def list_categories(request, pagination: KeysetPagination.Input = Query(...)):
+    return await paginate(Category.objects.all(), CategoryOut, pagination)
+
+
+@router.get('/products', response = paged_schema(ProductOut), summary = 'Получить список товаров')
+async def list_products(request, pagination: KeysetPagination.Input = Query(...)):
+    return await paginate(Product.objects.all(), ProductOut, pagination)
+
+
+@router.get('/categories/{category_slug}', response = CategoryOut, summary = 'Получить категорию по slug')
+async def get_category(request, category_slug: str):
+    return await aget_object_or_404(Category, slug = category_slug)
+
+
+@router.get('/products/{product_id}', response = ProductOut, summary = 'Получить товар по id')
+async def get_product(request, product_id: int):
+    return await aget_object_or_404(optimize_queryset(Product.objects.all(), ProductOut), id = product_id)
+
+
+@router.get('/products/{category_slug}/', response = paged_schema(ProductOut), summary = 'Получить список товаров по категории')
+async def get_products_of_category(request, category_slug: str, pagination: KeysetPagination.Input = Query(...)):
+    category = await aget_object_or_404(Category, slug = category_slug)
+    return await paginate(Product.objects.filter(category = category), ProductOut, pagination)
+
+
+@router.get('/wishlist/{user_id}/', response = paged_schema(WishlistOut), summary = 'Получить лист желаний пользователя')
+async def get_wishlist(request, user_id: int, pagination: KeysetPagination.Input = Query(...)):
+    user = await aget_object_or_404(User, id = user_id)
+    return await paginate(Wishlist.objects.filter(user = user), WishlistOut, pagination)
+
+
+@router.get('/orders', response = paged_schema(OrderItemOut), summary = 'Получить список всех заказов')
+@check_permission('ninjashop.view_orderitem', raise_exception = True, use_auth = True)
+async def list_orders(request, pagination: KeysetPagination.Input = Query(...)):
+    return await paginate(OrderItem.objects.all(), OrderItemOut, pagination)
+
+
+@router.get('/order/{user_id}/', response = paged_schema(OrderItemOut), summary = 'Получить список заказов пользователя')
+async def get_user_orders(request, user_id: int, pagination: KeysetPagination.Input = Query(...)):
+    '''Как и синхронная версия: позиции единственного заказа пользователя, 404, если заказов нет или их несколько'''
+    try:
+        user = await aget_object_or_404(User, id = user_id)
+        order = await aget_object_or_404(Order, user = user)
+    except Exception:
+        raise HttpError(404, 'Произошла ошибка!')
+    return await paginate(OrderItem.objects.filter(order = order), OrderItemOut, pagination)
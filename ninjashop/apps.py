@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class NinjashopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ninjashop'
+
+    def ready(self):
+        from . import signals
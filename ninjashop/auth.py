@@ -0,0 +1,144 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import aauthenticate, authenticate
+from django.contrib.auth.models import User
+from ninja.errors import AuthenticationError
+from ninja.security import HttpBasicAuth, HttpBearer
+from .models import ApiToken
+
+
+AUTH_CACHE_TTL = getattr(settings, 'AUTH_CACHE_TTL', 300)
+
+AUTH_CACHE_SIZE = getattr(settings, 'AUTH_CACHE_SIZE', 1024)
+
+
+class CredentialCache:
+    '''
+    Кэш проверенных пар (логин, пароль) с ограниченным временем жизни и вытеснением LRU.
+    Пароль хранится только в виде HMAC, поэтому повторная проверка не требует PBKDF2.
+    Запись действительна, пока хеш пароля и активность пользователя в базе не изменились
+    '''
+    def __init__(self, ttl = AUTH_CACHE_TTL, size = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _key(self, username, password):
+        digest = hmac.new(settings.SECRET_KEY.encode(), f'{ username }:{ password }'.encode(), hashlib.sha256).hexdigest()
+        return username, digest
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _set(self, key, user):
+        with self._lock:
+            self._entries[key] = (user.pk, user.password, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last = False)
+
+    def authenticate(self, username, password):
+        key = self._key(username, password)
+        entry = self._get(key)
+        if entry is not None:
+            user_id, password_hash, _ = entry
+            user = User.objects.filter(pk = user_id).first()
+            if user and user.is_active and user.password == password_hash:
+                return user
+            self.invalidate_user(user_id)
+
+        user = authenticate(username = username, password = password)
+        if user:
+            self._set(key, user)
+        return user
+
+    async def aauthenticate(self, username, password):
+        key = self._key(username, password)
+        entry = self._get(key)
+        if entry is not None:
+            user_id, password_hash, _ = entry
+            user = await User.objects.filter(pk = user_id).afirst()
+            if user and user.is_active and user.password == password_hash:
+                return user
+            self.invalidate_user(user_id)
+
+        user = await aauthenticate(username = username, password = password)
+        if user:
+            self._set(key, user)
+        return user
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0] == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+credential_cache = CredentialCache()
+
+
+def token_digest(token):
+    '''Токены случайные и длинные, поэтому для них достаточно быстрого SHA-256 вместо KDF'''
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def generate_token():
+    return secrets.token_urlsafe(32)
+
+
+class BasicAuth(HttpBasicAuth):
+    def authenticate(self, request, username, password):
+        user = credential_cache.authenticate(username, password)
+        if user:
+            return user
+        raise AuthenticationError('Ошибка авторизации!')
+
+
+class AsyncBasicAuth(HttpBasicAuth):
+    async def authenticate(self, request, username, password):
+        user = await credential_cache.aauthenticate(username, password)
+        if user:
+            return user
+        raise AuthenticationError('Ошибка авторизации!')
+
+
+class BearerOnly:
+    '''Заголовок другой схемы (Basic) молча передается следующему классу авторизации'''
+    def __call__(self, request):
+        if not request.headers.get('Authorization', '').lower().startswith('bearer '):
+            return None
+        return super().__call__(request)
+
+
+class TokenAuth(BearerOnly, HttpBearer):
+    '''Проверка токена — один запрос по уникальному индексу, без хеширования пароля'''
+    def authenticate(self, request, token):
+        api_token = ApiToken.objects.select_related('user').filter(digest = token_digest(token), user__is_active = True).first()
+        if api_token:
+            return api_token.user
+        raise AuthenticationError('Ошибка авторизации!')
+
+
+class AsyncTokenAuth(BearerOnly, HttpBearer):
+    async def authenticate(self, request, token):
+        api_token = await ApiToken.objects.select_related('user').filter(digest = token_digest(token), user__is_active = True).afirst()
+        if api_token:
+            return api_token.user
+        raise AuthenticationError('Ошибка авторизации!')
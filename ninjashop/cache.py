@@ -0,0 +1,125 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.http import HttpResponse
+from django.utils.http import urlencode
+from django.http.response import HttpResponseBase
+from django.views.decorators.http import condition
+from pydantic import TypeAdapter
+from .metrics import timed_serialization
+from .models import CacheVersion
+from .renderers import renderer
+
+
+CATALOG_CACHE_ALIAS = getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')
+
+CATALOG_CACHE_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+def get_cache():
+    return caches[CATALOG_CACHE_ALIAS]
+
+
+def get_versions(namespaces):
+    '''
+    Версии пространств имен кэша одним запросом к базе. Ключ ответа содержит версии, поэтому смена версии
+    делает недоступными все ответы пространства без перебора ключей. Версии хранятся в базе, а не в кэше,
+    поэтому изменение через любой процесс сразу сбрасывает ответы и ETag во всех процессах.
+    Пространство, которое еще не менялось, имеет версию 0
+    '''
+    versions = dict(CacheVersion.objects.filter(namespace__in = namespaces).values_list('namespace', 'version'))
+    return [versions.get(namespace, 0) for namespace in namespaces]
+
+
+def invalidate(*namespaces):
+    '''
+    Новая версия пишется в той же транзакции, что и изменение данных: другие процессы увидят ее
+    одновременно с новыми данными, а данные незавершенной транзакции не попадут в кэш под новой версией
+    '''
+    version = time.time_ns()
+    CacheVersion.objects.bulk_create(
+        [CacheVersion(namespace = namespace, version = version) for namespace in dict.fromkeys(namespaces)],
+        update_conflicts = True,
+        unique_fields = ['namespace'],
+        update_fields = ['version']
+    )
+
+
+def request_versions(request, namespaces):
+    '''Версии читаются из базы один раз за запрос, даже если нужны нескольким декораторам'''
+    memo = request.__dict__.setdefault('_cache_versions', {})
+    key = tuple(namespaces)
+    if key not in memo:
+        memo[key] = get_versions(namespaces)
+    return memo[key]
+
+
+def _request_key(request, namespaces, versions):
+    '''Все значения повторяющихся параметров (category=a&category=b) в ключе, с экранированием'''
+    query = urlencode(sorted(request.GET.lists()), doseq = True)
+    version = '.'.join(str(version) for version in versions)
+    return f'ninjashop:response:{ ",".join(namespaces) }:{ version }:{ request.path }?{ query }'
+
+
+def cached_response(namespaces, schema, validate = True):
+    '''
+    Кэширует уже сериализованный JSON ответа. namespaces — шаблоны пространств имен,
+    подставляются аргументы view, например 'product:{product_id}'.
+    validate = False — view уже отдает словари в форме схемы (values_for), pydantic не вызывается
+    '''
+    adapter = TypeAdapter(schema)
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            names = [namespace.format(**kwargs) for namespace in namespaces]
+            key = _request_key(request, names, request_versions(request, names))
+            cache = get_cache()
+            content = cache.get(key)
+
+            cached = content is not None
+            if content is None:
+                result = view_func(request, *args, **kwargs)
+                if isinstance(result, HttpResponseBase):
+                    return result
+                with timed_serialization():
+                    if validate:
+                        result = adapter.dump_python(adapter.validate_python(result, from_attributes = True))
+                    content = renderer.render(request, result, response_status = 200)
+                if not connection.in_atomic_block:
+                    '''Данные из незавершенной транзакции могут быть откачены, их не кэшируем'''
+                    cache.set(key, content, CATALOG_CACHE_TIMEOUT)
+                    cached = True
+
+            response = HttpResponse(content, content_type = f'{ renderer.media_type }; charset={ renderer.charset }')
+            if cached:
+                '''По ключу ответа CompressionMiddleware кэширует его сжатые варианты'''
+                response.cache_key = key
+            return response
+        return wrapped_view
+    return decorator
+
+
+def conditional_response(namespaces):
+    '''
+    ETag и Last-Modified из версий пространств имен кэша: версии общие для всех процессов,
+    ответ 304 отдается одним запросом к таблице версий, без выборки данных и сериализации
+    '''
+    def get_names(kwargs):
+        return [namespace.format(**kwargs) for namespace in namespaces]
+
+    def etag(request, *args, **kwargs):
+        names = get_names(kwargs)
+        return hashlib.md5(_request_key(request, names, request_versions(request, names)).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        '''Пока пространство имен не изменялось, время изменения неизвестно и заголовок не отдается'''
+        version = max(request_versions(request, get_names(kwargs)))
+        if not version:
+            return None
+        return datetime.fromtimestamp(version / 1e9, tz = timezone.utc)
+
+    return condition(etag_func = etag, last_modified_func = last_modified)
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.db.models import Case, Count, Value, When
+from ninja.errors import HttpError
+from .search import get_search_index
+
+
+'''Границы ценовых диапазонов фасета, крайние диапазоны открыты: до 1000, [1000, 5000), ... от 100000'''
+PRICE_FACET_BOUNDS = getattr(settings, 'PRICE_FACET_BOUNDS', [1000, 5000, 10000, 50000, 100000])
+
+PRODUCT_SORTS = {
+    'name': ('name', ),
+    'price': ('price', ),
+    '-price': ('-price', ),
+}
+
+
+def filter_products(queryset, filters):
+    '''Категории, диапазон цены, поиск и сортировка из ProductFilter в одном queryset'''
+    if filters.sort not in PRODUCT_SORTS:
+        raise HttpError(400, f'Сортировка должна быть одной из: { ", ".join(PRODUCT_SORTS) }!')
+    if filters.category:
+        queryset = queryset.filter(category__slug__in = filters.category)
+    if filters.min_price is not None:
+        queryset = queryset.filter(price__gte = filters.min_price)
+    if filters.max_price is not None:
+        queryset = queryset.filter(price__lte = filters.max_price)
+    if filters.q:
+        queryset = get_search_index().filter(queryset, filters.q)
+    return queryset.order_by(*PRODUCT_SORTS[filters.sort])
+
+
+def product_facets(queryset, bounds = PRICE_FACET_BOUNDS):
+    '''
+    Число товаров по категориям и ценовым диапазонам для отфильтрованного queryset.
+    Один запрос GROUP BY категория, диапазон; суммы по каждому измерению считаются в Python
+    '''
+    bucket = Case(*[When(price__lt = bound, then = Value(index)) for index, bound in enumerate(bounds)], default = Value(len(bounds)))
+    rows = queryset.order_by().annotate(bucket = bucket).values('category__slug', 'category__name', 'bucket').annotate(count = Count('id'))
+
+    categories = {}
+    prices = [0] * (len(bounds) + 1)
+    for row in rows:
+        category = categories.setdefault(row['category__slug'], { 'slug': row['category__slug'], 'name': row['category__name'], 'count': 0 })
+        category['count'] += row['count']
+        prices[row['bucket']] += row['count']
+
+    edges = [None, *bounds, None]
+    return {
+        'categories': sorted(categories.values(), key = lambda category: (category['name'], category['slug'])),
+        'prices': [{ 'min': edges[index], 'max': edges[index + 1], 'count': count } for index, count in enumerate(prices)],
+    }
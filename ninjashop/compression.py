@@ -0,0 +1,105 @@
+import re
+import zlib
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+'''Уровень сжатия для каждого алгоритма: больше — меньше байт, но дороже по CPU'''
+COMPRESSION_LEVELS = { 'gzip': 3, 'br': 4, 'zstd': 3, **getattr(settings, 'COMPRESSION_LEVELS', {}) }
+
+'''Тела меньше этого размера отдаются без сжатия: выигрыш меньше накладных расходов'''
+COMPRESSION_MIN_SIZE = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+
+'''
+Сжимаются только ответы API. HTML с CSRF-токенами (админка) не сжимается:
+сжатие секрета вместе с данными из запроса открывает атаку BREACH
+'''
+COMPRESSION_TYPES = getattr(settings, 'COMPRESSION_TYPES', ('application/json', 'application/x-ndjson'))
+
+
+class Compressor:
+    '''Потоковый компрессор: compress(..., flush = True) отдает все накопленное, чтобы клиент мог читать по частям'''
+    def __init__(self, encoding, level = None):
+        level = COMPRESSION_LEVELS[encoding] if level is None else level
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == 'br':
+            self._compressor = brotli.Compressor(quality = level)
+        elif encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level = level).compressobj()
+        else:
+            raise ValueError(f'Неизвестный алгоритм сжатия: { encoding }')
+
+    def compress(self, data, flush = False):
+        if self.encoding == 'br':
+            output = self._compressor.process(data)
+            return output + self._compressor.flush() if flush else output
+        output = self._compressor.compress(data)
+        if flush:
+            output += self._compressor.flush(zlib.Z_SYNC_FLUSH if self.encoding == 'gzip' else zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return output
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def available_encodings():
+    '''Установленные алгоритмы в порядке предпочтения при равном q'''
+    return [encoding for encoding, module in (('zstd', zstandard), ('br', brotli), ('gzip', zlib)) if module is not None]
+
+
+def choose_encoding(accept_encoding, encodings = None):
+    '''Алгоритм из Accept-Encoding с наибольшим q; q=0 запрещает алгоритм, * разрешает остальные'''
+    encodings = available_encodings() if encodings is None else encodings
+    weights = {}
+    for part in accept_encoding.split(','):
+        match = re.match(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?', part)
+        if match:
+            try:
+                weights[match.group(1).lower()] = float(match.group(2) or 1)
+            except ValueError:
+                continue
+    candidates = [(weights.get(encoding, weights.get('*', 0)), -position, encoding) for position, encoding in enumerate(encodings)]
+    weight, _, encoding = max(candidates, default = (0, 0, None))
+    return encoding if weight > 0 else None
+
+
+def compress(data, encoding, level = None):
+    compressor = Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, encoding, level = None):
+    '''Сжимает поток по частям, каждая часть сразу отправляется клиенту'''
+    compressor = Compressor(encoding, level)
+    for chunk in chunks:
+        output = compressor.compress(chunk, flush = True)
+        if output:
+            yield output
+    yield compressor.finish()
+
+
+async def acompress_stream(chunks, encoding, level = None):
+    compressor = Compressor(encoding, level)
+    async for chunk in chunks:
+        output = compressor.compress(chunk, flush = True)
+        if output:
+            yield output
+    yield compressor.finish()
+
+
+def is_compressible(response):
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    return not response.has_header('Content-Encoding') and content_type in COMPRESSION_TYPES
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+'''
+PRAGMA для каждого нового соединения с SQLite. synchronous = NORMAL в режиме WAL безопасен
+для целостности и убирает fsync на каждом коммите. Режим WAL хранится в самом файле базы и включается
+миграцией 0008, а время ожидания блокировки задается одним параметром OPTIONS['timeout'] в DATABASES
+'''
+SQLITE_PRAGMAS = getattr(settings, 'SQLITE_PRAGMAS', {
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+})
+
+DATABASE_READ_ALIAS = getattr(settings, 'DATABASE_READ_ALIAS', 'replica')
+
+'''Эти PRAGMA меняют файл базы, а не соединение, и выполняются только на основном соединении'''
+WRITE_PRAGMAS = ('journal_mode', )
+
+
+def apply_pragmas(cursor, pragmas = SQLITE_PRAGMAS, read_only = False):
+    for name, value in pragmas.items():
+        if read_only and name in WRITE_PRAGMAS:
+            continue
+        cursor.execute(f'PRAGMA { name } = { value }')
+    if read_only:
+        cursor.execute('PRAGMA query_only = ON')
+
+
+def configure_connection(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, read_only = connection.alias == DATABASE_READ_ALIAS)
+
+
+class ReadReplicaRouter:
+    '''
+    Чтение идет через отдельное соединение только для чтения, запись — через основное.
+    Внутри транзакции чтение остается на основном соединении, чтобы видеть свои же изменения
+    '''
+    def db_for_read(self, model, **hints):
+        if DATABASE_READ_ALIAS not in connections.settings:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return DATABASE_READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name = None, **hints):
+        return db != DATABASE_READ_ALIAS
@@ -1,18 +1,85 @@
+import inspect
 from functools import wraps
+from typing import Iterable, Union
 from django.http import HttpResponse
+from django.http.response import HttpResponseBase
+from django.db.models import QuerySet
+from .queries import optimize_queryset
+from .fieldsets import projected_queryset, sparse_schema
+from .metrics import timed_serialization
+from .renderers import renderer
+from .permissions import has_perms, ahas_perms
 
 
-def check_permission(permission_codename: str, use_auth: bool = True, raise_exception: bool = True):
+def check_permission(permission_codename: Union[str, Iterable[str]], use_auth: bool = True, raise_exception: bool = True):
+    '''Принимает одно право или список прав, которые должны быть у пользователя одновременно'''
+    permissions = (permission_codename, ) if isinstance(permission_codename, str) else tuple(permission_codename)
+
+    def denied():
+        if raise_exception:
+            return HttpResponse('У вас недостаточно прав для совершения данной операции!', status = 403)
+        return HttpResponse('Требуется авторизация!', status = 401)
+
     def decorator(view_func):
+        if inspect.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapped_view(request, *args, **kwargs):
+                user_obj = request.auth if use_auth else request.user
+
+                if user_obj and await ahas_perms(user_obj, permissions):
+                    return await view_func(request, *args, **kwargs)
+                return denied()
+            return async_wrapped_view
+
         @wraps(view_func)
         def wrapped_view(request, *args, **kwargs):
             user_obj = request.auth if use_auth else request.user
             
-            if user_obj and user_obj.has_perm(permission_codename):
+            if user_obj and has_perms(user_obj, permissions):
                 return view_func(request, *args, **kwargs)
-            
-            if raise_exception:
-                return HttpResponse('У вас недостаточно прав для совершения данной операции!', status = 403)
-            return HttpResponse('Требуется авторизация!', status = 401)
+            return denied()
         return wrapped_view
-    return decorator
\ No newline at end of file
+    return decorator
+
+
+def select_related_for(schema):
+    '''Подгружает связанные объекты, нужные схеме ответа, чтобы избежать N+1 запросов'''
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            result = view_func(request, *args, **kwargs)
+            if isinstance(result, QuerySet):
+                return optimize_queryset(result, schema)
+            return result
+        return wrapped_view
+    return decorator
+
+
+def values_for(schema):
+    '''
+    Отдает строки queryset словарями в форме схемы через .values(), без создания моделей.
+    Параметр view fields сужает схему, из базы читаются только выбранные столбцы
+    '''
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            fieldset = sparse_schema(schema, kwargs.get('fields'))
+            result = view_func(request, *args, **kwargs)
+            if isinstance(result, QuerySet):
+                return projected_queryset(result, fieldset)
+            return result
+        return wrapped_view
+    return decorator
+
+
+def rendered_response(view_func):
+    '''Рендерит результат без валидации схемой ответа: словари из values_for уже в форме схемы (или ее части)'''
+    @wraps(view_func)
+    def wrapped_view(request, *args, **kwargs):
+        result = view_func(request, *args, **kwargs)
+        if isinstance(result, HttpResponseBase):
+            return result
+        with timed_serialization():
+            content = renderer.render(request, result, response_status = 200)
+        return HttpResponse(content, content_type = f'{ renderer.media_type }; charset={ renderer.charset }')
+    return wrapped_view
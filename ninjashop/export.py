@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from ninja.errors import HttpError
+from .queries import optimize_queryset, values_queryset
+from .renderers import dumps
+
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+def _serialized_chunks(queryset, schema, chunk_size):
+    '''Сериализует строки queryset схемой и отдает их пачками по chunk_size'''
+    chunk = []
+    for obj in queryset.iterator(chunk_size = chunk_size):
+        '''Словари из values_queryset уже в форме схемы'''
+        chunk.append(dumps(obj) if isinstance(obj, dict) else schema.from_orm(obj).model_dump_json().encode())
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _ndjson(queryset, schema, chunk_size):
+    for chunk in _serialized_chunks(queryset, schema, chunk_size):
+        yield b'\n'.join(chunk) + b'\n'
+
+
+def _json_array(queryset, schema, chunk_size):
+    yield b'['
+    separator = b''
+    for chunk in _serialized_chunks(queryset, schema, chunk_size):
+        yield separator + b','.join(chunk)
+        separator = b','
+    yield b']'
+
+
+def stream_export(queryset, schema, format: str = 'ndjson', chunk_size: int = EXPORT_CHUNK_SIZE, values: bool = False):
+    '''
+    Потоковая выгрузка queryset: строки читаются курсором через iterator(),
+    поэтому расход памяти не зависит от размера таблицы.
+    values = True — строки читаются через .values() и не проходят через модели и pydantic
+    '''
+    if format not in CONTENT_TYPES:
+        raise HttpError(400, 'Формат выгрузки должен быть ndjson или json!')
+    queryset = values_queryset(queryset, schema) if values else optimize_queryset(queryset, schema)
+    generator = _ndjson if format == 'ndjson' else _json_array
+    return StreamingHttpResponse(generator(queryset, schema, chunk_size), content_type = CONTENT_TYPES[format])
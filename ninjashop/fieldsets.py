@@ -0,0 +1,88 @@
+import typing
+from functools import lru_cache
+from typing import ClassVar
+from ninja import Schema
+from ninja.errors import HttpError
+from .queries import _nested_schema, values_queryset
+
+
+'''Число закэшированных схем ограничено: набор полей задает клиент'''
+FIELDSET_CACHE_SIZE = 256
+
+
+def parse_fields(value):
+    '''
+    'id,name,category.slug' -> (('category', 'slug'), ('id', ), ('name', )).
+    Пустое значение означает все поля схемы
+    '''
+    if not value:
+        return None
+    paths = { tuple(part.strip() for part in field.split('.')) for field in value.split(',') if field.strip() }
+    return tuple(sorted(paths)) or None
+
+
+def _replace(annotation, nested, replacement):
+    '''Подменяет вложенную схему в аннотации: CategoryOut, Optional[CategoryOut], List[CategoryOut]'''
+    if annotation is nested:
+        return replacement
+    origin = typing.get_origin(annotation)
+    if origin is None:
+        return annotation
+    arguments = tuple(_replace(argument, nested, replacement) for argument in typing.get_args(annotation))
+    return (typing.Union if origin is typing.Union else origin)[arguments]
+
+
+def _select(schema, tree):
+    unknown = set(tree) - set(schema.model_fields)
+    if unknown:
+        raise HttpError(400, f'Неизвестные поля: { ", ".join(sorted(unknown)) }! Доступны: { ", ".join(schema.model_fields) }')
+
+    annotations, namespace, computed = {}, {}, {}
+    for name, field in schema.model_fields.items():
+        if name not in tree:
+            continue
+        annotation = field.annotation
+        if tree[name]:
+            nested = _nested_schema(annotation)
+            if nested is None:
+                raise HttpError(400, f'Поле { name } не содержит вложенных полей!')
+            annotation = _replace(annotation, nested, _select(nested, tree[name]))
+        annotations[name] = annotation
+        namespace[name] = field
+        if f'resolve_{ name }' in schema.__dict__:
+            namespace[f'resolve_{ name }'] = schema.__dict__[f'resolve_{ name }']
+        if name in getattr(schema, 'values_computed', {}):
+            computed[name] = schema.values_computed[name]
+
+    if computed:
+        annotations['values_computed'] = ClassVar[dict]
+        namespace['values_computed'] = computed
+    namespace['__annotations__'] = annotations
+    return type(f'{ schema.__name__ }Fields', (Schema, ), namespace)
+
+
+@lru_cache(maxsize = FIELDSET_CACHE_SIZE)
+def _sparse_schema(schema, paths):
+    tree = {}
+    for path in paths:
+        node = tree
+        '''Пустой узел означает вложенную схему целиком, уточнение полей его сужает'''
+        for name in path:
+            node = node.setdefault(name, {})
+    return _select(schema, tree)
+
+
+def sparse_schema(schema, fields):
+    '''
+    Схема только с полями из параметра fields (вложенные поля через точку).
+    Сгенерированные классы кэшируются по набору полей
+    '''
+    paths = parse_fields(fields)
+    if paths is None:
+        return schema
+    return _sparse_schema(schema, paths)
+
+
+def projected_queryset(queryset, schema, fields = None):
+    '''Queryset списочного эндпоинта: .values() только по полям схемы, суженной параметром fields'''
+    return values_queryset(queryset, sparse_schema(schema, fields))
@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from ninja.errors import HttpError
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_DIRECTORY = 'images'
+
+'''Имя варианта -> максимальная сторона в пикселях'''
+IMAGE_VARIANTS = getattr(settings, 'IMAGE_VARIANTS', { 'thumb': 200, 'medium': 800 })
+
+IMAGE_WORKERS = getattr(settings, 'IMAGE_WORKERS', 2)
+
+IMAGE_WEBP_QUALITY = getattr(settings, 'IMAGE_WEBP_QUALITY', 80)
+
+'''Формат, определенный Pillow по содержимому -> расширение сохраненного файла'''
+IMAGE_FORMATS = getattr(settings, 'IMAGE_FORMATS', { 'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp' })
+
+executor = ThreadPoolExecutor(max_workers = IMAGE_WORKERS, thread_name_prefix = 'images')
+
+_pending_lock = threading.Lock()
+_pending = set()
+
+
+def variant_name(name, variant):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return f'{ IMAGE_DIRECTORY }/variants/{ stem }_{ variant }.webp'
+
+
+def variant_urls(name):
+    '''
+    Адреса оригинала и уменьшенных копий. Копия, которая еще не построена в фоне
+    (или не построена для старого файла), заменяется адресом оригинала
+    '''
+    if not name:
+        return {}
+    original = default_storage.url(name)
+    urls = { 'original': original }
+    for variant in IMAGE_VARIANTS:
+        target = variant_name(name, variant)
+        urls[variant] = default_storage.url(target) if default_storage.exists(target) else original
+    return urls
+
+
+def image_extension(file):
+    '''Расширение по содержимому файла, а не по имени от клиента; не изображение — ошибка 400'''
+    try:
+        with Image.open(file) as image:
+            image.verify()
+            image_format = image.format
+    except Exception:
+        raise HttpError(400, 'Файл не является изображением!')
+    if image_format not in IMAGE_FORMATS:
+        raise HttpError(400, f'Формат изображения не поддерживается: { image_format }')
+    return IMAGE_FORMATS[image_format]
+
+
+def store_upload(upload):
+    '''
+    Пишет загрузку на диск по частям, одновременно считая SHA-256. Файл сохраняется под именем
+    хеша содержимого, поэтому повторная загрузка той же картинки не создает копию
+    '''
+    digest = hashlib.sha256()
+    with tempfile.TemporaryFile() as buffer:
+        for chunk in upload.chunks():
+            digest.update(chunk)
+            buffer.write(chunk)
+
+        buffer.seek(0)
+        extension = image_extension(buffer)
+        name = f'{ IMAGE_DIRECTORY }/{ digest.hexdigest() }{ extension }'
+        if not default_storage.exists(name):
+            buffer.seek(0)
+            name = default_storage.save(name, File(buffer))
+    return name
+
+
+def generate_variants(name):
+    with default_storage.open(name) as source, Image.open(source) as image:
+        image.load()
+        for variant, size in IMAGE_VARIANTS.items():
+            target = variant_name(name, variant)
+            if default_storage.exists(target):
+                continue
+            copy = image.copy()
+            copy.thumbnail((size, size))
+            with tempfile.TemporaryFile() as buffer:
+                copy.save(buffer, 'WEBP', quality = IMAGE_WEBP_QUALITY)
+                buffer.seek(0)
+                default_storage.save(target, File(buffer))
+
+
+def _run(name):
+    try:
+        generate_variants(name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+
+
+def schedule_variants(name):
+    '''Уменьшенные копии строятся в пуле потоков после коммита, не задерживая ответ'''
+    def submit():
+        future = executor.submit(_run, name)
+        with _pending_lock:
+            _pending.add(future)
+        future.add_done_callback(_discard)
+
+    transaction.on_commit(submit)
+
+
+def _discard(future):
+    with _pending_lock:
+        _pending.discard(future)
+
+
+def wait_for_variants(timeout = None):
+    with _pending_lock:
+        futures = list(_pending)
+    wait(futures, timeout = timeout)
+
+
+def save_product_image(product, upload):
+    product.image.name = store_upload(upload)
+    product.save()
+    schedule_variants(product.image.name)
+    return product
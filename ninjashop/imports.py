@@ -0,0 +1,108 @@
+import codecs
+import csv
+import json
+from decimal import Decimal
+from itertools import islice
+from django.conf import settings
+from django.db import transaction
+from ninja.errors import HttpError
+from pydantic import ValidationError
+from .models import Category, Product
+from .schemas import ProductIn
+from .search import get_search_index
+from .cache import invalidate
+
+
+IMPORT_BATCH_SIZE = getattr(settings, 'IMPORT_BATCH_SIZE', 1000)
+
+IMPORT_FORMATS = ('json', 'ndjson', 'csv')
+
+UPDATE_FIELDS = ['name', 'category', 'description', 'price']
+
+
+def parse_rows(request, format):
+    '''Строки NDJSON и CSV читаются из тела запроса потоком, JSON-массив разбирается целиком'''
+    if format == 'json':
+        try:
+            rows = json.loads(request.body)
+        except ValueError:
+            raise HttpError(400, 'Некорректный JSON!')
+        if not isinstance(rows, list):
+            raise HttpError(400, 'Ожидается JSON-массив товаров!')
+        return iter(rows)
+
+    lines = codecs.iterdecode(request, 'utf-8')
+    if format == 'csv':
+        return csv.DictReader(lines)
+    return (_ndjson_row(line) for line in lines if line.strip())
+
+
+def _ndjson_row(line):
+    try:
+        return json.loads(line)
+    except ValueError as error:
+        return error
+
+
+def _batches(rows, size):
+    rows = enumerate(rows, start = 1)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _validate(batch, categories, errors):
+    '''Категории всей пачки подгружаются одним запросом, уже известные берутся из словаря'''
+    valid = []
+    for number, row in batch:
+        if not isinstance(row, dict):
+            errors.append({ 'row': number, 'errors': ['Строка не является объектом товара'] })
+            continue
+        try:
+            valid.append((number, ProductIn(**row)))
+        except ValidationError as error:
+            errors.append({ 'row': number, 'errors': [f'{ ".".join(map(str, item["loc"])) }: { item["msg"] }' for item in error.errors()] })
+
+    unknown = { product.category for _, product in valid } - categories.keys()
+    if unknown:
+        categories.update(Category.objects.filter(slug__in = unknown).values_list('slug', 'id'))
+
+    products = {}
+    for number, product in valid:
+        if product.category not in categories:
+            errors.append({ 'row': number, 'errors': [f'category: категория { product.category } не найдена'] })
+            continue
+        '''Повтор slug внутри пачки: побеждает последняя строка'''
+        products[product.slug] = Product(
+            name = product.name,
+            slug = product.slug,
+            category_id = categories[product.category],
+            description = product.description,
+            price = Decimal(str(product.price)),
+        )
+    return list(products.values())
+
+
+def import_products(rows, batch_size = IMPORT_BATCH_SIZE):
+    '''
+    Импорт с upsert по уникальному slug: каждая пачка — один INSERT ... ON CONFLICT DO UPDATE
+    в своей транзакции, ошибки строк не прерывают импорт остальных
+    '''
+    categories = {}
+    errors = []
+    imported = 0
+
+    for batch in _batches(rows, batch_size):
+        products = _validate(batch, categories, errors)
+        if not products:
+            continue
+        with transaction.atomic():
+            Product.objects.bulk_create(products, update_conflicts = True, unique_fields = ['slug'], update_fields = UPDATE_FIELDS)
+            get_search_index().update_many(products)
+        '''bulk_create не отправляет сигналы, поэтому кэш сбрасывается здесь'''
+        invalidate('products', *[f'product:{ product.id }' for product in products])
+        imported += len(products)
+
+    return { 'imported': imported, 'errors': sorted(errors, key = lambda error: error['row']) }
@@ -0,0 +1,95 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from ninjashop.models import Category, Product, Wishlist, Order, OrderItem
+from ninjashop.schemas import CategoryOut, ProductOut, ProductFilter, UserOut, WishlistOut, OrderItemOut
+from ninjashop.catalog import filter_products
+from ninjashop.queries import optimize_queryset
+from ninjashop.fieldsets import projected_queryset
+from ninjashop.pagination import KeysetPagination, encode_cursor, get_value
+
+
+def first_id(model):
+    return model.objects.values_list('id', flat = True).first() or 0
+
+
+def first_slug():
+    return Category.objects.values_list('slug', flat = True).first() or ''
+
+
+def values(schema, fields = None):
+    '''Эндпоинты с values_for, списки товаров и выгрузки: .values() по (суженной) схеме'''
+    return lambda queryset: projected_queryset(queryset, schema, fields)
+
+
+def models(schema):
+    '''Эндпоинты с select_related_for: модели со связанными объектами'''
+    return lambda queryset: optimize_queryset(queryset, schema)
+
+
+'''Querysets списочных эндпоинтов в том виде, в каком они уходят в базу, теми же построителями, что в api.py'''
+AUDITED_QUERIES = [
+    ('GET /categories', lambda: Category.objects.all(), values(CategoryOut), True),
+    ('GET /products', lambda: Product.objects.all(), values(ProductOut), True),
+    ('GET /products?fields=id,name,price', lambda: Product.objects.all(), values(ProductOut, 'id,name,price'), True),
+    ('GET /products?category=...&min_price=...&sort=price', lambda: filter_products(
+        Product.objects.all(), ProductFilter(category = [first_slug()], min_price = 1, sort = 'price')
+    ), values(ProductOut), True),
+    ('GET /products?sort=-price', lambda: filter_products(Product.objects.all(), ProductFilter(sort = '-price')), values(ProductOut), True),
+    ('GET /products/{category_slug}/', lambda: Product.objects.filter(category_id = first_id(Category)), values(ProductOut), True),
+    ('GET /products_sort?sort=asc', lambda: Product.objects.order_by('price'), models(ProductOut), True),
+    ('GET /products_sort?sort=desc', lambda: Product.objects.order_by('-price'), models(ProductOut), True),
+    ('GET /products_name_search', lambda: Product.objects.filter(name__icontains = 'x'), models(ProductOut), True),
+    ('GET /products_desc_search', lambda: Product.objects.filter(description__icontains = 'x'), models(ProductOut), True),
+    ('GET /users', lambda: User.objects.all(), models(UserOut), True),
+    ('GET /wishlist/{user_id}/', lambda: Wishlist.objects.filter(user_id = first_id(User)), values(WishlistOut), True),
+    ('GET /orders', lambda: OrderItem.objects.all(), values(OrderItemOut), True),
+    ('GET /orders?fields=quantity,product.name', lambda: OrderItem.objects.all(), values(OrderItemOut, 'quantity,product.name'), True),
+    ('GET /order/{user_id}/', lambda: OrderItem.objects.filter(order_id = first_id(Order)), values(OrderItemOut), True),
+    ('GET /export/products', lambda: Product.objects.all(), values(ProductOut), False),
+    ('GET /export/orders', lambda: OrderItem.objects.order_by('order_id', 'id'), values(OrderItemOut), False),
+]
+
+
+def pages(queryset, paginated):
+    '''Первая страница и страница по курсору: у второй в WHERE появляется условие по ключу сортировки'''
+    if not paginated:
+        yield 'весь список', queryset
+        return
+    paginator = KeysetPagination()
+    fields, first = paginator._prepare(queryset, KeysetPagination.Input())
+    yield 'первая страница', first
+    obj = first.first()
+    if obj is not None:
+        cursor = encode_cursor(fields, [get_value(obj, name) for name, _ in fields])
+        yield 'страница по курсору', paginator._prepare(queryset, KeysetPagination.Input(cursor = cursor))[1]
+
+
+def audit():
+    '''Возвращает [(эндпоинт, страница, план, есть ли сортировка во временном B-дереве)]'''
+    results = []
+    for name, build, plan, paginated in AUDITED_QUERIES:
+        for page, queryset in pages(plan(build()), paginated):
+            plan = queryset.explain()
+            results.append((name, page, plan, 'TEMP B-TREE' in plan))
+    return results
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN QUERY PLAN для querysets списочных эндпоинтов; ошибка, если сортировка выполняется без индекса'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Аудит планов запросов поддерживается только для SQLite')
+
+        failed = []
+        for name, page, plan, sorted_in_memory in audit():
+            self.stdout.write(f'{ "FAIL" if sorted_in_memory else "ok  " } { name } ({ page })')
+            if sorted_in_memory or options['verbosity'] > 1:
+                for line in plan.splitlines():
+                    self.stdout.write(f'       { line }')
+            if sorted_in_memory:
+                failed.append(name)
+
+        if failed:
+            raise CommandError(f'Сортировка во временном B-дереве (нужен индекс): { ", ".join(dict.fromkeys(failed)) }')
@@ -0,0 +1,391 @@
+import django
+import http.client
+import json
+import platform
+import random
+import resource
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.test import Client, override_settings
+from django.utils.crypto import get_random_string
+from ninjashop.auth import generate_token, token_digest
+from ninjashop.cache import get_cache
+from ninjashop.metrics import registry
+from ninjashop.models import ApiToken, Category, Product, Wishlist, Status, Order, OrderItem
+from ninjashop.pagination import encode_cursor
+from ninjashop.search import get_search_index
+
+
+'''Размеры синтетических наборов данных; у каждого пользователя один заказ'''
+DATASETS = {
+    '1k': { 'products': 1000, 'categories': 20, 'users': 100, 'wishlist': 20, 'order_items': 5 },
+    '100k': { 'products': 100000, 'categories': 200, 'users': 2000, 'wishlist': 50, 'order_items': 10 },
+    '1m': { 'products': 1000000, 'categories': 1000, 'users': 10000, 'wishlist': 100, 'order_items': 10 },
+}
+
+TARGETS = ('client', 'wsgi', 'asgi')
+
+SYLLABLES = ['sa', 'mi', 'ko', 'ra', 'te', 'lu', 'vi', 'no', 'ga', 'pe', 'зу', 'ма', 'ри', 'то', 'ле', 'ка']
+
+BATCH_SIZE = 5000
+
+
+def generate(sizes, seed = 0, batch_size = BATCH_SIZE):
+    '''Заполняет текущую базу синтетическими данными через bulk_create, поисковый индекс обновляется пачками'''
+    rng = random.Random(seed)
+    words = sorted({ ''.join(rng.choices(SYLLABLES, k = rng.randint(2, 4))) for _ in range(5000) })
+
+    categories = Category.objects.bulk_create(
+        [Category(name = f'Категория { number }', slug = f'category-{ number }') for number in range(sizes['categories'])]
+    )
+
+    product_ids, prices = array('q'), array('q')
+    index = get_search_index()
+    for start in range(0, sizes['products'], batch_size):
+        products = Product.objects.bulk_create([
+            Product(
+                category = categories[number % len(categories)],
+                name = ' '.join(rng.choices(words, k = 3)),
+                slug = f'product-{ number }',
+                description = ' '.join(rng.choices(words, k = 12)),
+                price = Decimal(rng.randint(100, 200000)),
+            )
+            for number in range(start, min(start + batch_size, sizes['products']))
+        ])
+        index.update_many(products)
+        product_ids.extend(product.id for product in products)
+        prices.extend(int(product.price) for product in products)
+
+    password = make_password(None)
+    users = User.objects.bulk_create(
+        [User(username = f'user{ number }', password = password) for number in range(sizes['users'])], batch_size = batch_size
+    )
+
+    wishlists = []
+    for user in users:
+        wishlists += [Wishlist(user = user, product_id = product_id, quantity = rng.randint(1, 5)) for product_id in rng.sample(product_ids, sizes['wishlist'])]
+        if len(wishlists) >= batch_size:
+            Wishlist.objects.bulk_create(wishlists)
+            wishlists = []
+    Wishlist.objects.bulk_create(wishlists)
+
+    status, _ = Status.objects.get_or_create(id = 1, defaults = { 'name': 'Создан' })
+    for start in range(0, len(users), batch_size):
+        items = []
+        orders = []
+        for user in users[start:start + batch_size]:
+            positions = [rng.randrange(len(product_ids)) for _ in range(sizes['order_items'])]
+            order_items = [OrderItem(product_id = product_ids[position], quantity = 1, cost = Decimal(prices[position])) for position in positions]
+            orders.append(Order(user = user, status = status, total = sum(item.cost for item in order_items)))
+            items.append(order_items)
+        for order, order_items in zip(Order.objects.bulk_create(orders), items):
+            for item in order_items:
+                item.order = order
+        OrderItem.objects.bulk_create([item for order_items in items for item in order_items], batch_size = batch_size)
+
+
+def build_endpoints(seed = 0):
+    '''
+    (название, метод, пути по кругу, тело, предел числа запросов) для эндпоинтов api.py на данных текущей базы.
+    Полная выгрузка каталога на больших наборах тяжелая, поэтому для нее число запросов ограничено
+    '''
+    rng = random.Random(seed)
+    product_ids = list(Product.objects.order_by('id').values_list('id', flat = True)[:1000])
+    products = rng.sample(product_ids, min(len(product_ids), 50))
+    category = Category.objects.order_by('id').values_list('slug', flat = True).first()
+    word = Product.objects.order_by('id').values_list('name', flat = True).first().split()[0]
+    middle = Product.objects.order_by('name', 'id').values_list('name', 'id')[Product.objects.count() // 2]
+    cursor = encode_cursor([('name', False), ('id', False)], list(middle))
+    user_id = Wishlist.objects.order_by('id').values_list('user_id', flat = True).first()
+    order_user_id = Order.objects.order_by('id').values_list('user_id', flat = True).first()
+    wishlist_ids = list(Wishlist.objects.order_by('id').values_list('id', flat = True)[:50])
+
+    return [
+        ('categories', 'GET', ['/api/categories'], None, None),
+        ('products', 'GET', ['/api/products'], None, None),
+        ('products_cursor', 'GET', [f'/api/products?cursor={ cursor }'], None, None),
+        ('product', 'GET', [f'/api/products/{ product_id }' for product_id in products], None, None),
+        ('products_faceted', 'GET', [f'/api/products?category={ category }&min_price=100&sort=price&facets=true'], None, None),
+        ('products_batch', 'GET', ['/api/products/batch?' + '&'.join(f'ids={ product_id }' for product_id in products)], None, None),
+        ('products_of_category', 'GET', [f'/api/products/{ category }/'], None, None),
+        ('search', 'GET', [f'/api/products/search?q={ word }'], None, None),
+        ('products_sort', 'GET', ['/api/products_sort?sort=desc'], None, None),
+        ('products_name_search', 'GET', [f'/api/products_name_search?search={ word }'], None, None),
+        ('wishlist', 'GET', [f'/api/wishlist/{ user_id }/'], None, None),
+        ('orders', 'GET', ['/api/orders'], None, None),
+        ('user_orders', 'GET', [f'/api/order/{ order_user_id }/'], None, None),
+        ('orders_summary', 'GET', ['/api/orders/summary'], None, None),
+        ('export_products', 'GET', ['/api/export/products'], None, 2),
+        ('async_products', 'GET', ['/api/async/products'], None, None),
+        ('async_product', 'GET', [f'/api/async/products/{ product_id }' for product_id in products], None, None),
+        ('wishlist_add', 'PUT', [f'/api/wishlist_add?wishlist_id={ wishlist_id }' for wishlist_id in wishlist_ids], None, None),
+    ]
+
+
+def client_sender(headers):
+    def send(method, path, body):
+        response = Client().generic(method, path, body or '', content_type = 'application/json', headers = headers)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, len(content)
+    return send
+
+
+def http_sender(port, headers):
+    '''API включает CSRF-защиту, поэтому запросы на запись по HTTP несут cookie и заголовок с одним секретом'''
+    secret = get_random_string(32)
+    headers = { **headers, 'Cookie': f'{ settings.CSRF_COOKIE_NAME }={ secret }', 'X-CSRFToken': secret }
+
+    def send(method, path, body):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout = 60)
+        try:
+            connection.request(method, path, body = body, headers = { **headers, 'Content-Type': 'application/json' })
+            response = connection.getresponse()
+            return response.status, len(response.read())
+        finally:
+            connection.close()
+    return send
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def start_wsgi():
+    server = make_server('127.0.0.1', 0, get_wsgi_application(), server_class = ThreadingWSGIServer, handler_class = QuietHandler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server.server_port, server.shutdown
+
+
+def start_asgi():
+    '''uvicorn — необязательная зависимость: без него цель asgi пропускается'''
+    try:
+        import uvicorn
+    except ImportError:
+        return None
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(get_asgi_application(), host = '127.0.0.1', port = port, log_level = 'warning', lifespan = 'off'))
+    server.install_signal_handlers = lambda: None
+    threading.Thread(target = server.run, daemon = True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+    return port, stop
+
+
+def percentile(values, q):
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def run_endpoint(send, endpoint, requests, concurrency):
+    '''Нагрузка на один эндпоинт; пиковая память измеряется отдельным запросом под tracemalloc, чтобы не искажать задержки'''
+    name, method, paths, body, limit = endpoint
+    requests = min(requests, limit or requests)
+    get_cache().clear()
+    send(method, paths[0], body)
+    registry.clear()
+
+    def one(number):
+        started = time.perf_counter()
+        status, size = send(method, paths[number % len(paths)], body)
+        return (time.perf_counter() - started) * 1000, status, size
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    queries = sum(histograms['queries'].sum for histograms in registry.operations.values())
+    observed = sum(histograms['queries'].count for histograms in registry.operations.values())
+
+    tracemalloc.start()
+    send(method, paths[0], body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings = sorted(timing for timing, _, _ in results)
+    return {
+        'endpoint': name,
+        'requests': requests,
+        'errors': sum(status >= 400 for _, status, _ in results),
+        'throughput': round(requests / elapsed, 1),
+        'latency_ms': { key: round(percentile(timings, q), 3) for key, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.0)) },
+        'queries_per_request': round(queries / observed, 2) if observed else None,
+        'response_bytes': round(sum(size for _, _, size in results) / len(results)),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(previous, current, threshold):
+    '''Строки сравнения по (цель, эндпоинт): рост p50 больше порога или рост числа запросов — регрессия'''
+    before = { (result['target'], result['endpoint']): result for result in previous['results'] }
+    rows = []
+    for result in current['results']:
+        old = before.get((result['target'], result['endpoint']))
+        if old is None:
+            continue
+        change = (result['latency_ms']['p50'] - old['latency_ms']['p50']) / old['latency_ms']['p50'] if old['latency_ms']['p50'] else 0.0
+        more_queries = (result['queries_per_request'] or 0) > (old['queries_per_request'] or 0)
+        rows.append({
+            'target': result['target'],
+            'endpoint': result['endpoint'],
+            'p50_before': old['latency_ms']['p50'],
+            'p50_after': result['latency_ms']['p50'],
+            'change': change,
+            'queries_before': old['queries_per_request'],
+            'queries_after': result['queries_per_request'],
+            'regression': change > threshold or more_queries,
+        })
+    return rows
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, cwd = settings.BASE_DIR, check = True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output = True, text = True, cwd = settings.BASE_DIR).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def use_database(path):
+    '''Все соединения, в том числе создаваемые позже в других потоках, открывают указанный файл'''
+    for alias in connections:
+        connections[alias].close()
+        connections.settings[alias]['NAME'] = path
+
+
+class Command(BaseCommand):
+    help = (
+        'Бенчмарк эндпоинтов API на синтетических данных через тестовый клиент, WSGI и ASGI сервер: '
+        'пропускная способность, перцентили задержки, запросы к базе, пиковая память; результат сохраняется в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices = DATASETS, default = '1k')
+        parser.add_argument('--targets', default = 'client,wsgi,asgi', help = 'Через запятую: ' + ', '.join(TARGETS))
+        parser.add_argument('--endpoints', default = '', help = 'Только эндпоинты, в названии которых есть одна из подстрок через запятую')
+        parser.add_argument('--requests', type = int, default = 200)
+        parser.add_argument('--concurrency', type = int, default = 8)
+        parser.add_argument('--database', help = 'Файл SQLite для данных; по умолчанию во временном каталоге, повторно используется между запусками')
+        parser.add_argument('--regenerate', action = 'store_true', help = 'Пересоздать набор данных')
+        parser.add_argument('--output', help = 'Файл результатов; по умолчанию benchmarks/<набор>-<коммит>.json')
+        parser.add_argument('--compare', help = 'Файл результатов предыдущего запуска для сравнения')
+        parser.add_argument('--threshold', type = float, default = 0.2, help = 'Допустимый рост p50 при сравнении (0.2 = 20%%)')
+        parser.add_argument('--fail-on-regression', action = 'store_true')
+
+    @override_settings(DEBUG = False, ALLOWED_HOSTS = ['*'], RATE_LIMIT_ENABLED = False)
+    def handle(self, *args, **options):
+        targets = [target.strip() for target in options['targets'].split(',') if target.strip()]
+        unknown = set(targets) - set(TARGETS)
+        if unknown:
+            raise CommandError(f'Неизвестные цели: { ", ".join(sorted(unknown)) }')
+
+        sizes = DATASETS[options['dataset']]
+        path = Path(options['database'] or Path(tempfile.gettempdir()) / f'ninjashop-benchmark-{ options["dataset"] }.sqlite3')
+        if options['regenerate']:
+            for suffix in ('', '-wal', '-shm'):
+                Path(f'{ path }{ suffix }').unlink(missing_ok = True)
+        use_database(path)
+        call_command('migrate', verbosity = 0)
+        if not Product.objects.exists():
+            self.stdout.write(f'Генерация набора { options["dataset"] } в { path }...')
+            started = time.perf_counter()
+            generate(sizes)
+            self.stdout.write(f'Готово за { time.perf_counter() - started:.1f} с')
+
+        user, _ = User.objects.get_or_create(username = 'benchmark', defaults = { 'is_staff': True, 'is_superuser': True })
+        token = generate_token()
+        ApiToken.objects.create(user = user, name = 'benchmark', digest = token_digest(token))
+        headers = { 'Authorization': f'Bearer { token }' }
+
+        endpoints = build_endpoints()
+        if options['endpoints']:
+            patterns = options['endpoints'].split(',')
+            endpoints = [endpoint for endpoint in endpoints if any(pattern in endpoint[0] for pattern in patterns)]
+
+        results = []
+        for target in targets:
+            if target == 'client':
+                send, stop = client_sender(headers), None
+            else:
+                server = start_wsgi() if target == 'wsgi' else start_asgi()
+                if server is None:
+                    self.stdout.write(self.style.WARNING(f'{ target }: uvicorn не установлен, цель пропущена'))
+                    continue
+                port, stop = server
+                send = http_sender(port, headers)
+
+            self.stdout.write(f'\n{ target }: { options["requests"] } запросов, { options["concurrency"] } клиентов')
+            try:
+                for endpoint in endpoints:
+                    result = { 'target': target, **run_endpoint(send, endpoint, options['requests'], options['concurrency']) }
+                    results.append(result)
+                    latency = result['latency_ms']
+                    self.stdout.write(
+                        f'  { result["endpoint"]:<22} { result["throughput"]:8.1f} запр/с  p50 = { latency["p50"]:8.2f}  '
+                        f'p99 = { latency["p99"]:8.2f} мс  запросов к БД: { result["queries_per_request"] }  '
+                        f'память: { result["peak_memory_kb"]:8.1f} КБ  ошибок: { result["errors"] }'
+                    )
+            finally:
+                if stop:
+                    stop()
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'dataset': options['dataset'],
+                'sizes': sizes,
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            },
+            'results': results,
+        }
+        output = Path(options['output'] or settings.BASE_DIR / 'benchmarks' / f'{ options["dataset"] }-{ report["meta"]["revision"] }.json')
+        output.parent.mkdir(parents = True, exist_ok = True)
+        output.write_text(json.dumps(report, ensure_ascii = False, indent = 2))
+        self.stdout.write(f'\nРезультаты сохранены в { output }')
+
+        if options['compare']:
+            rows = compare(json.loads(Path(options['compare']).read_text()), report, options['threshold'])
+            self.stdout.write(f'\nСравнение с { options["compare"] }:')
+            for row in rows:
+                self.stdout.write(
+                    f'  { "РЕГРЕССИЯ" if row["regression"] else "ok":<10} { row["target"]:<7} { row["endpoint"]:<22} '
+                    f'p50 { row["p50_before"]:8.2f} -> { row["p50_after"]:8.2f} мс ({ row["change"]:+.0%})  '
+                    f'запросов { row["queries_before"] } -> { row["queries_after"] }'
+                )
+            if options['fail_on_regression'] and any(row['regression'] for row in rows):
+                raise CommandError('Обнаружены регрессии производительности')
@@ -0,0 +1,70 @@
+import base64
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from .benchmark_api import http_sender, start_asgi, start_wsgi
+
+
+def summary(name, timings, elapsed, errors):
+    timings = sorted(timings)
+    p99 = timings[max(int(len(timings) * 0.99) - 1, 0)]
+    return (
+        f'{ name:<6} { len(timings) / elapsed:8.1f} запр/с  p50 = { statistics.median(timings):7.2f} мс  '
+        f'p99 = { p99:7.2f} мс  ошибок: { errors }'
+    )
+
+
+'''Кэш отключен на время замера: синхронный список товаров кэшируется, асинхронный нет, и сравнение было бы нечестным'''
+NO_CACHE = { alias: { 'BACKEND': 'django.core.cache.backends.dummy.DummyCache' } for alias in settings.CACHES }
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочное сравнение синхронного эндпоинта под WSGI и асинхронного под ASGI (uvicorn) при конкурентных клиентах. '
+        'Оба сервера запускаются по HTTP теми же функциями, что в benchmark_api, кэш отключен'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default = '/orders?limit=50', help = 'Путь относительно /api и /api/async')
+        parser.add_argument('--requests', type = int, default = 500)
+        parser.add_argument('--concurrency', type = int, default = 32)
+        parser.add_argument('--username', default = 'admin')
+        parser.add_argument('--password', default = 'admin')
+
+    @override_settings(DEBUG = False, ALLOWED_HOSTS = ['*'], RATE_LIMIT_ENABLED = False, CACHES = NO_CACHE)
+    def handle(self, *args, **options):
+        credentials = base64.b64encode(f'{ options["username"] }:{ options["password"] }'.encode()).decode()
+        headers = { 'Authorization': f'Basic { credentials }' }
+        total, concurrency = options['requests'], options['concurrency']
+
+        asgi = start_asgi()
+        if asgi is None:
+            raise CommandError('Для сравнения нужен uvicorn: pip install uvicorn')
+        wsgi = start_wsgi()
+        targets = [('WSGI', '/api', wsgi), ('ASGI', '/api/async', asgi)]
+
+        self.stdout.write(f'Запросов: { total }, конкурентных клиентов: { concurrency }, путь: { options["path"] }')
+        try:
+            for name, prefix, (port, _) in targets:
+                send = http_sender(port, headers)
+                path = f'{ prefix }{ options["path"] }'
+
+                def request(_):
+                    started = time.perf_counter()
+                    status, size = send('GET', path, None)
+                    return (time.perf_counter() - started) * 1000, status
+
+                '''Прогрев: проверка пароля и первые запросы не должны попадать в замер'''
+                request(None)
+
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers = concurrency) as executor:
+                    results = list(executor.map(request, range(total)))
+                elapsed = time.perf_counter() - started
+                self.stdout.write(summary(name, [timing for timing, _ in results], elapsed, sum(status != 200 for _, status in results)))
+        finally:
+            for _, _, (_, stop) in targets:
+                stop()
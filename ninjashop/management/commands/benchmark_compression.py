@@ -0,0 +1,91 @@
+import json
+import tempfile
+import time
+from pathlib import Path
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from ninjashop.auth import generate_token, token_digest
+from ninjashop.compression import available_encodings, compress, compress_stream
+from ninjashop.models import ApiToken, Product
+from .benchmark_api import DATASETS, generate, use_database
+
+
+'''Ответы для замера: страницы списков максимального размера и потоковая выгрузка'''
+PATHS = [
+    '/api/products?limit=200',
+    '/api/orders?limit=200',
+    '/api/users?limit=200',
+    '/api/export/products',
+]
+
+DEFAULT_LEVELS = { 'gzip': '1,3,6,9', 'br': '1,4,9', 'zstd': '1,3,9' }
+
+
+def measure(body, encoding, level, repeat, chunks = None):
+    '''Лучшее время из repeat попыток; для потоковых ответов сжатие по частям со сбросом после каждой'''
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        if chunks is None:
+            size = len(compress(body, encoding, level))
+        else:
+            size = sum(len(part) for part in compress_stream(chunks, encoding, level))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        'encoding': encoding,
+        'level': level,
+        'compressed_bytes': size,
+        'ratio': round(size / len(body), 4),
+        'saved_bytes': len(body) - size,
+        'cpu_ms': round(best * 1000, 3),
+        'mb_per_s': round(len(body) / best / 1e6, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Стоимость сжатия ответов API по CPU против сэкономленных байт для каждого алгоритма и уровня'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices = DATASETS, default = '1k')
+        parser.add_argument('--database', help = 'Файл SQLite с данными; по умолчанию общий с benchmark_api')
+        for encoding, levels in DEFAULT_LEVELS.items():
+            parser.add_argument(f'--{ encoding }-levels', default = levels, help = f'Уровни { encoding } через запятую')
+        parser.add_argument('--repeat', type = int, default = 5)
+        parser.add_argument('--output', help = 'Сохранить результаты в JSON')
+
+    @override_settings(DEBUG = False, ALLOWED_HOSTS = ['*'])
+    def handle(self, *args, **options):
+        path = Path(options['database'] or Path(tempfile.gettempdir()) / f'ninjashop-benchmark-{ options["dataset"] }.sqlite3')
+        use_database(path)
+        call_command('migrate', verbosity = 0)
+        if not Product.objects.exists():
+            generate(DATASETS[options['dataset']])
+
+        user, _ = User.objects.get_or_create(username = 'benchmark', defaults = { 'is_staff': True, 'is_superuser': True })
+        token = generate_token()
+        ApiToken.objects.create(user = user, name = 'benchmark', digest = token_digest(token))
+        client = Client(headers = { 'Authorization': f'Bearer { token }' })
+
+        results = []
+        for url in PATHS:
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{ url }: ответ { response.status_code }')
+            chunks = list(response.streaming_content) if response.streaming else None
+            body = b''.join(chunks) if chunks else response.content
+            self.stdout.write(f'\n{ url }: { len(body) } байт{ ", потоковый, частей: " + str(len(chunks)) if chunks else "" }')
+            for encoding in available_encodings():
+                for level in [int(level) for level in options[f'{ encoding }_levels'].split(',')]:
+                    result = { 'path': url, 'bytes': len(body), **measure(body, encoding, level, options['repeat'], chunks) }
+                    results.append(result)
+                    self.stdout.write(
+                        f'  { encoding:<5} уровень { level:<2}  { result["compressed_bytes"]:>10} байт  '
+                        f'({ result["ratio"]:.1%})  { result["cpu_ms"]:9.2f} мс  { result["mb_per_s"]:7.1f} МБ/с'
+                    )
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, ensure_ascii = False, indent = 2))
+            self.stdout.write(f'\nРезультаты сохранены в { options["output"] }')
@@ -0,0 +1,81 @@
+import random
+import sqlite3
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from ninjashop.search import DatabaseIndex, MemoryIndex
+
+
+SYLLABLES = ['sa', 'mi', 'ko', 'ra', 'te', 'lu', 'vi', 'no', 'ga', 'pe', 'зу', 'ма', 'ри', 'то', 'ле', 'ка']
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнение задержки поиска на синтетическом каталоге: LIKE по таблице, SQLite FTS5, DatabaseIndex '
+        '(резервный поиск без FTS5) и индекс в памяти (только для одного процесса)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type = int, default = 100000)
+        parser.add_argument('--queries', type = int, default = 200)
+        parser.add_argument('--seed', type = int, default = 0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words = list({ ''.join(rng.choices(SYLLABLES, k = rng.randint(2, 5))) for _ in range(20000) })
+        rows = [
+            (
+                product_id,
+                ' '.join(rng.choices(words, k = 3)),
+                ' '.join(rng.choices(words, k = 30)),
+            )
+            for product_id in range(1, options['products'] + 1)
+        ]
+        queries = [rng.choice(words) for _ in range(options['queries'])]
+
+        database = sqlite3.connect(':memory:')
+        '''Таблица названа как у модели Product, чтобы выполнять SQL, который строит DatabaseIndex'''
+        database.execute('CREATE TABLE ninjashop_product (id INTEGER PRIMARY KEY, name TEXT, description TEXT)')
+        database.execute("CREATE VIRTUAL TABLE product_fts USING fts5(name, description, tokenize = 'unicode61 remove_diacritics 2')")
+        database.executemany('INSERT INTO ninjashop_product VALUES (?, ?, ?)', rows)
+        database.executemany('INSERT INTO product_fts (rowid, name, description) VALUES (?, ?, ?)', rows)
+
+        index = MemoryIndex()
+        for row in rows:
+            index._add(*row)
+        index._loaded = True
+
+        def like(query):
+            pattern = f'%{ query }%'
+            return database.execute(
+                'SELECT id FROM ninjashop_product WHERE name LIKE ? OR description LIKE ? ORDER BY name LIMIT 20', (pattern, pattern)
+            ).fetchall()
+
+        def fts5(query):
+            return database.execute(
+                'SELECT rowid FROM product_fts WHERE product_fts MATCH ? ORDER BY bm25(product_fts, 10.0, 1.0) LIMIT 20',
+                (f'"{ query }"*', )
+            ).fetchall()
+
+        fallback = DatabaseIndex()
+
+        def orm(query):
+            '''SQL компилируется для базы по умолчанию (SQLite) и выполняется на синтетической таблице'''
+            sql, params = fallback.ranked(fallback._terms(query))[:20].query.sql_with_params()
+            return database.execute(sql.replace('%s', '?'), params).fetchall()
+
+        def memory(query):
+            return index.search(query, limit = 20)
+
+        self.stdout.write(f'Товаров: { len(rows) }, запросов: { len(queries) }')
+        for name, search in (('LIKE %x%', like), ('FTS5', fts5), ('DatabaseIndex', orm), ('Индекс в памяти', memory)):
+            timings = []
+            for query in queries:
+                started = time.perf_counter()
+                search(query)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write(
+                f'{ name:<16} p50 = { statistics.median(timings):8.2f} мс  '
+                f'p95 = { timings[int(len(timings) * 0.95) - 1]:8.2f} мс  max = { timings[-1]:8.2f} мс'
+            )
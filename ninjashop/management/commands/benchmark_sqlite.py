@@ -0,0 +1,100 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ninjashop.db import SQLITE_PRAGMAS, apply_pragmas
+
+
+'''
+Режимы: настройки SQLite по умолчанию с новым соединением на каждый запрос (как было),
+те же настройки с постоянным соединением, и PRAGMA из SQLITE_PRAGMAS с постоянными соединениями
+'''
+MODES = [
+    ('по умолчанию', {}, False, 5),
+    ('+ постоянные соединения', {}, True, 5),
+    ('WAL + PRAGMA', { 'journal_mode': 'WAL', **SQLITE_PRAGMAS }, True, 20),
+]
+
+
+class Worker(threading.Thread):
+    def __init__(self, path, pragmas, persistent, timeout, deadline, writer):
+        super().__init__()
+        self.path, self.pragmas, self.persistent, self.timeout = path, pragmas, persistent, timeout
+        self.deadline, self.writer = deadline, writer
+        self.done = self.locked = 0
+        self.connection = None
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout = self.timeout, isolation_level = None, check_same_thread = False)
+        apply_pragmas(connection.cursor(), self.pragmas, read_only = not self.writer)
+        return connection
+
+    def operation(self, connection):
+        if self.writer:
+            '''Как изменение листа желаний: чтение и UPDATE в одной транзакции'''
+            connection.execute('BEGIN IMMEDIATE' if self.pragmas else 'BEGIN')
+            try:
+                connection.execute('SELECT quantity FROM ninjashop_wishlist WHERE id = 1').fetchone()
+                connection.execute('UPDATE ninjashop_wishlist SET quantity = quantity + 1 WHERE id = 1')
+                connection.execute('COMMIT')
+            except sqlite3.OperationalError:
+                connection.execute('ROLLBACK')
+                raise
+        else:
+            connection.execute('SELECT id, name, price FROM ninjashop_product ORDER BY name, id LIMIT 50').fetchall()
+
+    def run(self):
+        while time.perf_counter() < self.deadline:
+            connection = self.connection if self.persistent and self.connection else self.connect()
+            self.connection = connection
+            try:
+                self.operation(connection)
+                self.done += 1
+            except sqlite3.OperationalError:
+                self.locked += 1
+            if not self.persistent:
+                connection.close()
+                self.connection = None
+        if self.connection:
+            self.connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Конкурентная нагрузка на копию базы: настройки SQLite по умолчанию против WAL, PRAGMA и постоянных соединений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type = int, default = 4)
+        parser.add_argument('--readers', type = int, default = 16)
+        parser.add_argument('--seconds', type = float, default = 5)
+
+    def handle(self, *args, **options):
+        source = settings.DATABASES['default']['NAME']
+        self.stdout.write(f'Писателей: { options["writers"] }, читателей: { options["readers"] }, { options["seconds"] } с на режим')
+
+        for name, pragmas, persistent, timeout in MODES:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'db.sqlite3')
+                shutil.copy(source, path)
+                '''Копия в исходном режиме журнала, даже если основная база уже переведена в WAL'''
+                with sqlite3.connect(path) as connection:
+                    connection.execute('PRAGMA journal_mode = DELETE')
+
+                deadline = time.perf_counter() + options['seconds']
+                workers = [Worker(path, pragmas, persistent, timeout, deadline, writer = True) for _ in range(options['writers'])]
+                workers += [Worker(path, pragmas, persistent, timeout, deadline, writer = False) for _ in range(options['readers'])]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+
+            writes = sum(worker.done for worker in workers if worker.writer)
+            reads = sum(worker.done for worker in workers if not worker.writer)
+            locked = sum(worker.locked for worker in workers)
+            self.stdout.write(
+                f'{ name:<24} записей/с: { writes / options["seconds"]:8.1f}  чтений/с: { reads / options["seconds"]:9.1f}  '
+                f'database is locked: { locked }'
+            )
@@ -0,0 +1,47 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ninja.errors import HttpError
+from ninjashop.images import generate_variants, store_upload
+from ninjashop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Переименовывает изображения товаров по хешу содержимого, удаляет копии и строит уменьшенные варианты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', action = 'store_true', help = 'Не удалять файлы, на которые больше не ссылается ни один товар')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image = '').exclude(image__isnull = True).only('id', 'image')
+        renamed, stored = {}, set()
+        for name in products.values_list('image', flat = True).distinct():
+            if not default_storage.exists(name):
+                self.stderr.write(f'Файл не найден: { name }')
+                continue
+            try:
+                with default_storage.open(name) as source:
+                    renamed[name] = store_upload(source)
+            except HttpError as error:
+                self.stderr.write(f'{ name }: { error }')
+                continue
+            if renamed[name] not in stored:
+                generate_variants(renamed[name])
+                stored.add(renamed[name])
+
+        changed = [product for product in products if renamed.get(product.image.name, product.image.name) != product.image.name]
+        for product in changed:
+            product.image.name = renamed[product.image.name]
+        with transaction.atomic():
+            '''save() по одному: сигналы сбрасывают кэш каталога и карточки товара'''
+            for product in changed:
+                product.save(update_fields = ['image'])
+
+        removed = 0
+        if not options['keep']:
+            referenced = set(Product.objects.values_list('image', flat = True))
+            for name in set(renamed) - set(renamed.values()) - referenced:
+                default_storage.delete(name)
+                removed += 1
+
+        self.stdout.write(f'Файлов: { len(renamed) }, уникальных: { len(stored) }, товаров обновлено: { len(changed) }, удалено копий: { removed }')
@@ -0,0 +1,240 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from ninja import NinjaAPI, Router
+
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+'''
+Заголовок Server-Timing раскрывает время запросов к базе. True — всем, 'staff' — только сотрудникам,
+False — никому; по умолчанию только при DEBUG
+'''
+METRICS_SERVER_TIMING = getattr(settings, 'METRICS_SERVER_TIMING', settings.DEBUG)
+
+
+class Histogram:
+    '''Счетчики по корзинам как у гистограммы Prometheus; перцентили оцениваются интерполяцией внутри корзины'''
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_time', 'serialize_time', 'view_finished')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.serialize_time = 0.0
+        self.view_finished = None
+
+
+'''Статистика текущего запроса; контекст копируется в потоки sync_to_async, поэтому запросы ORM из async view тоже учитываются'''
+current = contextvars.ContextVar('ninjashop_request_stats', default = None)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+
+
+def install_query_wrapper(connection):
+    '''Вызывается для каждого нового соединения; список обработчиков переживает переподключение, поэтому без повторов'''
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+@contextmanager
+def timed_serialization():
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current.get()
+        if stats is not None:
+            stats.serialize_time += time.perf_counter() - started
+
+
+class Registry:
+    '''Метрики по операциям (метод и шаблон маршрута) в памяти процесса'''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.requests = {}
+            self.operations = {}
+
+    def observe(self, method, operation, status, duration, stats, size):
+        with self._lock:
+            key = (method, operation)
+            histograms = self.operations.get(key)
+            if histograms is None:
+                histograms = self.operations[key] = {
+                    'duration': Histogram(DURATION_BUCKETS),
+                    'queries': Histogram(QUERY_BUCKETS),
+                    'query_time': Histogram(DURATION_BUCKETS),
+                    'serialize_time': Histogram(DURATION_BUCKETS),
+                    'size': Histogram(SIZE_BUCKETS),
+                }
+            histograms['duration'].observe(duration)
+            histograms['queries'].observe(stats.queries)
+            histograms['query_time'].observe(stats.query_time)
+            histograms['serialize_time'].observe(stats.serialize_time)
+            if size is not None:
+                histograms['size'].observe(size)
+            counter = (method, operation, status)
+            self.requests[counter] = self.requests.get(counter, 0) + 1
+
+    def render(self):
+        '''Текстовый формат экспозиции Prometheus 0.0.4'''
+        families = (
+            ('duration', 'ninjashop_request_duration_seconds', 'Время обработки запроса'),
+            ('queries', 'ninjashop_db_queries', 'Количество запросов к базе данных на запрос'),
+            ('query_time', 'ninjashop_db_query_duration_seconds', 'Время запросов к базе данных на запрос'),
+            ('serialize_time', 'ninjashop_serialization_duration_seconds', 'Время сериализации ответа'),
+            ('size', 'ninjashop_response_size_bytes', 'Размер тела ответа'),
+        )
+        with self._lock:
+            lines = [
+                '# HELP ninjashop_requests_total Количество запросов',
+                '# TYPE ninjashop_requests_total counter',
+            ]
+            for (method, operation, status), count in sorted(self.requests.items()):
+                lines.append(f'ninjashop_requests_total{{{ _labels(method, operation) },status="{ status }"}} { count }')
+
+            for field, name, description in families:
+                lines += [f'# HELP { name } { description }', f'# TYPE { name } histogram']
+                for (method, operation), histograms in sorted(self.operations.items()):
+                    histogram = histograms[field]
+                    labels = _labels(method, operation)
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{ name }_bucket{{{ labels },le="{ bound }"}} { cumulative }')
+                    lines.append(f'{ name }_bucket{{{ labels },le="+Inf"}} { histogram.count }')
+                    lines.append(f'{ name }_sum{{{ labels }}} { histogram.sum }')
+                    lines.append(f'{ name }_count{{{ labels }}} { histogram.count }')
+
+            name = 'ninjashop_request_duration_quantile_seconds'
+            lines += [f'# HELP { name } Перцентили времени обработки запроса, оценка по гистограмме', f'# TYPE { name } gauge']
+            for (method, operation), histograms in sorted(self.operations.items()):
+                for q in QUANTILES:
+                    lines.append(f'{ name }{{{ _labels(method, operation) },quantile="{ q }"}} { histograms["duration"].quantile(q) }')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(method, operation):
+    operation = operation.replace('\\', '\\\\').replace('"', '\\"')
+    return f'method="{ method }",operation="{ operation }"'
+
+
+registry = Registry()
+
+
+def show_server_timing(request):
+    if METRICS_SERVER_TIMING == 'staff':
+        user = getattr(request, 'auth', None) or getattr(request, 'user', None)
+        return bool(getattr(user, 'is_staff', False))
+    return bool(METRICS_SERVER_TIMING)
+
+
+def server_timing(duration, stats):
+    return (
+        f'total;dur={ duration * 1000:.2f}, '
+        f'db;dur={ stats.query_time * 1000:.2f};desc="{ stats.queries } queries", '
+        f'serialize;dur={ stats.serialize_time * 1000:.2f}'
+    )
+
+
+def _view_finished():
+    stats = current.get()
+    if stats is not None:
+        stats.view_finished = time.perf_counter()
+
+
+def mark_view_end(view_func):
+    '''Отмечает, когда view вернула результат: дальше ninja проверяет его по схеме ответа и рендерит'''
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_view(request, *args, **kwargs):
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                _view_finished()
+        return async_view
+
+    @wraps(view_func)
+    def view(request, *args, **kwargs):
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            _view_finished()
+    return view
+
+
+class InstrumentedRouter(Router):
+    def add_api_operation(self, path, methods, view_func, **kwargs):
+        super().add_api_operation(path, methods, mark_view_end(view_func), **kwargs)
+
+
+class InstrumentedAPI(NinjaAPI):
+    '''
+    NinjaAPI, в котором время сериализации — весь шаг ответа операции: от возврата view до готового
+    ответа create_response, то есть проверка и model_dump схемы ответа (pydantic) и рендеринг JSON.
+    Используются только публичные точки расширения: default_router, Router.add_api_operation и create_response
+    '''
+    def __init__(self, *args, default_router = None, **kwargs):
+        super().__init__(*args, default_router = default_router or InstrumentedRouter(), **kwargs)
+
+    def create_response(self, request, *args, **kwargs):
+        stats = current.get()
+        started = time.perf_counter()
+        if stats is not None and stats.view_finished is not None:
+            started = stats.view_finished
+        try:
+            return super().create_response(request, *args, **kwargs)
+        finally:
+            if stats is not None:
+                stats.serialize_time += time.perf_counter() - started
+                stats.view_finished = None
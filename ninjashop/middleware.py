@@ -0,0 +1,116 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.cache import patch_vary_headers
+from .cache import CATALOG_CACHE_TIMEOUT, get_cache
+from .compression import COMPRESSION_LEVELS, COMPRESSION_MIN_SIZE, acompress_stream, choose_encoding, compress, compress_stream, is_compressible
+from .metrics import RequestStats, current, registry, server_timing, show_server_timing
+
+
+class InstrumentationMiddleware:
+    '''
+    Время обработки, количество и время запросов к базе, время сериализации и размер ответа
+    по каждой операции API. Для потоковых ответов учитывается время до начала передачи
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, time.perf_counter() - started, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, time.perf_counter() - started, stats)
+
+    def finish(self, request, response, duration, stats):
+        match = request.resolver_match
+        operation = f'/{ match.route }' if match else 'unmatched'
+        size = None if response.streaming else len(response.content)
+        registry.observe(request.method, operation, response.status_code, duration, stats, size)
+        if show_server_timing(request):
+            response['Server-Timing'] = server_timing(duration, stats)
+        return response
+
+
+class CompressionMiddleware:
+    '''
+    Сжатие ответов API (COMPRESSION_TYPES) gzip, а также brotli и zstd, если установлены. Потоковые ответы
+    сжимаются по частям, маленькие тела и остальные типы (HTML админки, изображения) отдаются как есть. Сжатые варианты закэшированных
+    ответов каталога хранятся в кэше рядом с ответом и сбрасываются вместе с ним
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    def process(self, request, response):
+        if not is_compressible(response) or response.status_code in (204, 304):
+            return response
+        if not response.streaming and len(response.content) < COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_stream(response.streaming_content, encoding)
+            else:
+                response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            response.content = self.compressed_content(response, encoding)
+            response['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and not etag.startswith('W/'):
+            '''Сжатое тело отличается побайтно, поэтому ETag становится слабым'''
+            response['ETag'] = f'W/{ etag }'
+        response['Content-Encoding'] = encoding
+        return response
+
+    def compressed_content(self, response, encoding):
+        key = getattr(response, 'cache_key', None)
+        if key is None:
+            return compress(response.content, encoding)
+        cache = get_cache()
+        key = f'{ key }:{ encoding }:{ COMPRESSION_LEVELS[encoding] }'
+        content = cache.get(key)
+        if content is None:
+            content = compress(response.content, encoding)
+            cache.set(key, content, CATALOG_CACHE_TIMEOUT)
+        return content
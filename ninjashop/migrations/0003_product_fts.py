@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+FTS_TABLE = 'ninjashop_product_fts'
+
+
+def create_fts_table(apps, schema_editor):
+    '''Виртуальная таблица FTS5 создается только на SQLite, на других базах поиск идет запросом к таблице товаров (DatabaseIndex)'''
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Product = apps.get_model('ninjashop', 'Product')
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS { FTS_TABLE } "
+        f"USING fts5(name, description, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    for row in Product.objects.values_list('id', 'name', 'description').iterator():
+        schema_editor.execute(f'INSERT INTO { FTS_TABLE } (rowid, name, description) VALUES (%s, %s, %s)', row)
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS { FTS_TABLE }')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ninjashop', '0002_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
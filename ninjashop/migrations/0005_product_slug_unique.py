@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 01:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ninjashop', '0004_apitoken'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(max_length=250, unique=True, verbose_name='Slug'),
+        ),
+    ]
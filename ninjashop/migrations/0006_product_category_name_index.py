@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-17 01:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ninjashop', '0005_product_slug_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'name', 'id'], name='product_category_name_id_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def enable_wal(apps, schema_editor):
+    '''
+    Режим журнала хранится в файле базы, поэтому включается один раз явной миграцией,
+    а не при каждом подключении. WAL позволяет читателям не блокировать писателя
+    '''
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('PRAGMA journal_mode = WAL')
+
+
+def disable_wal(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('PRAGMA journal_mode = DELETE')
+
+
+class Migration(migrations.Migration):
+    '''PRAGMA journal_mode нельзя менять внутри транзакции'''
+    atomic = False
+
+    dependencies = [
+        ('ninjashop', '0007_product_category_price_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, disable_wal),
+    ]
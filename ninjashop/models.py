@@ -1,4 +1,7 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.urls import reverse
 
@@ -11,6 +14,9 @@ class Category(models.Model):
         ordering = ('name', )
         verbose_name = 'Категория'
         verbose_name_plural = 'Категории'
+        indexes = [
+            models.Index(fields = ['name', 'id'], name = 'category_name_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -19,7 +25,7 @@ class Category(models.Model):
 class Product(models.Model):
     category = models.ForeignKey(Category, verbose_name = 'Категория', related_name = 'products', on_delete = models.CASCADE)
     name = models.CharField(verbose_name = 'Наименование', max_length = 250)
-    slug = models.SlugField(verbose_name = 'Slug', max_length = 250)
+    slug = models.SlugField(verbose_name = 'Slug', max_length = 250, unique = True)
     price = models.DecimalField(verbose_name = 'Цена', max_digits = 10, decimal_places = 2)
     description = models.TextField(verbose_name = 'Описание', blank = True, null = True)
     image = models.ImageField(verbose_name = 'Изображение', upload_to = 'images/', blank = True, null = True)
@@ -28,6 +34,12 @@ class Product(models.Model):
         ordering = ('name', )
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        indexes = [
+            models.Index(fields = ['name', 'id'], name = 'product_name_id_idx'),
+            models.Index(fields = ['price', 'id'], name = 'product_price_id_idx'),
+            models.Index(fields = ['category', 'name', 'id'], name = 'product_category_name_id_idx'),
+            models.Index(fields = ['category', 'price', 'id'], name = 'product_category_price_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -73,9 +85,19 @@ class Order(models.Model):
         ordering = ('created_at', )
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        indexes = [
+            models.Index(fields = ['created_at', 'id'], name = 'order_created_at_id_idx'),
+        ]
 
     def get_total_amount(self):
-        return sum(item.get_amount() for item in self.order_items.all())
+        return self.order_items.aggregate(total = Sum(F('cost')))['total'] or Decimal('0')
+
+    def update_total(self):
+        '''Пересчитывает сохраненную итоговую стоимость одним UPDATE с подзапросом'''
+        items_total = OrderItem.objects.filter(order = OuterRef('pk')).values('order').annotate(total = Sum('cost')).values('total')
+        Order.objects.filter(pk = self.pk).update(
+            total = Coalesce(Subquery(items_total, output_field = models.DecimalField(max_digits = 10, decimal_places = 2)), Decimal('0'))
+        )
 
 
 class OrderItem(models.Model):
@@ -89,5 +111,34 @@ class OrderItem(models.Model):
         verbose_name_plural = 'Позиции заказа'
 
     def get_amount(self):
-        self.cost = self.product.price * self.quantity
-        return self.cost
\ No newline at end of file
+        return self.cost
+
+
+class ApiToken(models.Model):
+    user = models.ForeignKey(User, verbose_name = 'Пользователь', related_name = 'tokens', on_delete = models.CASCADE)
+    name = models.CharField(verbose_name = 'Наименование', max_length = 250, blank = True)
+    digest = models.CharField(verbose_name = 'Хеш токена', max_length = 64, unique = True)
+    created_at = models.DateTimeField(verbose_name = 'Дата создания', auto_now_add = True)
+
+    class Meta:
+        verbose_name = 'API-токен'
+        verbose_name_plural = 'API-токены'
+
+    def __str__(self):
+        return self.user.username + ' - ' + self.name
+
+
+class CacheVersion(models.Model):
+    '''
+    Версия пространства имен кэша каталога. Хранится в базе, а не в кэше процесса,
+    поэтому изменение, сделанное одним процессом, сразу видят все остальные
+    '''
+    namespace = models.CharField(verbose_name = 'Пространство имен', max_length = 250, primary_key = True)
+    version = models.BigIntegerField(verbose_name = 'Версия')
+
+    class Meta:
+        verbose_name = 'Версия кэша'
+        verbose_name_plural = 'Версии кэша'
+
+    def __str__(self):
+        return f'{ self.namespace }: { self.version }'
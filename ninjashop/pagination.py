@@ -0,0 +1,123 @@
+import base64
+import json
+from functools import lru_cache
+from typing import Any, List, Optional
+from ninja import Field, Schema
+from ninja.conf import settings as ninja_settings
+from ninja.errors import HttpError
+from ninja.pagination import PaginationBase
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+from .queries import SchemaRow
+
+
+PAGINATION_MAX_LIMIT = getattr(settings, 'PAGINATION_MAX_LIMIT', 100)
+
+
+def ordering_names(fields):
+    return [('-' if descending else '') + name for name, descending in fields]
+
+
+def encode_cursor(fields, values):
+    '''Курсор хранит и порядок сортировки, по которому получены значения ключа'''
+    data = json.dumps({ 'order': ordering_names(fields), 'values': values }, cls = DjangoJSONEncoder, separators = (',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, TypeError):
+        raise HttpError(400, 'Некорректный курсор!')
+    if not isinstance(data, dict) or not isinstance(data.get('values'), list) or len(data['values']) != len(fields):
+        raise HttpError(400, 'Некорректный курсор!')
+    if data.get('order') != ordering_names(fields):
+        raise HttpError(400, 'Курсор получен для другой сортировки!')
+    return data['values']
+
+
+def get_ordering(queryset: QuerySet):
+    '''Порядок сортировки queryset с уникальным pk в конце, чтобы ключ страницы был однозначным'''
+    ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+    fields = []
+    for field in ordering:
+        if not isinstance(field, str):
+            raise TypeError('Курсорная пагинация поддерживает только сортировку по именам полей')
+        fields.append((field.lstrip('-'), field.startswith('-')))
+
+    pk = queryset.model._meta.pk.name
+    if not any(name in ('pk', pk) for name, _ in fields):
+        fields.append((pk, fields[-1][1] if fields else False))
+    return fields
+
+
+def get_value(obj, name):
+    '''Значение ключа сортировки у модели или у словаря из values_queryset'''
+    if isinstance(obj, SchemaRow):
+        return obj.row[name]
+    for attribute in name.split('__'):
+        obj = getattr(obj, attribute)
+    return obj
+
+
+def keyset_filter(fields, values):
+    '''(a, b) > (x, y)  ->  a > x OR (a = x AND b > y)'''
+    condition = Q()
+    for index, (name, descending) in enumerate(fields):
+        step = Q(**{ f'{ name }__{ "lt" if descending else "gt" }': values[index] })
+        for position, (previous, _) in enumerate(fields[:index]):
+            step &= Q(**{ previous: values[position] })
+        condition |= step
+    return condition
+
+
+class KeysetPagination(PaginationBase):
+    '''
+    Курсорная (keyset) пагинация: следующая страница выбирается условием по ключу сортировки,
+    поэтому стоимость любой страницы равна стоимости первой, в отличие от LIMIT/OFFSET
+    '''
+    class Input(Schema):
+        cursor: Optional[str] = Field(None, description = 'Курсор следующей страницы')
+        limit: int = Field(ninja_settings.PAGINATION_PER_PAGE, ge = 1, le = PAGINATION_MAX_LIMIT)
+
+    class Output(Schema):
+        items: List[Any]
+        next: Optional[str] = None
+
+    def _prepare(self, queryset: QuerySet, pagination: Input):
+        fields = get_ordering(queryset)
+        queryset = queryset.order_by(*ordering_names(fields))
+
+        if pagination.cursor:
+            values = decode_cursor(pagination.cursor, fields)
+            try:
+                queryset = queryset.filter(keyset_filter(fields, values))
+            except (ValidationError, TypeError, ValueError):
+                '''Значения курсора не приводятся к типам полей сортировки'''
+                raise HttpError(400, 'Некорректный курсор!')
+
+        return fields, queryset[:pagination.limit + 1]
+
+    def _page(self, items, fields, limit):
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(fields, [get_value(items[-1], name) for name, _ in fields])
+        return { 'items': items, 'next': next_cursor }
+
+    def paginate_queryset(self, queryset: QuerySet, pagination: Input, **params: Any) -> Any:
+        fields, queryset = self._prepare(queryset, pagination)
+        return self._page(list(queryset), fields, pagination.limit)
+
+    async def apaginate_queryset(self, queryset: QuerySet, pagination: Input, **params: Any) -> Any:
+        fields, queryset = self._prepare(queryset, pagination)
+        return self._page([obj async for obj in queryset], fields, pagination.limit)
+
+
+@lru_cache(maxsize = None)
+def paged_schema(schema):
+    '''Схема страницы ответа, такая же, как строит ninja для @paginate'''
+    return type(f'Paged{ schema.__name__ }', (KeysetPagination.Output, ), { '__annotations__': { 'items': List[schema] } })
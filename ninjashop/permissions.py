@@ -0,0 +1,80 @@
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+
+'''
+Снимки прав хранятся в памяти процесса. Сигналы сбрасывают их только в том процессе, где изменены права,
+поэтому остальные процессы видят отозванное право не дольше PERMISSION_CACHE_TTL секунд.
+0 отключает кэш: права читаются из базы при каждой проверке
+'''
+PERMISSION_CACHE_TTL = getattr(settings, 'PERMISSION_CACHE_TTL', 60)
+
+_lock = threading.Lock()
+_snapshots = {}
+
+
+def _cached(user):
+    with _lock:
+        snapshot = _snapshots.get(user.pk)
+    if snapshot is not None and snapshot[1] > time.monotonic():
+        return snapshot[0]
+    return None
+
+
+def _store(user, permissions):
+    permissions = frozenset(permissions)
+    with _lock:
+        _snapshots[user.pk] = (permissions, time.monotonic() + PERMISSION_CACHE_TTL)
+    return permissions
+
+
+def get_permissions(user):
+    '''Снимок прав пользователя (свои и групп), общий для процесса'''
+    permissions = _cached(user)
+    if permissions is None:
+        permissions = _store(user, user.get_all_permissions())
+    return permissions
+
+
+async def aget_permissions(user):
+    permissions = _cached(user)
+    if permissions is None:
+        permissions = _store(user, await sync_to_async(user.get_all_permissions)())
+    return permissions
+
+
+def _check(user):
+    '''None — нужна проверка по снимку прав'''
+    if not user or user.pk is None or not user.is_active:
+        return False
+    if user.is_superuser:
+        return True
+    return None
+
+
+def has_perms(user, permissions):
+    result = _check(user)
+    if result is not None:
+        return result
+    granted = get_permissions(user)
+    return all(permission in granted for permission in permissions)
+
+
+async def ahas_perms(user, permissions):
+    result = _check(user)
+    if result is not None:
+        return result
+    granted = await aget_permissions(user)
+    return all(permission in granted for permission in permissions)
+
+
+def invalidate_user(user_id):
+    with _lock:
+        _snapshots.pop(user_id, None)
+
+
+def clear():
+    with _lock:
+        _snapshots.clear()
@@ -0,0 +1,151 @@
+import typing
+from functools import lru_cache
+from ninja import Schema
+from django.db.models import DecimalField, QuerySet
+from django.db.models.query import ValuesIterable
+from django.core.exceptions import FieldDoesNotExist
+
+
+def _nested_schema(annotation):
+    '''Возвращает вложенную схему из аннотации поля (CategoryOut, List[ProductOut], Optional[...])'''
+    if isinstance(annotation, type) and issubclass(annotation, Schema):
+        return annotation
+    for argument in typing.get_args(annotation):
+        nested = _nested_schema(argument)
+        if nested is not None:
+            return nested
+    return None
+
+
+def _collect(model, schema, prefix, in_prefetch, select, prefetch):
+    for name, field in schema.model_fields.items():
+        nested = _nested_schema(field.annotation)
+        if nested is None:
+            continue
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if not model_field.is_relation:
+            continue
+
+        path = prefix + name
+        if (model_field.many_to_one or model_field.one_to_one) and not in_prefetch:
+            select.append(path)
+            _collect(model_field.related_model, nested, path + '__', False, select, prefetch)
+        else:
+            '''Обратные связи и many-to-many загружаются отдельным запросом'''
+            prefetch.append(path)
+            _collect(model_field.related_model, nested, path + '__', True, select, prefetch)
+
+
+@lru_cache(maxsize = None)
+def related_lookups(model, schema):
+    '''Выводит списки select_related и prefetch_related, необходимые для сериализации модели схемой'''
+    select, prefetch = [], []
+    _collect(model, schema, '', False, select, prefetch)
+    return tuple(select), tuple(prefetch)
+
+
+def optimize_queryset(queryset: QuerySet, schema):
+    '''Добавляет к queryset все join'ы, которые понадобятся при сериализации схемой'''
+    select, prefetch = related_lookups(queryset.model, schema)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+def _to_float(value):
+    return None if value is None else float(value)
+
+
+def _values_fields(model, schema, prefix, lookups):
+    '''
+    План сборки словаря схемы из строки .values(): (поле, lookup, функция, вложенный план).
+    Вычисляемые поля описываются в схеме атрибутом values_computed: поле -> (поле модели, функция)
+    '''
+    computed = getattr(schema, 'values_computed', {})
+    fields = []
+    for name, field in schema.model_fields.items():
+        if name in computed:
+            source, function = computed[name]
+            lookups.append(prefix + source)
+            fields.append((name, prefix + source, function, None))
+            continue
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise TypeError(f'Поле { name } схемы { schema.__name__ } нельзя получить через values()')
+
+        nested = _nested_schema(field.annotation)
+        if nested is None:
+            lookups.append(prefix + name)
+            '''Decimal приводится к float один раз при сборке строки, а не в рендерере для каждого значения'''
+            function = _to_float if isinstance(model_field, DecimalField) and field.annotation is float else None
+            fields.append((name, prefix + name, function, None))
+        elif model_field.many_to_one or model_field.one_to_one:
+            '''Для необязательной связи по внешнему ключу видно, что объекта нет'''
+            lookups.append(prefix + name)
+            fields.append((name, prefix + name, None, _values_fields(model_field.related_model, nested, prefix + name + '__', lookups)))
+        else:
+            raise TypeError(f'Поле { name } схемы { schema.__name__ } — обратная связь, values() ее не поддерживает')
+    return fields
+
+
+class SchemaRow(dict):
+    '''Словарь в форме схемы; исходная строка .values() нужна пагинации для ключей сортировки'''
+    __slots__ = ('row', )
+
+
+def _build(fields, row):
+    item = {}
+    for name, lookup, function, nested in fields:
+        value = row[lookup]
+        if nested is not None:
+            item[name] = None if value is None else _build(nested, row)
+        elif function is not None:
+            item[name] = function(value)
+        else:
+            item[name] = value
+    return item
+
+
+@lru_cache(maxsize = 1024)
+def values_plan(model, schema):
+    '''Lookups для .values() и класс итерации, собирающий из строк словари в форме схемы'''
+    lookups = []
+    fields = _values_fields(model, schema, '', lookups)
+
+    class SchemaValuesIterable(ValuesIterable):
+        def __iter__(self):
+            for row in super().__iter__():
+                item = SchemaRow(_build(fields, row))
+                item.row = row
+                yield item
+
+    return tuple(dict.fromkeys(lookups)), SchemaValuesIterable
+
+
+def values_queryset(queryset: QuerySet, schema):
+    '''
+    Queryset, который отдает готовые словари схемы без создания моделей и валидации pydantic.
+    Фильтры, сортировка и срезы после вызова работают как обычно, поля сортировки читаются,
+    даже если их нет в схеме
+    '''
+    lookups, iterable_class = values_plan(queryset.model, schema)
+    ordering = [name.lstrip('-') for name in queryset.query.order_by or queryset.model._meta.ordering if isinstance(name, str)]
+    queryset = queryset.values(*dict.fromkeys([*lookups, *ordering, queryset.model._meta.pk.name]))
+    queryset._iterable_class = iterable_class
+    return queryset
+
+
+def fetch_in_order(queryset: QuerySet, keys, field_name = 'pk'):
+    '''
+    Одним запросом in_bulk выбирает объекты по списку ключей.
+    Возвращает объекты в порядке ключей (повторы отбрасываются) и список ненайденных ключей
+    '''
+    keys = list(dict.fromkeys(keys))
+    objects = queryset.in_bulk(keys, field_name = field_name)
+    return [objects[key] for key in keys if key in objects], [key for key in keys if key not in objects]
@@ -0,0 +1,77 @@
+import json
+from decimal import Decimal
+from django.conf import settings
+from ninja.renderers import BaseRenderer
+from ninja.responses import NinjaJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+'''auto — orjson, если установлен, затем msgspec, иначе стандартный модуль json'''
+JSON_RENDERER = getattr(settings, 'JSON_RENDERER', 'auto')
+
+JSON_BACKENDS = ('orjson', 'msgspec', 'json')
+
+
+class JSONEncoder(NinjaJSONEncoder):
+    '''
+    Decimal отдается числом, как поля Money в схемах, а не строкой, как в DjangoJSONEncoder.
+    Списки из values() приводят Decimal к float заранее, сюда попадают только отдельные значения
+    '''
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return float(o)
+        return super().default(o)
+
+
+_default = JSONEncoder().default
+
+
+def _orjson_dumps():
+    '''Даты передаются в JSONEncoder, чтобы формат совпадал со стандартным рендерером'''
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    return lambda data: orjson.dumps(data, default = _default, option = option)
+
+
+def _msgspec_dumps():
+    return msgspec.json.Encoder(enc_hook = _default, decimal_format = 'number').encode
+
+
+def _json_dumps():
+    encoder = JSONEncoder(ensure_ascii = False, separators = (',', ':'))
+    return lambda data: encoder.encode(data).encode()
+
+
+def get_dumps(backend = JSON_RENDERER):
+    '''Функция data -> bytes для выбранной библиотеки; auto выбирает самую быструю из установленных'''
+    if backend == 'auto':
+        backend = 'orjson' if orjson else 'msgspec' if msgspec else 'json'
+    if backend not in JSON_BACKENDS:
+        raise ValueError(f'Неизвестная библиотека JSON: { backend }! Доступны: { ", ".join(JSON_BACKENDS) }')
+    if (backend == 'orjson' and orjson is None) or (backend == 'msgspec' and msgspec is None):
+        raise ValueError(f'Библиотека { backend } не установлена!')
+    return { 'orjson': _orjson_dumps, 'msgspec': _msgspec_dumps, 'json': _json_dumps }[backend]()
+
+
+class FastJSONRenderer(BaseRenderer):
+    '''Рендерер ответов API, сразу возвращает bytes без промежуточной строки'''
+    media_type = 'application/json'
+
+    def __init__(self, backend = JSON_RENDERER):
+        self.dumps = get_dumps(backend)
+
+    def render(self, request, data, *, response_status):
+        return self.dumps(data)
+
+
+renderer = FastJSONRenderer()
+
+dumps = renderer.dumps
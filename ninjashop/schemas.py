@@ -0,0 +1,186 @@
+from typing import Annotated, ClassVar, Dict, List, Optional
+from ninja import Field, Schema
+from pydantic import EmailStr
+from .images import variant_urls
+
+
+'''
+Денежные поля моделей — DecimalField(max_digits = 10, decimal_places = 2), в ответах они отдаются числом JSON.
+float передает без потерь до 15 значащих цифр, поэтому цены и суммы с max_digits = 10 не округляются
+'''
+Money = Annotated[float, Field(description = 'Сумма с копейками числом JSON, точна до 15 значащих цифр')]
+
+
+class TokenIn(Schema):
+    name: str = ''
+
+
+class TokenOut(Schema):
+    id: int
+    name: str
+    token: str
+
+
+class CategoryIn(Schema):
+    name: str
+    slug: str
+
+
+class CategoryOut(Schema):
+    id: int
+    name: str
+    slug: str
+
+
+class CategoryBatchOut(Schema):
+    items: List[CategoryOut]
+    missing: List[str]
+
+
+class ProductIn(Schema):
+    name: str
+    slug: str
+    category: str
+    description: str
+    price: float 
+
+
+class ProductOut(Schema):
+    id: int
+    name: str
+    slug: str
+    category: CategoryOut
+    description: Optional[str]
+    price: Money
+    images: Dict[str, str]
+
+    values_computed: ClassVar[dict] = { 'images': ('image', variant_urls) }
+
+    @staticmethod
+    def resolve_images(obj):
+        return variant_urls(obj.image.name if obj.image else None)
+
+
+class ProductFilter(Schema):
+    category: List[str] = Field(None, description = 'slug категорий, например ?category=a&category=b')
+    min_price: float = Field(None, ge = 0)
+    max_price: float = Field(None, ge = 0)
+    q: str = Field(None, description = 'Строка поиска по названию и описанию')
+    sort: str = Field('name', description = 'name, price или -price')
+
+
+class CategoryFacetOut(Schema):
+    slug: str
+    name: str
+    count: int
+
+
+class PriceFacetOut(Schema):
+    min: Optional[float]
+    max: Optional[float]
+    count: int
+
+
+class FacetsOut(Schema):
+    categories: List[CategoryFacetOut]
+    prices: List[PriceFacetOut]
+
+
+class ProductPageOut(Schema):
+    items: List[ProductOut]
+    next: Optional[str] = None
+    facets: Optional[FacetsOut] = None
+
+
+class ProductBatchOut(Schema):
+    items: List[ProductOut]
+    missing: List[int]
+
+
+class ImportRowError(Schema):
+    row: int
+    errors: List[str]
+
+
+class ImportOut(Schema):
+    imported: int
+    errors: List[ImportRowError]
+
+
+class UserAuth(Schema):
+    username: str
+    password: str
+
+
+class UserRegistration(Schema):
+    username: str
+    last_name: str
+    first_name: str
+    email: EmailStr
+    password1: str
+    password2: str
+    
+
+class UserOut(Schema):
+    username: str
+    last_name: str
+    first_name: str
+    email: str
+    is_active: bool
+
+
+class WishlistIn(Schema):
+    user: int
+    product: int
+    quantity: int = Field(..., ge = 1)
+
+
+class WishlistItemIn(Schema):
+    product: int
+    quantity: int = Field(..., ge = 0)
+
+
+class WishlistDeltaIn(Schema):
+    product: int
+    delta: int
+
+
+class WishlistOut(Schema):
+    product: ProductOut
+    quantity: int
+
+
+class StatusOut(Schema):
+    name: str
+
+
+class OrderOut(Schema):
+    status: StatusOut
+    total: Money
+
+
+class OrderSummaryOut(Schema):
+    user_id: int
+    username: str
+    orders: int
+    revenue: Money
+
+
+class OrderIn(Schema):
+    user: int
+    status: int
+    total: float
+
+
+class OrderItemOut(Schema):
+    order: OrderOut
+    product: ProductOut
+    cost: Money
+    quantity: int
+
+
+class OrderItemIn(Schema):
+    order: int
+    product: int
+    cost: float
+    quantity: int
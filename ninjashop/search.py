@@ -0,0 +1,272 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+
+FTS_TABLE = 'ninjashop_product_fts'
+
+SEARCH_FIELDS = ('name', 'description')
+
+'''Вес совпадения в названии относительно совпадения в описании'''
+FIELD_WEIGHTS = { 'name': 10.0, 'description': 1.0 }
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+class MemoryIndex:
+    '''
+    Обратный индекс в памяти процесса: токен -> { id товара: частоты по полям }.
+    Изменения, сделанные другим процессом, в индекс не попадают, поэтому он подходит
+    только для одного процесса (тесты, разработка) и включается явно: SEARCH_BACKEND = 'memory'
+    '''
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._tokens = []
+        self._dirty = False
+        self._loaded = False
+
+    def _add(self, product_id, name, description):
+        tokens = set()
+        for position, text in enumerate((name, description)):
+            for token in tokenize(text):
+                frequencies = self._postings[token].setdefault(product_id, [0, 0])
+                frequencies[position] += 1
+                tokens.add(token)
+        self._documents[product_id] = tokens
+        self._dirty = True
+
+    def _remove(self, product_id):
+        for token in self._documents.pop(product_id, ()):
+            postings = self._postings[token]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+        self._dirty = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.rebuild()
+
+    def rebuild(self):
+        from .models import Product
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            for product_id, name, description in Product.objects.values_list('id', 'name', 'description').iterator():
+                self._add(product_id, name, description)
+            self._loaded = True
+
+    def update(self, product):
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove(product.id)
+            self._add(product.id, product.name, product.description)
+
+    def update_many(self, products):
+        with self._lock:
+            if not self._loaded:
+                return
+            for product in products:
+                self._remove(product.id)
+                self._add(product.id, product.name, product.description)
+
+    def remove(self, product_id):
+        with self._lock:
+            if self._loaded:
+                self._remove(product_id)
+
+    def _expand(self, prefix):
+        '''Все токены индекса, начинающиеся с prefix (поиск по префиксу через бинарный поиск)'''
+        if self._dirty:
+            self._tokens = sorted(self._postings)
+            self._dirty = False
+        start = bisect_left(self._tokens, prefix)
+        end = start
+        while end < len(self._tokens) and self._tokens[end].startswith(prefix):
+            end += 1
+        return self._tokens[start:end]
+
+    def search(self, query, fields = SEARCH_FIELDS, limit = 20):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        weights = [FIELD_WEIGHTS[field] if field in fields else 0.0 for field in SEARCH_FIELDS]
+
+        with self._lock:
+            self._ensure_loaded()
+            total = len(self._documents) or 1
+            scores = None
+            for term in terms:
+                term_scores = defaultdict(float)
+                for token in self._expand(term):
+                    postings = self._postings[token]
+                    idf = math.log(1 + total / len(postings))
+                    for product_id, frequencies in postings.items():
+                        score = sum(weight * frequency for weight, frequency in zip(weights, frequencies))
+                        if score:
+                            term_scores[product_id] += idf * score
+                '''Все слова запроса должны присутствовать в товаре'''
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = { product_id: scores[product_id] + score for product_id, score in term_scores.items() if product_id in scores }
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key = lambda item: (-item[1], item[0]))
+        return [product_id for product_id, _ in ranked[:limit]]
+
+    def filter(self, queryset, query, fields = SEARCH_FIELDS):
+        '''Оставляет в queryset товары, подходящие под запрос, без ограничения их числа'''
+        return queryset.filter(id__in = self.search(query, fields, limit = None))
+
+
+class Fts5Index:
+    '''Индекс на виртуальной таблице SQLite FTS5, ранжирование по bm25'''
+
+    def rebuild(self):
+        from .models import Product
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM { FTS_TABLE }')
+            for row in Product.objects.values_list('id', 'name', 'description').iterator():
+                cursor.execute(f'INSERT INTO { FTS_TABLE } (rowid, name, description) VALUES (%s, %s, %s)', row)
+
+    def update(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM { FTS_TABLE } WHERE rowid = %s', [product.id])
+            cursor.execute(
+                f'INSERT INTO { FTS_TABLE } (rowid, name, description) VALUES (%s, %s, %s)',
+                [product.id, product.name, product.description or '']
+            )
+
+    def update_many(self, products):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM { FTS_TABLE } WHERE rowid = %s', [[product.id] for product in products])
+            cursor.executemany(
+                f'INSERT INTO { FTS_TABLE } (rowid, name, description) VALUES (%s, %s, %s)',
+                [[product.id, product.name, product.description or ''] for product in products]
+            )
+
+    def remove(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM { FTS_TABLE } WHERE rowid = %s', [product_id])
+
+    def _expression(self, terms, fields):
+        expression = ' '.join(f'"{ term }"*' for term in terms)
+        return '{%s} : (%s)' % (' '.join(fields), expression)
+
+    def search(self, query, fields = SEARCH_FIELDS, limit = 20):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        expression = self._expression(terms, fields)
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in SEARCH_FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM { FTS_TABLE } WHERE { FTS_TABLE } MATCH %s '
+                f'ORDER BY bm25({ FTS_TABLE }, { weights }), rowid LIMIT %s',
+                [expression, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def filter(self, queryset, query, fields = SEARCH_FIELDS):
+        '''Условие поиска подзапросом к FTS5, чтобы фильтры и фасеты оставались одним запросом'''
+        terms = tokenize(query)
+        if not terms:
+            return queryset.none()
+        return queryset.filter(id__in = RawSQL(
+            f'SELECT rowid FROM { FTS_TABLE } WHERE { FTS_TABLE } MATCH %s',
+            [self._expression(terms, fields)]
+        ))
+
+
+class DatabaseIndex:
+    '''
+    Поиск запросом к таблице товаров, когда FTS5 недоступен: все процессы видят одни и те же данные,
+    отдельный индекс не нужен. Слова ищутся как подстроки (icontains), вес — по полям совпадения.
+    На SQLite icontains без учета регистра работает только для латиницы
+    '''
+    def rebuild(self):
+        pass
+
+    def update(self, product):
+        pass
+
+    def update_many(self, products):
+        pass
+
+    def remove(self, product_id):
+        pass
+
+    def _terms(self, query):
+        '''Регистр слов сохраняется: его учитывает icontains самой базы'''
+        return re.findall(r'\w+', query or '')
+
+    def _condition(self, terms, fields):
+        '''Все слова запроса должны присутствовать в товаре, каждое в любом из полей'''
+        condition = Q()
+        for term in terms:
+            matches = Q()
+            for field in fields:
+                matches |= Q(**{ f'{ field }__icontains': term })
+            condition &= matches
+        return condition
+
+    def ranked(self, terms, fields = SEARCH_FIELDS):
+        '''id товаров по убыванию веса одним запросом; отдельно от search, чтобы замерять тот же SQL'''
+        from .models import Product
+        score = Value(0.0)
+        for term in terms:
+            for field in fields:
+                score = score + Case(
+                    When(**{ f'{ field }__icontains': term }, then = Value(FIELD_WEIGHTS[field])),
+                    default = Value(0.0),
+                    output_field = FloatField()
+                )
+        queryset = Product.objects.filter(self._condition(terms, fields)).annotate(score = score).order_by(F('score').desc(), 'id')
+        return queryset.values_list('id', flat = True)
+
+    def search(self, query, fields = SEARCH_FIELDS, limit = 20):
+        terms = self._terms(query)
+        if not terms:
+            return []
+        return list(self.ranked(terms, fields)[:limit])
+
+    def filter(self, queryset, query, fields = SEARCH_FIELDS):
+        terms = self._terms(query)
+        if not terms:
+            return queryset.none()
+        return queryset.filter(self._condition(terms, fields))
+
+
+SEARCH_BACKENDS = { 'fts5': Fts5Index, 'database': DatabaseIndex, 'memory': MemoryIndex }
+
+_index = None
+
+
+def fts5_available():
+    return connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+
+
+def get_search_index():
+    '''FTS5 на SQLite, если таблица индекса создана миграцией, иначе поиск запросом к базе'''
+    global _index
+    if _index is None:
+        backend = getattr(settings, 'SEARCH_BACKEND', 'auto')
+        if backend == 'auto':
+            backend = 'fts5' if fts5_available() else 'database'
+        if backend not in SEARCH_BACKENDS:
+            raise ValueError(f'Неизвестный поисковый индекс: { backend }! Доступны: auto, { ", ".join(SEARCH_BACKENDS) }')
+        _index = SEARCH_BACKENDS[backend]()
+    return _index
@@ -0,0 +1,149 @@
+from django.db import connections, router, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.shortcuts import get_object_or_404
+from ninja.errors import HttpError
+from django.contrib.auth.models import User
+from .models import Product, Wishlist, Order, OrderItem, Status
+from .queries import optimize_queryset
+from .schemas import ProductOut, WishlistOut
+from .permissions import has_perms
+
+
+NEW_ORDER_STATUS_ID = 1
+
+
+def place_order(user, wishlist_ids):
+    '''
+    Оформляет заказ пользователя из его листов желаний одной транзакцией: листы желаний вместе с товарами
+    читаются одним запросом с блокировкой строк внутри транзакции, позиции заказа создаются одним bulk_create
+    '''
+    wishlist_ids = list(dict.fromkeys(wishlist_ids))
+    if not wishlist_ids:
+        raise HttpError(400, 'Список листов желаний пуст!')
+
+    with transaction.atomic():
+        wishlists = Wishlist.objects.select_related('product').select_for_update().in_bulk(wishlist_ids)
+        missing = [wishlist_id for wishlist_id in wishlist_ids if wishlist_id not in wishlists]
+        if missing:
+            raise HttpError(404, f'Листы желаний не найдены: { ", ".join(map(str, missing)) }')
+
+        foreign = [wishlist_id for wishlist_id in wishlist_ids if wishlists[wishlist_id].user_id != user.id]
+        if foreign:
+            raise HttpError(403, f'Листы желаний принадлежат другому пользователю: { ", ".join(map(str, foreign)) }')
+        if any(wishlist.product is None for wishlist in wishlists.values()):
+            raise HttpError(400, 'Лист желаний без товара не может быть включен в заказ!')
+
+        status = get_object_or_404(Status, id = NEW_ORDER_STATUS_ID)
+        items = [
+            OrderItem(
+                product = wishlists[wishlist_id].product,
+                quantity = wishlists[wishlist_id].quantity,
+                cost = wishlists[wishlist_id].product.price * wishlists[wishlist_id].quantity
+            )
+            for wishlist_id in wishlist_ids
+        ]
+        order = Order.objects.create(user = user, status = status, total = sum(item.cost for item in items))
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+
+    return order
+
+
+def _update_quantity(wishlist_id, delta):
+    '''
+    Изменяет количество одним UPDATE и возвращает (product_id, quantity) после изменения
+    или None, если листа желаний нет. Там, где база поддерживает UPDATE ... RETURNING,
+    новое состояние приходит в ответ на тот же запрос
+    '''
+    connection = connections[router.db_for_write(Wishlist)]
+    if connection.vendor in ('sqlite', 'postgresql') and connection.features.can_return_columns_from_insert:
+        table = connection.ops.quote_name(Wishlist._meta.db_table)
+        greatest = 'MAX' if connection.vendor == 'sqlite' else 'GREATEST'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE { table } SET quantity = { greatest }(quantity + %s, 0) WHERE id = %s RETURNING product_id, quantity',
+                [delta, wishlist_id]
+            )
+            return cursor.fetchone()
+
+    queryset = Wishlist.objects.filter(id = wishlist_id)
+    if not queryset.update(quantity = Greatest(F('quantity') + delta, Value(0))):
+        return None
+    return queryset.values_list('product_id', 'quantity').get()
+
+
+def change_wishlist_quantity(wishlist_id, delta):
+    '''
+    Атомарное изменение количества товара в листе желаний: параллельные запросы не теряют
+    изменения, при нулевом количестве лист желаний удаляется
+    '''
+    with transaction.atomic():
+        row = _update_quantity(wishlist_id, delta)
+        if row is None:
+            raise HttpError(404, 'Лист желаний не найден!')
+        product_id, quantity = row
+        if quantity == 0:
+            Wishlist.objects.filter(id = wishlist_id, quantity = 0).delete()
+
+    product = optimize_queryset(Product.objects.all(), ProductOut).filter(id = product_id).first()
+    return Wishlist(id = wishlist_id, product = product, quantity = quantity)
+
+
+def check_wishlist_owner(user, user_id):
+    '''Лист желаний другого пользователя изменяет только тот, у кого есть право на изменение листов желаний'''
+    if user.id != user_id and not has_perms(user, ['ninjashop.change_wishlist']):
+        raise HttpError(403, 'Лист желаний принадлежит другому пользователю!')
+
+
+def apply_wishlist_deltas(user_id, deltas):
+    '''
+    Применяет изменения количества к нескольким товарам листа желаний пользователя в одной
+    транзакции: один UPDATE с CASE по товарам и один DELETE позиций с нулевым количеством
+    '''
+    totals = {}
+    for item in deltas:
+        totals[item.product] = totals.get(item.product, 0) + item.delta
+    if not totals:
+        raise HttpError(400, 'Список изменений пуст!')
+
+    queryset = Wishlist.objects.filter(user_id = user_id, product_id__in = totals)
+    delta = Case(*[When(product_id = product_id, then = Value(value)) for product_id, value in totals.items()], default = Value(0))
+    with transaction.atomic():
+        updated = queryset.update(quantity = Greatest(F('quantity') + delta, Value(0)))
+        if updated != len(totals):
+            missing = sorted(set(totals) - set(queryset.values_list('product_id', flat = True)))
+            raise HttpError(404, f'Товары отсутствуют в листе желаний: { ", ".join(map(str, missing)) }')
+        queryset.filter(quantity = 0).delete()
+
+    return optimize_queryset(queryset.order_by('id'), WishlistOut)
+
+
+def upsert_wishlist(user_id, items):
+    '''
+    Добавляет или обновляет товары в листе желаний пользователя одним
+    INSERT ... ON CONFLICT (user, product) DO UPDATE; товары с нулевым количеством удаляются.
+    Пользователь проверяется по id, товары читаются один раз — они нужны для ответа.
+    Возвращаются только сохраненные позиции, удаленные в ответ не попадают
+    '''
+    quantities = dict(items)
+    if not quantities:
+        raise HttpError(400, 'Список товаров пуст!')
+    if not User.objects.filter(id = user_id).exists():
+        raise HttpError(404, 'Пользователь не найден!')
+
+    products = optimize_queryset(Product.objects.all(), ProductOut).in_bulk(list(quantities))
+    missing = [product_id for product_id in quantities if product_id not in products]
+    if missing:
+        raise HttpError(404, f'Товары не найдены: { ", ".join(map(str, missing)) }')
+
+    wishlists = [Wishlist(user_id = user_id, product = products[product_id], quantity = quantity) for product_id, quantity in quantities.items()]
+    with transaction.atomic():
+        saved = [wishlist for wishlist in wishlists if wishlist.quantity > 0]
+        if saved:
+            Wishlist.objects.bulk_create(saved, update_conflicts = True, unique_fields = ['user', 'product'], update_fields = ['quantity'])
+        removed = [wishlist.product_id for wishlist in wishlists if wishlist.quantity == 0]
+        if removed:
+            Wishlist.objects.filter(user_id = user_id, product_id__in = removed).delete()
+    return saved
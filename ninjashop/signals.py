@@ -0,0 +1,79 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.conf import settings
+from django.contrib.auth.models import User, Group, Permission
+from .models import Category, Product, Order, OrderItem
+from .search import get_search_index
+from .cache import invalidate
+from .auth import credential_cache
+from . import permissions
+from .db import configure_connection
+from .metrics import install_query_wrapper
+
+
+@receiver(post_save, sender = Product)
+def index_product(sender, instance, **kwargs):
+    get_search_index().update(instance)
+
+
+@receiver(post_delete, sender = Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_index().remove(instance.id)
+
+
+@receiver(post_save, sender = Product)
+@receiver(post_delete, sender = Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    invalidate('products', f'product:{ instance.id }')
+
+
+@receiver(post_save, sender = Category)
+@receiver(post_delete, sender = Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    '''Категория вложена в ответы по товарам, поэтому сбрасываются и они'''
+    invalidate('categories')
+
+
+@receiver(post_save, sender = OrderItem)
+@receiver(post_delete, sender = OrderItem)
+def update_order_total(sender, instance, raw = False, **kwargs):
+    if raw or not getattr(settings, 'ORDER_TOTAL_AUTO_UPDATE', True):
+        return
+    Order(pk = instance.order_id).update_total()
+
+
+@receiver(post_save, sender = User)
+@receiver(post_delete, sender = User)
+def invalidate_credentials(sender, instance, **kwargs):
+    '''Смена пароля или деактивация сразу сбрасывают закэшированные учетные данные'''
+    credential_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender = User)
+@receiver(post_delete, sender = User)
+def invalidate_user_permissions(sender, instance, **kwargs):
+    permissions.invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender = User.user_permissions.through)
+@receiver(m2m_changed, sender = User.groups.through)
+def user_relations_changed(sender, instance, reverse, **kwargs):
+    '''При изменении со стороны права или группы затронуто неизвестное число пользователей'''
+    if reverse:
+        permissions.clear()
+    else:
+        permissions.invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender = Group.permissions.through)
+@receiver(post_delete, sender = Group)
+@receiver(post_delete, sender = Permission)
+def group_permissions_changed(sender, **kwargs):
+    permissions.clear()
+
+
+@receiver(connection_created)
+def tune_connection(sender, connection, **kwargs):
+    configure_connection(connection)
+    install_query_wrapper(connection)
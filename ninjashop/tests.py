@@ -1,7 +1,45 @@
 from .api import *
 from .models import *
-from django.test import TestCase
+from .queries import related_lookups
+from .export import stream_export
+from .search import DatabaseIndex, MemoryIndex
+from .cache import get_cache, invalidate
+from .auth import CredentialCache, credential_cache
+from unittest import mock
+from asgiref.sync import sync_to_async
+from PIL import Image
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .images import variant_name, wait_for_variants
+from . import permissions
+from . import metrics
+from .metrics import Histogram, registry
+from .permissions import has_perms
+from django.contrib.auth.models import Group, Permission
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command, CommandError
+from django.conf import settings
+from django.db import connection, connections
+from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+import base64
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+def basic_auth(username = 'admin', password = 'admin'):
+    credentials = base64.b64encode(f'{ username }:{ password }'.encode()).decode()
+    return { 'HTTP_AUTHORIZATION': f'Basic { credentials }' }
+
+
+def auth_headers(username = 'admin', password = 'admin'):
+    return { 'Authorization': basic_auth(username, password)['HTTP_AUTHORIZATION'] }
 
 
 class CategoryTest(TestCase):
@@ -222,4 +260,1334 @@ class LoginTest(TestCase):
         }
         self.client.post('/api/login', content_type = 'application/json', data = payload)
         response = self.client.get('/api/users')
-        self.assertEqual(response.status_code, 403)
\ No newline at end of file
+        self.assertEqual(response.status_code, 403)
+
+
+class QueryCountTest(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        category = Category.objects.get(slug = 'televizory')
+        order = Order.objects.get(id = 1)
+        for number in range(20):
+            product = Product.objects.create(category = category, name = f'TV { number }', slug = f'tv-{ number }', description = '', price = 1000)
+            OrderItem.objects.create(order = order, product = product, cost = 1000, quantity = 1)
+
+    def test_list_products_queries(self):
+        '''Авторизация, версии кэша и один запрос с join категорий'''
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/products?limit=100', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['items']), 23)
+
+    def test_products_of_category_queries(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/products/televizory/', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_orders_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/orders?limit=100', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['items']), 22)
+
+    def test_related_lookups(self):
+        self.assertEqual(related_lookups(Product, ProductOut), (('category', ), ()))
+        self.assertEqual(
+            related_lookups(OrderItem, OrderItemOut),
+            (('order', 'order__status', 'product', 'product__category'), ())
+        )
+
+
+
+class KeysetPaginationTest(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        category = Category.objects.get(slug = 'televizory')
+        for number in range(7):
+            Product.objects.create(category = category, name = 'Same name', slug = f'same-{ number }', description = '', price = 500 + number % 3)
+
+    def collect(self, url):
+        items, cursor = [], None
+        while True:
+            separator = '&' if '?' in url else '?'
+            page_url = f'{ url }{ separator }limit=2' + (f'&cursor={ cursor }' if cursor else '')
+            response = self.client.get(page_url, **basic_auth())
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page['items']), 2)
+            items += page['items']
+            cursor = page['next']
+            if cursor is None:
+                return items
+
+    def test_walk_products(self):
+        items = self.collect('/api/products')
+        expected = list(Product.objects.order_by('name', 'id').values_list('id', flat = True))
+        self.assertEqual([item['id'] for item in items], expected)
+
+    def test_walk_products_sort_desc(self):
+        items = self.collect('/api/products_sort?sort=desc')
+        expected = list(Product.objects.order_by('-price', '-id').values_list('id', flat = True))
+        self.assertEqual([item['id'] for item in items], expected)
+
+    def test_limit_bounds(self):
+        response = self.client.get('/api/categories?limit=100000', **basic_auth())
+        self.assertEqual(response.status_code, 422)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/categories?cursor=not-a-cursor', **basic_auth())
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_with_wrong_types(self):
+        from .pagination import encode_cursor
+        response = self.client.get('/api/products', { 'sort': 'price', 'cursor': encode_cursor([('price', False), ('id', False)], ['x', 'y']) }, **basic_auth())
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/orders', { 'cursor': encode_cursor([('id', False)], [{ 'id': 1 }]) }, **basic_auth())
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_from_other_sort(self):
+        '''Курсор страницы с сортировкой по цене нельзя применить к сортировке по убыванию цены'''
+        cursor = self.client.get('/api/products?sort=price&limit=2', **basic_auth()).json()['next']
+        self.assertEqual(self.client.get(f'/api/products?sort=price&limit=2&cursor={ cursor }', **basic_auth()).status_code, 200)
+        response = self.client.get(f'/api/products?sort=-price&limit=2&cursor={ cursor }', **basic_auth())
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'/api/products?limit=2&cursor={ cursor }', **basic_auth())
+        self.assertEqual(response.status_code, 400)
+
+
+
+class ExportTest(TestCase):
+    fixtures = ['data.json']
+
+    def test_export_products_ndjson(self):
+        response = self.client.get('/api/export/products', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], list(Product.objects.values_list('id', flat = True)))
+
+    def test_export_products_json(self):
+        response = self.client.get('/api/export/products?format=json', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        products = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(products), Product.objects.count())
+        self.assertEqual(products[0]['category']['slug'], 'telefony')
+
+    def test_export_orders_json(self):
+        response = self.client.get('/api/export/orders?format=json', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        items = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(items), OrderItem.objects.count())
+
+    def test_export_small_chunks(self):
+        '''Несколько пачек должны склеиваться в корректный JSON-массив'''
+        response = stream_export(Product.objects.all(), ProductOut, 'json', chunk_size = 1)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), Product.objects.count())
+
+    def test_export_wrong_format(self):
+        response = self.client.get('/api/export/products?format=xml', **basic_auth())
+        self.assertEqual(response.status_code, 400)
+
+
+
+class SearchTest(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        category = Category.objects.get(slug = 'televizory')
+        self.in_description = Product.objects.create(category = category, name = 'Пульт', slug = 'pult', description = 'Подходит к Samsung', price = 900)
+
+    def search(self, query):
+        response = self.client.get(f'/api/products/search?q={ query }', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.json()]
+
+    def test_prefix_and_ranking(self):
+        ids = self.search('sams')
+        self.assertEqual(set(ids), { 1, 2, 3, self.in_description.id })
+        self.assertEqual(ids[-1], self.in_description.id)
+
+    def test_index_follows_changes(self):
+        self.in_description.name = 'Кронштейн'
+        self.in_description.save()
+        self.assertIn(self.in_description.id, self.search('кронш'))
+        self.in_description.delete()
+        self.assertEqual(self.search('кронш'), [])
+
+    def test_query_required(self):
+        self.assertEqual(self.client.get('/api/products/search', **basic_auth()).status_code, 422)
+        self.assertEqual(self.client.get('/api/products_name_search', **basic_auth()).status_code, 422)
+
+    def test_memory_index(self):
+        index = MemoryIndex()
+        index.rebuild()
+        self.assertEqual(index.search('пульт'), [self.in_description.id])
+        self.assertEqual(index.search('samsung', fields = ('description', )), [self.in_description.id])
+        self.assertEqual(index.search('sams')[-1], self.in_description.id)
+        index.remove(self.in_description.id)
+        self.assertEqual(index.search('пульт'), [])
+
+    def test_database_index(self):
+        '''Поиск без FTS5 идет запросом к базе, поэтому сразу видит изменения из любого процесса'''
+        index = DatabaseIndex()
+        self.assertEqual(index.search('Пульт'), [self.in_description.id])
+        self.assertEqual(index.search('samsung', fields = ('description', )), [self.in_description.id])
+        ids = index.search('sams')
+        self.assertEqual(set(ids), { 1, 2, 3, self.in_description.id })
+        self.assertEqual(ids[-1], self.in_description.id)
+        Product.objects.filter(id = self.in_description.id).update(name = 'Кронштейн')
+        self.assertEqual(index.search('Кронш'), [self.in_description.id])
+        self.assertEqual(list(index.filter(Product.objects.all(), 'samsung a51').values_list('slug', flat = True)), ['samsung-a51'])
+
+
+class CatalogCacheTest(TransactionTestCase):
+    fixtures = ['data.json']
+    serialized_rollback = True
+    databases = { 'default', 'replica' }
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_cached_list(self):
+        first = self.client.get('/api/products', **basic_auth())
+        with self.assertNumQueries(0), self.assertNumQueries(2, using = 'replica'):
+            second = self.client.get('/api/products', **basic_auth())
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(second.json()['items'][0]['name'], 'Samsung A51')
+
+    def test_query_params_in_key(self):
+        self.client.get('/api/products?limit=1', **basic_auth())
+        response = self.client.get('/api/products?limit=2', **basic_auth())
+        self.assertEqual(len(response.json()['items']), 2)
+
+    def test_repeated_and_escaped_params_in_key(self):
+        self.client.get('/api/products?category=telefony&fields=slug', **basic_auth())
+        response = self.client.get('/api/products?category=televizory&category=telefony&fields=slug', **basic_auth())
+        expected = Product.objects.filter(category__slug__in = ['telefony', 'televizory']).count()
+        self.assertEqual(len(response.json()['items']), expected)
+        self.assertGreater(expected, Product.objects.filter(category__slug = 'telefony').count())
+
+        '''Экранированный & в значении не совпадает с разделителем параметров'''
+        self.client.get('/api/products?q=a&fields=slug&b=', **basic_auth())
+        with CaptureQueriesContext(connections['replica']) as queries:
+            self.client.get('/api/products?q=a%26fields%3Dslug&b=', **basic_auth())
+        self.assertTrue(any('ninjashop_product' in query['sql'] for query in queries.captured_queries))
+
+    def test_product_change_invalidates(self):
+        self.client.get('/api/products', **basic_auth())
+        self.client.get('/api/products/2', **basic_auth())
+        product = Product.objects.get(id = 1)
+        product.name = 'Aaa'
+        product.save()
+        self.assertEqual(self.client.get('/api/products', **basic_auth()).json()['items'][0]['name'], 'Aaa')
+        self.assertEqual(self.client.get('/api/products/1', **basic_auth()).json()['name'], 'Aaa')
+        '''Кэш других товаров не сбрасывается'''
+        with self.assertNumQueries(0), self.assertNumQueries(2, using = 'replica'):
+            self.client.get('/api/products/2', **basic_auth())
+
+    def test_change_from_other_process(self):
+        '''Версии в базе: изменение, сделанное другим процессом (отдельным соединением без сигналов), сбрасывает кэш здесь'''
+        self.client.get('/api/products', **basic_auth())
+        with sqlite3.connect(connections['default'].settings_dict['NAME']) as other:
+            other.execute("UPDATE ninjashop_product SET name = 'Aaa' WHERE id = 1")
+            other.execute('INSERT OR REPLACE INTO ninjashop_cacheversion (namespace, version) VALUES (?, ?)', ('products', time.time_ns()))
+        other.close()
+        self.assertEqual(self.client.get('/api/products', **basic_auth()).json()['items'][0]['name'], 'Aaa')
+
+    def test_category_change_invalidates_products(self):
+        self.client.get('/api/products/1', **basic_auth())
+        Category.objects.get(slug = 'telefony').delete()
+        self.assertEqual(self.client.get('/api/products/1', **basic_auth()).status_code, 404)
+        self.assertEqual(self.client.get('/api/categories/telefony', **basic_auth()).status_code, 404)
+
+    @override_settings(CACHES = { 'default': { 'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/ninjashop-test-cache' } })
+    def test_file_based_backend(self):
+        get_cache().clear()
+        first = self.client.get('/api/categories', **basic_auth())
+        with self.assertNumQueries(0), self.assertNumQueries(2, using = 'replica'):
+            second = self.client.get('/api/categories', **basic_auth())
+        self.assertEqual(first.content, second.content)
+
+
+class ConditionalRequestTest(TestCase):
+    fixtures = ['data.json']
+
+    def test_etag_not_modified(self):
+        response = self.client.get('/api/products', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        '''Авторизация и версии кэша, без выборки товаров'''
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/products', HTTP_IF_NONE_MATCH = etag, **basic_auth())
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_etag_depends_on_query(self):
+        first = self.client.get('/api/categories?limit=1', **basic_auth())
+        second = self.client.get('/api/categories?limit=2', HTTP_IF_NONE_MATCH = first['ETag'], **basic_auth())
+        self.assertEqual(second.status_code, 200)
+
+    def test_last_modified(self):
+        invalidate('categories')
+        response = self.client.get('/api/categories/telefony', **basic_auth())
+        response = self.client.get('/api/categories/telefony', HTTP_IF_MODIFIED_SINCE = response['Last-Modified'], **basic_auth())
+        self.assertEqual(response.status_code, 304)
+
+    def test_last_modified_unknown(self):
+        '''Пространство имен еще не изменялось: времени изменения нет, а не 1970 год'''
+        CacheVersion.objects.all().delete()
+        response = self.client.get('/api/categories/telefony', **basic_auth())
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_version_from_other_process_resets_etag(self):
+        '''Версия изменена в базе без сигналов этого процесса'''
+        etag = self.client.get('/api/categories', **basic_auth())['ETag']
+        CacheVersion.objects.update_or_create(namespace = 'categories', defaults = { 'version': time.time_ns() })
+        response = self.client.get('/api/categories', HTTP_IF_NONE_MATCH = etag, **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_change_resets_etag(self):
+        etag = self.client.get('/api/products/1', **basic_auth())['ETag']
+        Product.objects.get(id = 1).save()
+        response = self.client.get('/api/products/1', HTTP_IF_NONE_MATCH = etag, **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class CreateOrderTest(TestCase):
+    fixtures = ['data.json']
+
+    def create(self, *wishlist_ids, username = 'user2'):
+        return self.client.post('/api/order', content_type = 'application/json', data = list(wishlist_ids), **basic_auth(username, 'dfvgbh16'))
+
+    def test_create_order(self):
+        response = self.create(1, 2)
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.latest('id')
+        self.assertEqual(response.json(), { 'status': { 'name': 'Создан' }, 'total': 240000.0 })
+        self.assertEqual(order.order_items.count(), 2)
+        self.assertEqual(order.user_id, 3)
+
+    def test_constant_queries(self):
+        with self.assertNumQueries(7):
+            self.create(1)
+        with self.assertNumQueries(7):
+            self.create(1, 2, 3)
+
+    def test_missing_wishlist(self):
+        response = self.create(1, 99)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Order.objects.exclude(id = 1).exists())
+
+    def test_foreign_wishlist(self):
+        foreign = Wishlist.objects.create(user_id = 2, product_id = 1, quantity = 1)
+        response = self.create(1, foreign.id)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Order.objects.exclude(id = 1).exists())
+
+    def test_only_owner_can_order(self):
+        '''Чужие листы желаний нельзя оформить, даже если все они одного пользователя'''
+        response = self.create(1, 2, username = 'user1')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Order.objects.exclude(id = 1).exists())
+
+
+class OrderTotalTest(TestCase):
+    fixtures = ['data.json']
+
+    def test_total_amount(self):
+        order = Order.objects.get(id = 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(order.get_total_amount(), 240000)
+
+    def test_total_maintained(self):
+        item = OrderItem.objects.create(order_id = 1, product_id = 2, cost = 1000, quantity = 1)
+        self.assertEqual(Order.objects.get(id = 1).total, 241000)
+        item.delete()
+        self.assertEqual(Order.objects.get(id = 1).total, 240000)
+
+    def test_summary(self):
+        Order.objects.create(user_id = 3, status_id = 1, total = 500)
+        Order.objects.create(user_id = 2, status_id = 1, total = 100)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/orders/summary', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            { 'user_id': 2, 'username': 'user1', 'orders': 1, 'revenue': 100.0 },
+            { 'user_id': 3, 'username': 'user2', 'orders': 2, 'revenue': 240500.0 },
+        ])
+
+
+class AuthCacheTest(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        credential_cache.clear()
+
+    def test_password_hashed_once(self):
+        with mock.patch('ninjashop.auth.authenticate', wraps = authenticate) as patched:
+            for _ in range(3):
+                self.assertEqual(self.client.get('/api/basic', **basic_auth()).status_code, 200)
+        self.assertEqual(patched.call_count, 1)
+
+    def test_wrong_password(self):
+        self.client.get('/api/basic', **basic_auth())
+        self.assertEqual(self.client.get('/api/basic', **basic_auth('admin', 'wrong')).status_code, 401)
+
+    def test_password_change(self):
+        self.client.get('/api/basic', **basic_auth())
+        user = User.objects.get(username = 'admin')
+        user.set_password('new-password')
+        user.save()
+        self.assertEqual(self.client.get('/api/basic', **basic_auth()).status_code, 401)
+        self.assertEqual(self.client.get('/api/basic', **basic_auth('admin', 'new-password')).status_code, 200)
+
+    def test_deactivation_without_signal(self):
+        self.client.get('/api/basic', **basic_auth())
+        User.objects.filter(username = 'admin').update(is_active = False)
+        self.assertEqual(self.client.get('/api/basic', **basic_auth()).status_code, 401)
+
+    def test_lru_eviction(self):
+        cache = CredentialCache(size = 2)
+        cache.authenticate('admin', 'admin')
+        cache.authenticate('user1', 'dfvgbh16')
+        cache.authenticate('admin', 'admin')
+        cache.authenticate('user2', 'dfvgbh16')
+        self.assertEqual([key[0] for key in cache._entries], ['admin', 'user2'])
+
+
+class TokenAuthTest(TestCase):
+    fixtures = ['data.json']
+
+    def test_token(self):
+        response = self.client.post('/api/tokens', content_type = 'application/json', data = { 'name': 'mobile' }, **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        token = response.json()['token']
+        self.assertNotIn(token, ApiToken.objects.values_list('digest', flat = True))
+
+        headers = { 'HTTP_AUTHORIZATION': f'Bearer { token }' }
+        '''Токен с пользователем одним запросом, версии кэша и список категорий'''
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get('/api/categories', **headers).status_code, 200)
+
+        response = self.client.delete(f'/api/tokens/{ response.json()["id"] }', **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/categories', **headers).status_code, 401)
+
+    def test_invalid_token(self):
+        response = self.client.get('/api/categories', HTTP_AUTHORIZATION = 'Bearer nonsense')
+        self.assertEqual(response.status_code, 401)
+
+
+class PermissionCacheTest(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        permissions.clear()
+        credential_cache.clear()
+        self.client.get('/api/basic', **basic_auth('user1', 'dfvgbh16'))
+
+    def test_permissions_cached(self):
+        self.client.get('/api/users', **basic_auth('user1', 'dfvgbh16'))
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/users', **basic_auth('user1', 'dfvgbh16'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_group_change_invalidates(self):
+        self.assertEqual(self.client.get('/api/users', **basic_auth('user1', 'dfvgbh16')).status_code, 200)
+        Group.objects.get(id = 1).permissions.remove(Permission.objects.get(codename = 'view_user'))
+        self.assertEqual(self.client.get('/api/users', **basic_auth('user1', 'dfvgbh16')).status_code, 403)
+
+    def test_user_permission_invalidates(self):
+        self.assertEqual(self.client.get('/api/orders', **basic_auth('user1', 'dfvgbh16')).status_code, 403)
+        User.objects.get(username = 'user1').user_permissions.add(Permission.objects.get(codename = 'view_orderitem'))
+        self.assertEqual(self.client.get('/api/orders', **basic_auth('user1', 'dfvgbh16')).status_code, 200)
+
+    def test_multiple_permissions(self):
+        user = User.objects.get(username = 'user1')
+        self.assertTrue(has_perms(user, ['auth.view_user', 'ninjashop.change_order']))
+        self.assertFalse(has_perms(user, ['auth.view_user', 'ninjashop.delete_order']))
+        user.is_active = False
+        self.assertFalse(has_perms(user, ['auth.view_user']))
+
+    def revoke_elsewhere(self):
+        '''Удаление строки связи без сигналов: так изменение видит процесс, который его не делал'''
+        Group.permissions.through.objects.filter(group_id = 1, permission__codename = 'view_user').delete()
+
+    def test_other_process_change_bounded_by_ttl(self):
+        user = User.objects.get(username = 'user1')
+        self.assertTrue(has_perms(user, ['auth.view_user']))
+        self.revoke_elsewhere()
+        self.assertTrue(has_perms(user, ['auth.view_user']))
+        with mock.patch.object(permissions.time, 'monotonic', return_value = time.monotonic() + permissions.PERMISSION_CACHE_TTL + 1):
+            self.assertFalse(has_perms(User.objects.get(username = 'user1'), ['auth.view_user']))
+
+    def test_zero_ttl_disables_cache(self):
+        with mock.patch.object(permissions, 'PERMISSION_CACHE_TTL', 0):
+            user = User.objects.get(username = 'user1')
+            self.assertTrue(has_perms(user, ['auth.view_user']))
+            self.revoke_elsewhere()
+            self.assertFalse(has_perms(User.objects.get(username = 'user1'), ['auth.view_user']))
+
+
+class AsyncApiTest(TestCase):
+    fixtures = ['data.json']
+
+    async def test_async_products(self):
+        response = await self.async_client.get('/api/async/products?limit=2', headers = auth_headers())
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual(len(page['items']), 2)
+        self.assertEqual(page['items'][0]['category']['slug'], 'telefony')
+        response = await self.async_client.get(f'/api/async/products?limit=2&cursor={ page["next"] }', headers = auth_headers())
+        self.assertEqual(len(response.json()['items']), 1)
+
+    async def test_async_same_as_sync(self):
+        for path in ('/categories', '/products/1', '/categories/telefony', '/products/televizory/', '/wishlist/3/', '/orders', '/order/3/'):
+            sync_response = await sync_to_async(self.client.get)(f'/api{ path }', **basic_auth())
+            async_response = await self.async_client.get(f'/api/async{ path }', headers = auth_headers())
+            self.assertEqual(async_response.status_code, 200, path)
+            self.assertEqual(async_response.json(), sync_response.json(), path)
+
+    async def test_async_user_orders_not_found(self):
+        '''Нет заказов или их несколько — 404, как в синхронной версии'''
+        order = await Order.objects.aget(user_id = 3)
+        order.pk = None
+        await order.asave()
+        for path in ('/order/2/', '/order/3/', '/order/99/'):
+            sync_response = await sync_to_async(self.client.get)(f'/api{ path }', **basic_auth())
+            async_response = await self.async_client.get(f'/api/async{ path }', headers = auth_headers())
+            self.assertEqual(sync_response.status_code, 404, path)
+            self.assertEqual(async_response.status_code, 404, path)
+            self.assertEqual(async_response.json(), sync_response.json(), path)
+
+    async def test_async_not_found(self):
+        response = await self.async_client.get('/api/async/products/99', headers = auth_headers())
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_permissions(self):
+        response = await self.async_client.get('/api/async/orders', headers = auth_headers('user2', 'dfvgbh16'))
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.get('/api/async/orders', headers = auth_headers('admin', 'wrong'))
+        self.assertEqual(response.status_code, 401)
+
+
+class ImagePipelineTest(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT = self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def upload(self, slug, color = 'red'):
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 600), color).save(buffer, 'PNG')
+        image = SimpleUploadedFile('bg.png', buffer.getvalue(), content_type = 'image/png')
+        payload = { 'name': slug, 'slug': slug, 'category': 'telefony', 'description': '', 'price': 100 }
+        with self.captureOnCommitCallbacks(execute = True):
+            response = self.client.post('/api/products', data = { 'payload': json.dumps(payload), 'image': image }, **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        wait_for_variants(timeout = 10)
+        return response.json()
+
+    def test_variants(self):
+        product = self.upload('first')
+        self.assertEqual(set(product['images']), { 'original', 'thumb', 'medium' })
+        name = Product.objects.get(id = product['id']).image.name
+        with default_storage.open(variant_name(name, 'thumb')) as thumb, Image.open(thumb) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.size, (200, 100))
+
+    def test_deduplicated(self):
+        first = self.upload('first')
+        second = self.upload('second')
+        self.assertEqual(first['images']['original'], second['images']['original'])
+        self.assertNotEqual(second['images']['thumb'], second['images']['original'])
+        self.assertEqual(len(os.listdir(os.path.join(self.media.name, 'images'))), 2)
+        third = self.upload('third', color = 'blue')
+        self.assertNotEqual(first['images']['original'], third['images']['original'])
+
+    def test_not_an_image(self):
+        upload = SimpleUploadedFile('bg.png', b'<script></script>', content_type = 'image/png')
+        payload = { 'name': 'fake', 'slug': 'fake', 'category': 'telefony', 'description': '', 'price': 100 }
+        response = self.client.post('/api/products', data = { 'payload': json.dumps(payload), 'image': upload }, **basic_auth())
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Product.objects.filter(slug = 'fake').exists())
+
+    def test_extension_from_content(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, 'JPEG')
+        from .images import store_upload
+        name = store_upload(SimpleUploadedFile('photo.exe', buffer.getvalue()))
+        self.assertTrue(name.endswith('.jpg'))
+
+    def test_missing_variants_fall_back_to_original(self):
+        '''Файл из фикстуры без построенных вариантов'''
+        images = self.client.get('/api/products/1', **basic_auth()).json()['images']
+        self.assertEqual(images['thumb'], images['original'])
+        self.assertEqual(images['medium'], images['original'])
+
+    def test_dedupe_command(self):
+        os.makedirs(os.path.join(self.media.name, 'images'))
+        for name in Product.objects.exclude(image = '').values_list('image', flat = True):
+            with open(os.path.join(settings.BASE_DIR, name), 'rb') as source, open(os.path.join(self.media.name, name), 'wb') as target:
+                target.write(source.read())
+        call_command('dedupe_images', stdout = io.StringIO())
+        names = set(Product.objects.exclude(image = '').values_list('image', flat = True))
+        self.assertEqual(len(names), 1)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.media.name, 'images'))), [os.path.basename(names.pop()), 'variants'])
+        images = self.client.get('/api/products/1', **basic_auth()).json()['images']
+        self.assertNotEqual(images['thumb'], images['original'])
+
+
+class ProductImportTest(TestCase):
+    fixtures = ['data.json']
+
+    def post(self, body, content_type, query = ''):
+        return self.client.post(f'/api/products/import{ query }', body, content_type = content_type, **basic_auth())
+
+    def row(self, slug, category = 'telefony', price = 1000, name = None):
+        return { 'name': name or slug, 'slug': slug, 'category': category, 'description': '', 'price': price }
+
+    def test_json_upsert(self):
+        rows = [self.row('samsung-a51', price = 25000, name = 'Samsung A51 (2024)'), self.row('pixel-8', price = 70000)]
+        response = self.post(json.dumps(rows), 'application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), { 'imported': 2, 'errors': [] })
+        product = Product.objects.get(slug = 'samsung-a51')
+        self.assertEqual((product.id, product.name, product.price), (1, 'Samsung A51 (2024)', 25000))
+        self.assertEqual(Product.objects.get(slug = 'pixel-8').category.slug, 'telefony')
+        self.assertEqual(Product.objects.count(), 4)
+
+    def test_ndjson_row_errors(self):
+        body = '\n'.join([
+            json.dumps(self.row('pixel-8')),
+            '{broken',
+            json.dumps(self.row('pixel-9', category = 'unknown')),
+            json.dumps({ 'slug': 'pixel-10' }),
+        ])
+        response = self.post(body, 'application/x-ndjson')
+        self.assertEqual(response.json()['imported'], 1)
+        self.assertEqual([error['row'] for error in response.json()['errors']], [2, 3, 4])
+        self.assertFalse(Product.objects.filter(slug__in = ['pixel-9', 'pixel-10']).exists())
+
+    def test_csv_and_search_index(self):
+        body = 'name,slug,category,description,price\nКронштейн,kronshtein,televizory,Настенный,1500\n'
+        response = self.post(body, 'text/plain', '?format=csv')
+        self.assertEqual(response.json(), { 'imported': 1, 'errors': [] })
+        search = self.client.get('/api/products/search?q=кронш', **basic_auth()).json()
+        self.assertEqual([product['slug'] for product in search], ['kronshtein'])
+
+    def test_unknown_format_and_permission(self):
+        self.assertEqual(self.post('[]', 'application/json', '?format=xml').status_code, 400)
+        response = self.client.post('/api/products/import', '[]', content_type = 'application/json', **basic_auth('user1', 'dfvgbh16'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_constant_queries_per_batch(self):
+        from .imports import import_products
+
+        def count(size):
+            rows = [self.row(f'item-{ size }-{ number }') for number in range(size)]
+            with CaptureQueriesContext(connection) as context:
+                result = import_products(iter(rows), batch_size = 500)
+            self.assertEqual(result['imported'], size)
+            return len(context)
+
+        self.assertEqual(count(10), count(150))
+
+
+class QueryPlanTest(TestCase):
+    fixtures = ['data.json']
+
+    def test_list_endpoints_use_indexes(self):
+        from .management.commands.audit_queries import audit
+        failed = [(name, page, plan) for name, page, plan, sorted_in_memory in audit() if sorted_in_memory]
+        self.assertEqual(failed, [])
+
+    def test_audits_endpoint_querysets(self):
+        '''Аудит объясняет те же запросы, что выполняют эндпоинты: .values() только с выбранными полями'''
+        from .management.commands.audit_queries import AUDITED_QUERIES, pages
+        plans = { name: (build, plan) for name, build, plan, _ in AUDITED_QUERIES }
+        for name, path in (('GET /products?fields=id,name,price', '/api/products?fields=id,name,price'), ('GET /orders', '/api/orders')):
+            get_cache().clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(path, **basic_auth())
+            build, plan = plans[name]
+            _, first_page = next(pages(plan(build()), True))
+            self.assertEqual(queries.captured_queries[-1]['sql'], str(first_page.query), name)
+
+    def test_command_reports_temp_btree(self):
+        from .management.commands import audit_queries
+        queries = [('GET /unindexed', lambda: Product.objects.order_by('description'), audit_queries.values(ProductOut), True)]
+        with mock.patch.object(audit_queries, 'AUDITED_QUERIES', queries):
+            with self.assertRaises(CommandError):
+                call_command('audit_queries', stdout = io.StringIO())
+
+
+class DatabaseTuningTest(TestCase):
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            '''Ожидание блокировки задается только OPTIONS['timeout']'''
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.DATABASES['default']['OPTIONS']['timeout'] * 1000)
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_read_only_pragmas(self):
+        from .db import apply_pragmas
+        database = sqlite3.connect(':memory:')
+        apply_pragmas(database.cursor(), read_only = True)
+        with self.assertRaises(sqlite3.OperationalError):
+            database.execute('CREATE TABLE t (id INTEGER)')
+
+    def test_router(self):
+        from .db import ReadReplicaRouter
+        router = ReadReplicaRouter()
+        self.assertEqual(router.db_for_write(Product), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'ninjashop'))
+        '''Внутри транзакции теста чтение остается на основном соединении'''
+        self.assertEqual(router.db_for_read(Product), 'default')
+        with mock.patch.object(connections['default'], 'in_atomic_block', False):
+            self.assertEqual(router.db_for_read(Product), 'replica')
+
+
+class WishlistQuantityTest(TestCase):
+    fixtures = ['data.json']
+
+    def test_add_and_remove(self):
+        response = self.client.put('/api/wishlist_add?wishlist_id=1', **basic_auth())
+        quantity = Wishlist.objects.get(id = 1).quantity
+        self.assertEqual(response.json()['quantity'], quantity)
+        self.assertEqual(response.json()['product']['id'], Wishlist.objects.get(id = 1).product_id)
+        for _ in range(quantity - 1):
+            self.client.put('/api/wishlist_remove?wishlist_id=1', **basic_auth())
+        response = self.client.put('/api/wishlist_remove?wishlist_id=1', **basic_auth())
+        self.assertEqual(response.json()['quantity'], 0)
+        self.assertFalse(Wishlist.objects.filter(id = 1).exists())
+        self.assertEqual(self.client.put('/api/wishlist_add?wishlist_id=1', **basic_auth()).status_code, 404)
+
+    def test_single_update_statement(self):
+        from .services import change_wishlist_quantity
+        with CaptureQueriesContext(connection) as context:
+            change_wishlist_quantity(1, 1)
+        updates = [query['sql'] for query in context if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertFalse([query for query in context if 'FROM "ninjashop_wishlist"' in query['sql'] and query['sql'].startswith('SELECT')])
+
+    def test_batch_deltas(self):
+        items = { wishlist.product_id: wishlist.quantity for wishlist in Wishlist.objects.filter(user_id = 3) }
+        first, second = list(items)[:2]
+        payload = [{ 'product': first, 'delta': 2 }, { 'product': second, 'delta': -items[second] }, { 'product': first, 'delta': 1 }]
+        response = self.client.post('/api/wishlist/3/quantities', json.dumps(payload), content_type = 'application/json', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['product']['id'], item['quantity']) for item in response.json()], [(first, items[first] + 3)])
+        self.assertFalse(Wishlist.objects.filter(user_id = 3, product_id = second).exists())
+
+    def test_batch_rolls_back_on_missing_product(self):
+        before = list(Wishlist.objects.values_list('id', 'quantity'))
+        product = Wishlist.objects.filter(user_id = 3).first().product_id
+        payload = [{ 'product': product, 'delta': 5 }, { 'product': 999, 'delta': 1 }]
+        response = self.client.post('/api/wishlist/3/quantities', json.dumps(payload), content_type = 'application/json', **basic_auth())
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(list(Wishlist.objects.values_list('id', 'quantity')), before)
+
+
+    def test_batch_foreign_user(self):
+        product = Wishlist.objects.filter(user_id = 3).first().product_id
+        payload = json.dumps([{ 'product': product, 'delta': 1 }])
+        response = self.client.post('/api/wishlist/3/quantities', payload, content_type = 'application/json', **basic_auth('user1', 'dfvgbh16'))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post('/api/wishlist/3/quantities', payload, content_type = 'application/json', **basic_auth('user2', 'dfvgbh16'))
+        self.assertEqual(response.status_code, 200)
+
+
+class WishlistConcurrencyTest(TransactionTestCase):
+    fixtures = ['data.json']
+    serialized_rollback = True
+    databases = { 'default', 'replica' }
+
+    def test_no_lost_increments(self):
+        from .services import change_wishlist_quantity
+        start = Wishlist.objects.get(id = 1).quantity
+        threads, increments = 8, 25
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(increments):
+                    change_wishlist_quantity(1, 1)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target = worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Wishlist.objects.get(id = 1).quantity, start + threads * increments)
+
+
+class WishlistUpsertTest(TestCase):
+    fixtures = ['data.json']
+
+    def test_single_upsert(self):
+        existing = Wishlist.objects.filter(user_id = 3).first()
+        payload = { 'user': 3, 'product': existing.product_id, 'quantity': 7 }
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/wishlist', json.dumps(payload), content_type = 'application/json', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        statements = [query['sql'] for query in context if 'ninjashop_wishlist' in query['sql']]
+        self.assertEqual(len(statements), 1)
+        self.assertIn('ON CONFLICT', statements[0])
+        self.assertEqual(response.json()['quantity'], 7)
+        self.assertEqual(Wishlist.objects.get(id = existing.id).quantity, 7)
+        self.assertEqual(Wishlist.objects.filter(user_id = 3, product_id = existing.product_id).count(), 1)
+
+    def test_sync_list(self):
+        kept, removed = Wishlist.objects.filter(user_id = 3).values_list('product_id', flat = True)[:2]
+        created = Product.objects.exclude(wishlist__user_id = 3).values_list('id', flat = True).first() or Product.objects.create(
+            category_id = 1, name = 'Новый', slug = 'novyi', description = '', price = 100).id
+        items = [{ 'product': kept, 'quantity': 4 }, { 'product': removed, 'quantity': 0 }, { 'product': created, 'quantity': 2 }]
+        response = self.client.put('/api/wishlist/3/items', json.dumps(items), content_type = 'application/json', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['product']['id'], item['quantity']) for item in response.json()], [(kept, 4), (created, 2)])
+        quantities = dict(Wishlist.objects.filter(user_id = 3).values_list('product_id', 'quantity'))
+        self.assertEqual((quantities[kept], quantities[created]), (4, 2))
+        self.assertNotIn(removed, quantities)
+
+    def test_unknown_ids(self):
+        response = self.client.put('/api/wishlist/3/items', json.dumps([{ 'product': 999, 'quantity': 1 }]), content_type = 'application/json', **basic_auth())
+        self.assertEqual(response.status_code, 404)
+        response = self.client.put('/api/wishlist/99/items', json.dumps([{ 'product': 1, 'quantity': 1 }]), content_type = 'application/json', **basic_auth())
+        self.assertEqual(response.status_code, 404)
+        response = self.client.put('/api/wishlist/3/items', json.dumps([{ 'product': 1, 'quantity': -1 }]), content_type = 'application/json', **basic_auth())
+        self.assertEqual(response.status_code, 422)
+        payload = { 'user': 3, 'product': 1, 'quantity': -1 }
+        response = self.client.post('/api/wishlist', json.dumps(payload), content_type = 'application/json', **basic_auth())
+        self.assertEqual(response.status_code, 422)
+
+    def test_foreign_user(self):
+        items = json.dumps([{ 'product': 1, 'quantity': 1 }])
+        response = self.client.put('/api/wishlist/3/items', items, content_type = 'application/json', **basic_auth('user1', 'dfvgbh16'))
+        self.assertEqual(response.status_code, 403)
+        payload = json.dumps({ 'user': 3, 'product': 1, 'quantity': 1 })
+        response = self.client.post('/api/wishlist', payload, content_type = 'application/json', **basic_auth('user1', 'dfvgbh16'))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.put('/api/wishlist/3/items', items, content_type = 'application/json', **basic_auth('user2', 'dfvgbh16'))
+        self.assertEqual(response.status_code, 200)
+
+
+class MetricsTest(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        registry.clear()
+        get_cache().clear()
+
+    def test_server_timing(self):
+        response = self.client.get('/api/products', **basic_auth())
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+$')
+        self.assertNotIn('desc="0 queries"', timing)
+
+    def test_server_timing_staff_only(self):
+        with mock.patch.object(metrics, 'METRICS_SERVER_TIMING', 'staff'):
+            self.assertTrue(self.client.get('/api/products', **basic_auth()).has_header('Server-Timing'))
+            self.assertFalse(self.client.get('/api/products', **basic_auth('user1', 'dfvgbh16')).has_header('Server-Timing'))
+        with mock.patch.object(metrics, 'METRICS_SERVER_TIMING', False):
+            self.assertFalse(self.client.get('/api/products', **basic_auth()).has_header('Server-Timing'))
+
+    def test_prometheus_endpoint(self):
+        self.client.get('/api/products/1', **basic_auth())
+        self.client.get('/api/products/2', **basic_auth())
+        response = self.client.get('/api/metrics', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        labels = 'method="GET",operation="/api/products/<product_id>"'
+        self.assertIn(f'ninjashop_requests_total{{{ labels },status="200"}} 2', text)
+        self.assertIn(f'ninjashop_request_duration_seconds_count{{{ labels }}} 2', text)
+        self.assertIn(f'ninjashop_request_duration_quantile_seconds{{{ labels },quantile="0.99"}}', text)
+        self.assertIn(f'ninjashop_response_size_bytes_count{{{ labels }}} 2', text)
+
+    def test_metrics_protected(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/api/metrics', **basic_auth('user1', 'dfvgbh16')).status_code, 403)
+
+    def test_query_count_matches(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/api/orders', **basic_auth())
+        histogram = registry.operations[('GET', '/api/orders')]['queries']
+        self.assertEqual(histogram.sum, len(context))
+
+    async def test_async_queries_counted(self):
+        await self.async_client.get('/api/async/products', headers = auth_headers())
+        histogram = registry.operations[('GET', '/api/async/products')]['queries']
+        self.assertGreater(histogram.sum, 0)
+
+    def test_schema_validation_timed(self):
+        '''В сериализацию входит построение ответа по схеме, а не только рендеринг JSON'''
+        from ninja import Schema
+        from .metrics import InstrumentedAPI, RequestStats, current
+
+        class SlowOut(Schema):
+            name: str
+
+            @staticmethod
+            def resolve_name(obj):
+                time.sleep(0.02)
+                return 'slow'
+
+        api = InstrumentedAPI(urls_namespace = 'metrics-test')
+
+        @api.get('/slow', response = SlowOut)
+        def slow(request):
+            return {}
+
+        operation = api.default_router.path_operations['/slow'].operations[0]
+        stats = RequestStats()
+        token = current.set(stats)
+        try:
+            response = operation.run(RequestFactory().get('/slow'))
+        finally:
+            current.reset(token)
+        self.assertEqual(json.loads(response.content), { 'name': 'slow' })
+        self.assertGreaterEqual(stats.serialize_time, 0.02)
+
+    def test_histogram_quantiles(self):
+        histogram = Histogram((1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.quantile(0.5), 1.5)
+        self.assertLessEqual(histogram.quantile(0.99), 4)
+
+
+class BenchmarkSuiteTest(TransactionTestCase):
+    serialized_rollback = True
+    databases = { 'default', 'replica' }
+
+    def test_generate_and_run(self):
+        from .management.commands.benchmark_api import build_endpoints, client_sender, compare, generate, run_endpoint
+        User.objects.create_superuser('admin', password = 'admin')
+        generate({ 'products': 30, 'categories': 3, 'users': 4, 'wishlist': 5, 'order_items': 2 }, batch_size = 10)
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(Wishlist.objects.count(), 20)
+        self.assertEqual(Order.objects.count(), 4)
+        self.assertEqual(OrderItem.objects.count(), 8)
+
+        endpoints = { endpoint[0]: endpoint for endpoint in build_endpoints() }
+        send = client_sender(auth_headers())
+        result = run_endpoint(send, endpoints['product'], requests = 4, concurrency = 1)
+        self.assertEqual(result['errors'], 0)
+        self.assertEqual(set(result['latency_ms']), { 'p50', 'p95', 'p99', 'max' })
+        self.assertGreater(result['queries_per_request'], 0)
+        self.assertGreater(result['peak_memory_kb'], 0)
+
+        slower = { **result, 'latency_ms': { **result['latency_ms'], 'p50': result['latency_ms']['p50'] * 2 } }
+        rows = compare({ 'results': [{ 'target': 'client', **result }] }, { 'results': [{ 'target': 'client', **slower }] }, 0.2)
+        self.assertTrue(rows[0]['regression'])
+
+
+class JSONRendererTest(TestCase):
+    fixtures = ['data.json']
+
+    def test_decimal_rendered_as_number(self):
+        from decimal import Decimal
+        from .renderers import get_dumps
+        for backend in ('json', 'orjson'):
+            self.assertEqual(get_dumps(backend)({ 'price': Decimal('100.50'), 'name': 'Телевизор' }), '{"price":100.5,"name":"Телевизор"}'.encode())
+
+    def test_datetime_format_matches_stdlib(self):
+        from datetime import datetime, timezone
+        from .renderers import get_dumps
+        value = { 'created': datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo = timezone.utc) }
+        self.assertEqual(get_dumps('orjson')(value), get_dumps('json')(value))
+
+    def test_unknown_backend(self):
+        from .renderers import get_dumps
+        with self.assertRaises(ValueError):
+            get_dumps('yaml')
+
+    def test_values_queryset_matches_schema(self):
+        '''Словари из values() совпадают с сериализацией моделей через pydantic'''
+        from .queries import values_queryset
+        from .renderers import dumps
+        for queryset, schema in ((Product.objects.all(), ProductOut), (OrderItem.objects.all(), OrderItemOut)):
+            expected = [schema.from_orm(obj).model_dump() for obj in optimize_queryset(queryset, schema)]
+            self.assertEqual(json.loads(dumps(list(values_queryset(queryset, schema)))), expected)
+
+    def test_values_decimal_converted_once(self):
+        '''Цены из values() уже float: orjson сериализует их сам, без вызова default для каждой строки'''
+        from . import renderers
+        from .queries import values_queryset
+        items = list(values_queryset(OrderItem.objects.all(), OrderItemOut))
+        self.assertIsInstance(items[0]['cost'], float)
+        self.assertIsInstance(items[0]['product']['price'], float)
+        with mock.patch.object(renderers, '_default', side_effect = TypeError) as default:
+            renderers.get_dumps('orjson')(items)
+        default.assert_not_called()
+
+    def test_null_description(self):
+        '''Описание в базе может быть NULL: и модели, и values() отдают null, а не 500'''
+        Product.objects.filter(id = 1).update(description = None)
+        get_cache().clear()
+        self.assertIsNone(self.client.get('/api/products/1', **basic_auth()).json()['description'])
+        items = self.client.get('/api/products?limit=50', **basic_auth()).json()['items']
+        self.assertIsNone(next(item for item in items if item['id'] == 1)['description'])
+        self.assertIsNone(ProductOut.from_orm(Product.objects.get(id = 1)).description)
+
+    def test_list_products_from_values(self):
+        get_cache().clear()
+        '''Пользователь для авторизации, версии кэша и одна выборка товаров с категориями'''
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/products?limit=2', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual(page['items'][0]['category']['slug'], Product.objects.first().category.slug)
+        self.assertIsInstance(page['items'][0]['price'], float)
+
+        response = self.client.get(f'/api/products?limit=2&cursor={ page["next"] }', **basic_auth())
+        names = [item['name'] for item in page['items'] + response.json()['items']]
+        self.assertEqual(names, list(Product.objects.values_list('name', flat = True)))
+
+    def test_export_from_values_matches_models(self):
+        for format in ('ndjson', 'json'):
+            values = stream_export(OrderItem.objects.all(), OrderItemOut, format, values = True)
+            models = stream_export(OrderItem.objects.all(), OrderItemOut, format)
+            self.assertEqual(b''.join(values.streaming_content), b''.join(models.streaming_content))
+
+
+class BatchFetchTest(TestCase):
+    fixtures = ['data.json']
+
+    def test_products_in_request_order(self):
+        ids = list(Product.objects.order_by('-id').values_list('id', flat = True))
+        '''Пользователь для авторизации и одна выборка товаров с категориями'''
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/products/batch', { 'ids': ids + [999, ids[0]] }, **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([item['id'] for item in data['items']], ids)
+        self.assertEqual(data['items'][0]['category']['slug'], Product.objects.get(id = ids[0]).category.slug)
+        self.assertEqual(data['missing'], [999])
+
+    def test_categories_by_slug(self):
+        response = self.client.get('/api/categories/batch', { 'slugs': ['telefony', 'net', 'televizory'] }, **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([item['slug'] for item in data['items']], ['telefony', 'televizory'])
+        self.assertEqual(data['missing'], ['net'])
+
+    def test_batch_size_limit(self):
+        from . import api as api_module
+        with mock.patch.object(api_module, 'BATCH_MAX_SIZE', 2):
+            response = self.client.get('/api/products/batch', { 'ids': [1, 2, 3] }, **basic_auth())
+        self.assertEqual(response.status_code, 400)
+
+
+class FieldsetTest(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_products_projection(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products?fields=id,name,price', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        items = response.json()['items']
+        self.assertEqual([list(item) for item in items], [['id', 'name', 'price']] * Product.objects.count())
+        sql = queries.captured_queries[-1]['sql']
+        self.assertNotIn('description', sql)
+        self.assertNotIn('ninjashop_category', sql)
+
+    def test_nested_fields(self):
+        response = self.client.get('/api/products?fields=name,category.slug', **basic_auth())
+        item = response.json()['items'][0]
+        self.assertEqual(item, { 'name': Product.objects.first().name, 'category': { 'slug': Product.objects.first().category.slug } })
+
+    def test_unknown_field(self):
+        response = self.client.get('/api/products?fields=id,secret', **basic_auth())
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/products?fields=name.first', **basic_auth())
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_without_sort_fields(self):
+        '''Сортировка по name и id работает, даже если этих полей нет в ответе'''
+        response = self.client.get('/api/products?fields=price&limit=2', **basic_auth())
+        page = response.json()
+        response = self.client.get(f'/api/products?fields=price&limit=2&cursor={ page["next"] }', **basic_auth())
+        prices = [item['price'] for item in page['items'] + response.json()['items']]
+        self.assertEqual(prices, [float(price) for price in Product.objects.values_list('price', flat = True)])
+
+    def test_wishlist_and_orders(self):
+        response = self.client.get('/api/wishlist/3/', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        expected = [WishlistOut.from_orm(wishlist).model_dump() for wishlist in Wishlist.objects.filter(user_id = 3).order_by('id')]
+        self.assertEqual(response.json()['items'], expected)
+
+        response = self.client.get('/api/orders?fields=quantity,product.name', **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'], [
+            { 'quantity': item.quantity, 'product': { 'name': item.product.name } } for item in OrderItem.objects.order_by('id')
+        ])
+
+    def test_schema_cached(self):
+        from .fieldsets import sparse_schema
+        schema = sparse_schema(ProductOut, 'id,category.slug')
+        self.assertIs(sparse_schema(ProductOut, 'category.slug, id'), schema)
+        self.assertEqual(list(schema.model_fields), ['id', 'category'])
+        self.assertIs(sparse_schema(ProductOut, ''), ProductOut)
+
+
+class ProductFilterTest(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        get_cache().clear()
+        category = Category.objects.get(slug = 'televizory')
+        Product.objects.create(category = category, name = 'Пульт', slug = 'pult', description = 'Подходит к Samsung', price = 900)
+
+    def get(self, **params):
+        response = self.client.get('/api/products', params, **basic_auth())
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_category_and_price_range(self):
+        page = self.get(category = 'telefony', min_price = 31000, fields = 'slug')
+        self.assertEqual(page['items'], [{ 'slug': 'samsung-a71' }])
+        page = self.get(category = ['telefony', 'televizory'], max_price = 35000, sort = '-price', fields = 'slug')
+        self.assertEqual([item['slug'] for item in page['items']], ['samsung-a71', 'samsung-a51', 'pult'])
+        self.assertNotIn('facets', page)
+
+    def test_search_with_filters(self):
+        page = self.get(q = 'samsung', category = 'televizory', sort = 'price', fields = 'slug')
+        self.assertEqual([item['slug'] for item in page['items']], ['pult', 'samsung-tv10'])
+
+    def test_cursor_with_filters(self):
+        first = self.get(sort = 'price', min_price = 1000, limit = 2, fields = 'price')
+        second = self.get(sort = 'price', min_price = 1000, limit = 2, fields = 'price', cursor = first['next'])
+        self.assertEqual([item['price'] for item in first['items'] + second['items']], [30000.0, 35000.0, 150000.0])
+        self.assertIsNone(second['next'])
+
+    def test_facets_in_one_query(self):
+        '''Пользователь для авторизации, версии кэша, страница товаров и один запрос фасетов'''
+        with self.assertNumQueries(4):
+            page = self.get(q = 'samsung', facets = 'true')
+        self.assertEqual(page['facets']['categories'], [
+            { 'slug': 'televizory', 'name': 'Телевизоры', 'count': 2 },
+            { 'slug': 'telefony', 'name': 'Телефоны', 'count': 2 },
+        ])
+        self.assertEqual([bucket['count'] for bucket in page['facets']['prices']], [1, 0, 0, 2, 0, 1])
+        self.assertEqual(page['facets']['prices'][0], { 'min': None, 'max': 1000, 'count': 1 })
+
+    def test_wrong_sort(self):
+        response = self.client.get('/api/products?sort=description', **basic_auth())
+        self.assertEqual(response.status_code, 400)
+
+
+class CompressionTest(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_choose_encoding(self):
+        from .compression import choose_encoding
+        self.assertEqual(choose_encoding('br, gzip', ['gzip']), 'gzip')
+        self.assertEqual(choose_encoding('gzip;q=0.5, br;q=0.8', ['br', 'gzip']), 'br')
+        self.assertEqual(choose_encoding('zstd, br, gzip', ['zstd', 'br', 'gzip']), 'zstd')
+        self.assertEqual(choose_encoding('*', ['gzip']), 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0', ['gzip']))
+        self.assertIsNone(choose_encoding('identity', ['gzip']))
+        self.assertIsNone(choose_encoding('', ['gzip']))
+
+    def test_gzip_response(self):
+        import gzip
+        from . import middleware
+        plain = self.client.get('/api/products', **basic_auth())
+        with mock.patch.object(middleware, 'COMPRESSION_MIN_SIZE', 0):
+            response = self.client.get('/api/products', HTTP_ACCEPT_ENCODING = 'gzip', **basic_auth())
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertTrue(response['ETag'].startswith('W/'))
+
+        '''Слабый ETag сжатого ответа подходит для условного запроса'''
+        response = self.client.get('/api/products', HTTP_ACCEPT_ENCODING = 'gzip', HTTP_IF_NONE_MATCH = response['ETag'], **basic_auth())
+        self.assertEqual(response.status_code, 304)
+
+    def test_small_body_not_compressed(self):
+        response = self.client.get('/api/categories', HTTP_ACCEPT_ENCODING = 'gzip', **basic_auth())
+        self.assertLess(len(response.content), 1024)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_skips_images(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from .middleware import CompressionMiddleware
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING = 'gzip')
+        response = CompressionMiddleware(lambda request: HttpResponse(b'x' * 5000, content_type = 'image/png'))(request)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, b'x' * 5000)
+
+    def test_skips_html(self):
+        '''Страницы админки с CSRF-токеном не сжимаются (BREACH)'''
+        from . import middleware
+        with mock.patch.object(middleware, 'COMPRESSION_MIN_SIZE', 0):
+            response = self.client.get('/admin/login/', HTTP_ACCEPT_ENCODING = 'gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('csrfmiddlewaretoken', response.content.decode())
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming_compressed_incrementally(self):
+        import zlib
+        from django.http import StreamingHttpResponse
+        from django.test import RequestFactory
+        from .middleware import CompressionMiddleware
+        chunks = [json.dumps({ 'id': number, 'name': 'Товар' * 50 }).encode() + b'\n' for number in range(5)]
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING = 'gzip')
+        response = CompressionMiddleware(lambda request: StreamingHttpResponse(iter(chunks), content_type = 'application/x-ndjson'))(request)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        '''Каждая часть распаковывается сразу, не дожидаясь конца потока'''
+        decompressor = zlib.decompressobj(31)
+        for chunk, compressed in zip(chunks, response.streaming_content):
+            self.assertEqual(decompressor.decompress(compressed), chunk)
+
+
+class CompressedCacheTest(TransactionTestCase):
+    fixtures = ['data.json']
+    serialized_rollback = True
+    databases = { 'default', 'replica' }
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_compressed_variant_cached(self):
+        from . import middleware
+        with mock.patch.object(middleware, 'COMPRESSION_MIN_SIZE', 0), mock.patch.object(middleware, 'compress', wraps = middleware.compress) as compress:
+            first = self.client.get('/api/products', HTTP_ACCEPT_ENCODING = 'gzip', **basic_auth())
+            second = self.client.get('/api/products', HTTP_ACCEPT_ENCODING = 'gzip', **basic_auth())
+            self.assertEqual(compress.call_count, 1)
+            self.assertEqual(first.content, second.content)
+
+            Product.objects.filter(id = 1).update(name = 'Samsung A52')
+            invalidate('products')
+            self.client.get('/api/products', HTTP_ACCEPT_ENCODING = 'gzip', **basic_auth())
+            self.assertEqual(compress.call_count, 2)
+
+
+class RateLimitTest(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        from .throttling import buckets
+        buckets.clear()
+        self.factory = RequestFactory()
+
+    def request(self, user = None, ip = '10.0.0.1'):
+        request = self.factory.get('/', REMOTE_ADDR = ip)
+        request.auth = user
+        return request
+
+    def test_token_bucket(self):
+        from . import throttling
+        now = [1000.0]
+        view = throttling.rate_limit('2/m')(lambda request: HttpResponse('ok'))
+        admin = User.objects.get(username = 'admin')
+        with mock.patch.object(throttling, 'buckets', throttling.MemoryBuckets(clock = lambda: now[0])):
+            self.assertEqual(view(self.request(admin)).status_code, 200)
+            self.assertEqual(view(self.request(admin)).status_code, 200)
+            response = view(self.request(admin))
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '30')
+            '''Другой пользователь получает свою корзину'''
+            self.assertEqual(view(self.request(User.objects.get(username = 'user1'))).status_code, 200)
+            '''Через 30 секунд в корзине снова есть токен'''
+            now[0] = 1030.0
+            self.assertEqual(view(self.request(admin)).status_code, 200)
+            self.assertEqual(view(self.request(admin)).status_code, 429)
+
+    def test_disabled_at_runtime(self):
+        from .throttling import rate_limit
+        view = rate_limit('1/m')(lambda request: HttpResponse('ok'))
+        with override_settings(RATE_LIMIT_ENABLED = False):
+            self.assertEqual([view(self.request()).status_code for _ in range(3)], [200] * 3)
+
+    def test_cache_backend(self):
+        from .throttling import CacheBuckets
+        buckets = CacheBuckets()
+        get_cache().clear()
+        self.assertEqual([buckets.take('test', 2, 1) == 0 for _ in range(3)], [True, True, False])
+
+    def test_disabled_in_settings(self):
+        from . import throttling
+        view = lambda request: HttpResponse('ok')
+        with mock.patch.object(throttling, 'RATE_LIMITS', { 'view': None }):
+            self.assertIs(throttling.rate_limit('1/m', scope = 'view')(view), view)
+
+    def test_registration_limited_by_ip(self):
+        statuses = []
+        for number in range(6):
+            response = self.client.post('/api/registration', {
+                'username': f'new{ number }', 'last_name': 'Иванов', 'first_name': 'Иван', 'email': f'new{ number }@example.com',
+                'password1': 'Password123', 'password2': 'Password123'
+            }, content_type = 'application/json', **basic_auth())
+            statuses.append(response.status_code)
+        self.assertEqual(statuses, [200] * 5 + [429])
+
+    def test_concurrency_limit(self):
+        from .throttling import concurrency_limit
+        entered, release = threading.Event(), threading.Event()
+
+        def slow(request):
+            entered.set()
+            release.wait(5)
+            return HttpResponse('ok')
+
+        view = concurrency_limit(1)(slow)
+        worker = threading.Thread(target = view, args = (self.request(), ))
+        worker.start()
+        entered.wait(5)
+        response = view(self.request())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        release.set()
+        worker.join()
+        self.assertEqual(view(self.request()).status_code, 200)
+        self.assertEqual(view.limiter.in_flight, 0)
+
+    def test_streaming_holds_slot(self):
+        from django.http import StreamingHttpResponse
+        from .throttling import concurrency_limit
+        view = concurrency_limit(1)(lambda request: StreamingHttpResponse(iter([b'a', b'b'])))
+        response = view(self.request())
+        self.assertEqual(view(self.request()).status_code, 503)
+        self.assertEqual(b''.join(response.streaming_content), b'ab')
+        self.assertEqual(view.limiter.in_flight, 0)
+
+        '''Закрытие ответа без чтения (разрыв соединения) тоже освобождает слот'''
+        from django.core.signals import request_finished
+        from django.db import close_old_connections
+        response = view(self.request())
+        request_finished.disconnect(close_old_connections)
+        try:
+            response.close()
+        finally:
+            request_finished.connect(close_old_connections)
+        self.assertEqual(view.limiter.in_flight, 0)
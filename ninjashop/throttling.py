@@ -0,0 +1,226 @@
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+
+'''memory — корзины в памяти процесса; cache — в кэше Django (общие для процессов при общем кэше)'''
+RATE_LIMIT_BACKEND = getattr(settings, 'RATE_LIMIT_BACKEND', 'memory')
+
+RATE_LIMIT_CACHE_ALIAS = getattr(settings, 'RATE_LIMIT_CACHE_ALIAS', 'default')
+
+'''Переопределение лимитов по имени операции: { 'registration_user': '5/m' }, None отключает лимит'''
+RATE_LIMITS = getattr(settings, 'RATE_LIMITS', {})
+
+CONCURRENCY_LIMITS = getattr(settings, 'CONCURRENCY_LIMITS', {})
+
+'''Число корзин в памяти; самые старые вытесняются, чтобы память не росла с числом клиентов'''
+RATE_LIMIT_MAX_KEYS = getattr(settings, 'RATE_LIMIT_MAX_KEYS', 10000)
+
+PERIODS = { 's': 1, 'm': 60, 'h': 3600, 'd': 86400 }
+
+
+def parse_rate(rate):
+    '''"60/m" -> (60 запросов, 1 токен в секунду)'''
+    count, period = rate.split('/')
+    return int(count), int(count) / PERIODS[period]
+
+
+def _refill(state, capacity, refill_rate, now):
+    '''Состояние корзины (токены, время) после запроса и сколько ждать, если токенов нет'''
+    tokens, updated = state if state else (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * refill_rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / refill_rate
+
+
+class MemoryBuckets:
+    def __init__(self, max_keys = RATE_LIMIT_MAX_KEYS, clock = time.monotonic):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.max_keys = max_keys
+        self.clock = clock
+
+    def take(self, key, capacity, refill_rate):
+        now = self.clock()
+        with self._lock:
+            state, retry_after = _refill(self._buckets.pop(key, None), capacity, refill_rate, now)
+            self._buckets[key] = state
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last = False)
+        return retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBuckets:
+    '''Чтение и запись без блокировки: при гонке между процессами лимит может быть превышен на единицы запросов'''
+    def take(self, key, capacity, refill_rate):
+        cache = caches[RATE_LIMIT_CACHE_ALIAS]
+        key = f'ninjashop:ratelimit:{ key }'
+        now = time.time()
+        state, retry_after = _refill(cache.get(key), capacity, refill_rate, now)
+        '''Через capacity / rate секунд корзина снова полная, хранить ее дольше незачем'''
+        cache.set(key, state, capacity / refill_rate)
+        return retry_after
+
+    def clear(self):
+        pass
+
+
+buckets = CacheBuckets() if RATE_LIMIT_BACKEND == 'cache' else MemoryBuckets()
+
+
+def client_key(request, key):
+    '''Пользователь, если запрос авторизован, иначе IP-адрес'''
+    user = getattr(request, 'auth', None)
+    if key == 'user' and getattr(user, 'pk', None) is not None:
+        return f'user:{ user.pk }'
+    return f'ip:{ request.META.get("REMOTE_ADDR", "") }'
+
+
+def too_many_requests(retry_after):
+    response = HttpResponse('Слишком много запросов! Повторите позже.', status = 429)
+    response['Retry-After'] = str(max(1, round(retry_after + 0.5)))
+    return response
+
+
+def rate_limit(rate, key = 'user', scope = None):
+    '''
+    Token bucket на операцию и клиента: rate вида '60/m' — емкость корзины и скорость пополнения.
+    key = 'user' — по пользователю (без авторизации по IP), 'ip' — всегда по IP.
+    Лимит можно переопределить в настройке RATE_LIMITS по имени операции
+    '''
+    def decorator(view_func):
+        name = scope or view_func.__name__
+        configured = RATE_LIMITS.get(name, rate)
+        if configured is None:
+            return view_func
+        capacity, refill_rate = parse_rate(configured)
+
+        def check(request):
+            '''Настройка читается при каждом запросе, чтобы ее можно было выключить через override_settings'''
+            if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+                return None
+            retry_after = buckets.take(f'{ name }:{ client_key(request, key) }', capacity, refill_rate)
+            return too_many_requests(retry_after) if retry_after else None
+
+        if inspect.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapped_view(request, *args, **kwargs):
+                return check(request) or await view_func(request, *args, **kwargs)
+            return async_wrapped_view
+
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            return check(request) or view_func(request, *args, **kwargs)
+        return wrapped_view
+    return decorator
+
+
+class ConcurrencyLimiter:
+    '''Счетчик выполняющихся запросов операции в процессе'''
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+class ReleasingIterator:
+    '''
+    Потоковый ответ занимает слот, пока не передан до конца или не закрыт (разрыв соединения).
+    Django вызывает close() при закрытии ответа, даже если поток не начинали читать
+    '''
+    def __init__(self, content, limiter):
+        self.content = iter(content)
+        self.limiter = limiter
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.content)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.limiter.release()
+            if hasattr(self.content, 'close'):
+                self.content.close()
+
+
+def service_unavailable():
+    response = HttpResponse('Сервер перегружен, повторите запрос позже!', status = 503)
+    response['Retry-After'] = '1'
+    return response
+
+
+def concurrency_limit(limit, scope = None):
+    '''
+    Сброс нагрузки: если операция уже выполняет limit запросов, новые сразу получают 503,
+    а не ждут в очереди, поэтому задержка принятых запросов остается ограниченной
+    '''
+    def decorator(view_func):
+        name = scope or view_func.__name__
+        configured = CONCURRENCY_LIMITS.get(name, limit)
+        if configured is None:
+            return view_func
+        limiter = ConcurrencyLimiter(configured)
+
+        def finish(response):
+            if getattr(response, 'streaming', False) and not response.is_async:
+                response.streaming_content = ReleasingIterator(response.streaming_content, limiter)
+            else:
+                limiter.release()
+            return response
+
+        if inspect.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapped_view(request, *args, **kwargs):
+                if not limiter.acquire():
+                    return service_unavailable()
+                try:
+                    response = await view_func(request, *args, **kwargs)
+                except BaseException:
+                    limiter.release()
+                    raise
+                return finish(response)
+            async_wrapped_view.limiter = limiter
+            return async_wrapped_view
+
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            if not limiter.acquire():
+                return service_unavailable()
+            try:
+                response = view_func(request, *args, **kwargs)
+            except BaseException:
+                limiter.release()
+                raise
+            return finish(response)
+        wrapped_view.limiter = limiter
+        return wrapped_view
+    return decorator